@@ -1,8 +1,9 @@
 #!/usr/bin/python
-
-import daemonize
-import config
-import poll
+#
+# NOTE: submodules are not imported here; importing the package must not
+# pull in daemon's dependencies (liblognorm, yaml), so applications can use
+# logdevd.shmring.Producer without them
+#
 
 #-----------------------------------------------------------------------------
 # vim:ft=python
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+'''
+asyncio runtime
+---------------
+
+Alternative to the poll loop of the daemon (``--runtime=asyncio``, Python
+3.5 or newer), for comparing latency under many concurrent connections. The
+daemon, its sources, destinations and configuration stay the same; only the
+thing that drives them changes:
+
+   * socket sources are watched with :meth:`loop.add_reader()`, and a source
+     that became readable is processed in the callback
+   * plain files, which can't be polled, are tailed by a periodic callback,
+     which also reopens rotated files and retries missing ones
+   * destinations with data waiting for their sockets are watched with
+     :meth:`loop.add_writer()`, so the back-pressure of a slow receiver
+     works the same as in the poll loop
+
+Normalization runs inline, in the loop's thread. Signals are handled by the
+loop, so a reload never happens in the middle of processing a source.
+
+The module doesn't use ``async``/``await`` syntax, so the package still
+byte-compiles on Python 2, where this runtime is not available.
+
+.. autofunction:: run
+
+.. autoclass:: Runtime
+   :members:
+
+'''
+#-----------------------------------------------------------------------------
+
+import asyncio
+import os
+import signal
+
+#-----------------------------------------------------------------------------
+
+class Runtime:
+    '''
+    Read-parse-send cycle of a daemon, driven by an :mod:`asyncio` event
+    loop.
+    '''
+
+    # how often files are tailed and missing sources are checked, the same
+    # as poll timeout in the poll loop
+    TICK = 0.25 # seconds
+    SIGNALS = [signal.SIGHUP, signal.SIGINT, signal.SIGTERM,
+               signal.SIGUSR1, signal.SIGUSR2]
+
+    def __init__(self, daemon, exit_on_eof = False):
+        '''
+        :param daemon: ``Daemon`` instance from :file:`bin/logdevd`
+        :param exit_on_eof: stop when all the sources are closed
+        '''
+        self.daemon = daemon
+        self.exit_on_eof = exit_on_eof
+        self.loop = None
+        self.finished = None
+        # (descriptor, device, inode) -> source watched with add_reader()
+        self.readers = {}
+        # destination -> (descriptor, device, inode) watched with add_writer()
+        self.writers = {}
+        # sources to process in the next step
+        self.ready = []
+        self.step_scheduled = False
+        self.tick_handle = None
+
+    def run(self):
+        '''
+        Run the loop until all the sources are closed (when *exit_on_eof* was
+        set) or until a signal terminates the daemon.
+        '''
+        self.loop = asyncio.new_event_loop()
+        self.finished = self.loop.create_future()
+        # restored when the loop is done, for the final flush
+        handlers = dict((s, signal.getsignal(s)) for s in Runtime.SIGNALS)
+        for signum in Runtime.SIGNALS:
+            self.loop.add_signal_handler(signum, self._signal, signum)
+        try:
+            self._watch()
+            self._tick()
+            self.loop.run_until_complete(self.finished)
+        finally:
+            if self.tick_handle is not None:
+                self.tick_handle.cancel()
+            for (signum, handler) in handlers.items():
+                self.loop.remove_signal_handler(signum)
+                signal.signal(signum, handler)
+            self.loop.close()
+
+    def _signal(self, signum):
+        # signals are delivered between steps, so the handoff can be done
+        # right away; reload and handoff replace the sources
+        self.daemon.sighandler(signum, None)
+        self.daemon.handoff_if_requested()
+        self._watch()
+
+    def _readable(self, source):
+        if source not in self.ready:
+            self.ready.append(source)
+        self._schedule()
+
+    def _writable(self, destination):
+        destination.writable()
+        self._watch()
+
+    def _schedule(self):
+        # readiness of several sources is handled in a single step
+        if not self.step_scheduled:
+            self.step_scheduled = True
+            self.loop.call_soon(self._step)
+
+    def _tick(self):
+        self.daemon.reopen_sources_if_necessary()
+        for source in self.daemon.unpollable_opened_sources:
+            self._readable(source)
+        # even with nothing to read, coalesced lines expire and batches in
+        # destinations are due
+        self._schedule()
+        self.tick_handle = self.loop.call_later(Runtime.TICK, self._tick)
+
+    def _step(self):
+        self.step_scheduled = False
+        daemon = self.daemon
+        (ready, self.ready) = (self.ready, [])
+        # sources that have lines left over from the previous step
+        pending = [s for s in daemon.sources if s.pending() and s not in ready]
+        for source in ready + pending:
+            daemon.process(source)
+        daemon.flush_coalesced()
+        daemon.report_suppressed()
+        daemon.dispatch_queued()
+        daemon.flush_destinations()
+        self._watch()
+        if self.exit_on_eof and daemon.filecount() == 0:
+            if not self.finished.done():
+                self.finished.set_result(None)
+            return
+        if any(s.pending() for s in daemon.sources) or \
+           (daemon.scheduler is not None and daemon.scheduler.pending()):
+            self._schedule()
+
+    def _watch(self):
+        # sources come and go on reload and reopen, and destinations'
+        # descriptors change on reconnection; a descriptor is identified by
+        # its inode too, since a new socket often gets the number of the one
+        # just closed, and the closed one is no longer watched by the kernel
+        sources = dict(
+            (_identity(s.fileno()), s) for s in self.daemon.poll_h.handles()
+        )
+        destinations = dict(
+            (d, _identity(d.fileno())) for d in self.daemon.destinations
+            if d.fileno() is not None
+        )
+        # stale descriptors go first, as their numbers may be reused already
+        for (key, source) in list(self.readers.items()):
+            if sources.get(key) is not source:
+                self.loop.remove_reader(key[0])
+                del self.readers[key]
+        for (d, key) in list(self.writers.items()):
+            if destinations.get(d) != key:
+                self.loop.remove_writer(key[0])
+                del self.writers[d]
+        for (key, source) in sources.items():
+            if key not in self.readers:
+                self.loop.add_reader(key[0], self._readable, source)
+                self.readers[key] = source
+        for (d, key) in destinations.items():
+            if d not in self.writers:
+                self.loop.add_writer(key[0], self._writable, d)
+                self.writers[d] = key
+
+#-----------------------------------------------------------------------------
+
+def _identity(fd):
+    stat = os.fstat(fd)
+    return (fd, stat.st_dev, stat.st_ino)
+
+def run(daemon, exit_on_eof = False):
+    '''
+    :param daemon: ``Daemon`` instance from :file:`bin/logdevd`
+    :param exit_on_eof: stop when all the sources are closed
+
+    Counterpart of ``Daemon.run()``: run the read-parse-send cycle in an
+    :mod:`asyncio` loop, and flush what's left on exit.
+    '''
+    try:
+        Runtime(daemon, exit_on_eof).run()
+    except SystemExit:
+        # terminating on signal; don't lose lines held for coalescing or
+        # batched in destinations
+        daemon.flush_coalesced(force = True)
+        daemon.close_destinations()
+        raise
+    daemon.flush_coalesced(force = True)
+    daemon.close_destinations()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+'''
+Coalescing repeated lines
+-------------------------
+
+Some daemons log the same line over and over again. Runs of identical
+consecutive lines can be collapsed into a single line (and then a single
+message) with a repeat count, so the line is normalized and sent only once.
+
+.. autoclass:: Coalescer
+   :members:
+
+'''
+#-----------------------------------------------------------------------------
+
+from . import stats
+
+#-----------------------------------------------------------------------------
+
+class Coalescer:
+    '''
+    Coalescer of identical consecutive lines from a single source. A line is
+    held until a different line arrives or until maximum hold time passes,
+    whichever comes first.
+
+    Runs are returned as tuples ``(line, count, first, last)``, where
+    *first* and *last* are times (epoch) when the first and the last line of
+    the run arrived.
+    '''
+
+    def __init__(self, max_hold = 1.0):
+        '''
+        :param max_hold: maximum time (seconds) to hold a line
+        '''
+        self.max_hold = max_hold
+        self.line = None
+        self.hash = None
+        self.count = 0
+        self.first = None
+        self.last = None
+
+    def feed(self, line, now):
+        '''
+        :param line: log line
+        :param now: current time (epoch)
+        :return: list of runs to process
+
+        Add a line to the current run or start a new one.
+        '''
+        line_hash = hash(line)
+        if self.line is not None and line_hash == self.hash and \
+           line == self.line:
+            self.count += 1
+            self.last = now
+            stats.registry.incr("coalesce.repeated")
+            return self.expire(now)
+        result = self.expire(now, force = True)
+        self.line = line
+        self.hash = line_hash
+        self.count = 1
+        self.first = now
+        self.last = now
+        return result
+
+    def expire(self, now, force = False):
+        '''
+        :param now: current time (epoch)
+        :param force: return the held run regardless of its age
+        :return: list of runs to process
+
+        Return the held run if it's held for too long already.
+        '''
+        if self.line is None:
+            return []
+        if not force and now - self.first < self.max_hold:
+            return []
+        result = [(self.line, self.count, self.first, self.last)]
+        self.line = None
+        self.hash = None
+        return result
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
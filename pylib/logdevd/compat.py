@@ -0,0 +1,79 @@
+#!/usr/bin/python
+'''
+Python 2/3 compatibility
+------------------------
+
+*logdevourer* runs on both Python 2 and Python 3. Log lines are byte
+strings all the way from sources (:obj:`str` in Python 2, :obj:`bytes` in
+Python 3) through filtering, rate limiting and coalescing, up to
+normalization, where a sanitized line is decoded once (:func:`to_str`) for
+liblognorm. Serialized messages are byte strings again (see
+:mod:`logdevd.formats`), so destinations write them as they are.
+
+.. autofunction:: to_bytes
+
+.. autofunction:: to_str
+
+.. autofunction:: binary_stream
+
+'''
+#-----------------------------------------------------------------------------
+
+import sys
+
+PY3 = (sys.version_info[0] >= 3)
+
+if PY3:
+    import queue
+    string_types = (str,)
+    integer_types = (int,)
+else:
+    import Queue as queue
+    string_types = (str, unicode)
+    integer_types = (int, long)
+
+#-----------------------------------------------------------------------------
+
+def to_bytes(data, encoding = "utf-8"):
+    '''
+    :param data: byte string or text
+    :param encoding: encoding to use for text
+    :return: byte string
+
+    Encode text to a byte string. Byte strings are returned unchanged.
+    '''
+    if isinstance(data, bytes):
+        return data
+    return data.encode(encoding)
+
+if PY3:
+    def to_str(data, encoding = "utf-8"):
+        '''
+        :param data: byte string or text
+        :param encoding: encoding of *data*, if it's a byte string
+        :return: native string (:obj:`str`)
+
+        Convert data to interpreter's native string type. Invalid bytes are
+        replaced.
+        '''
+        if isinstance(data, bytes):
+            return data.decode(encoding, "replace")
+        return data
+else:
+    def to_str(data, encoding = "utf-8"):
+        if isinstance(data, unicode):
+            return data.encode("utf-8")
+        return data
+
+def binary_stream(fh):
+    '''
+    :param fh: file handle (e.g. :obj:`sys.stdout`)
+    :return: file handle accepting byte strings
+
+    Get the binary handle underlying a text file handle (Python 3), or the
+    handle itself (Python 2).
+    '''
+    return getattr(fh, "buffer", fh)
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
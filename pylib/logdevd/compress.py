@@ -0,0 +1,98 @@
+#!/usr/bin/python
+'''
+Stream compression
+------------------
+
+Compression of data sent over a stream (TCP) destination. Data is compressed
+in blocks (batches of messages), and each block is flushed completely, so
+the receiver can decompress everything it has got so far. The blocks form
+a single stream that can be decompressed with standard tools.
+
+Supported codecs:
+
+   * ``"zlib"`` -- zlib stream (:rfc:`1950`)
+   * ``"gzip"`` -- gzip stream (:rfc:`1952`)
+   * ``"lz4"`` -- concatenated LZ4 frames; requires *lz4* module
+
+A new stream is started after each reconnection (:meth:`Compressor.reset`).
+
+.. autoclass:: Compressor
+   :members:
+
+'''
+#-----------------------------------------------------------------------------
+
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+CODECS = ["zlib", "gzip", "lz4"]
+
+def available(codec):
+    '''
+    :param codec: name of the codec
+    :return: ``True`` or ``False``
+
+    Check if the codec can be used (its module is installed).
+    '''
+    if codec == "lz4":
+        return (lz4 is not None)
+    return (codec in CODECS)
+
+#-----------------------------------------------------------------------------
+
+class Compressor:
+    '''
+    Compressor of a data stream, working in blocks.
+    '''
+
+    # wbits for zlib.compressobj()
+    WBITS = {
+        "zlib": zlib.MAX_WBITS,
+        "gzip": zlib.MAX_WBITS | 16,
+    }
+
+    def __init__(self, codec, level = None):
+        '''
+        :param codec: name of the codec (one of :obj:`CODECS`)
+        :param level: compression level (codec's default if ``None``)
+        '''
+        if not available(codec):
+            raise ValueError("compression codec unavailable: %s" % (codec,))
+        self.codec = codec
+        self.level = level
+        self._stream = None
+        self.reset()
+
+    def reset(self):
+        '''
+        Start a new compressed stream.
+        '''
+        if self.codec == "lz4":
+            return # each block is a separate frame
+        if self.level is None:
+            level = zlib.Z_DEFAULT_COMPRESSION
+        else:
+            level = self.level
+        self._stream = zlib.compressobj(level, zlib.DEFLATED,
+                                        Compressor.WBITS[self.codec])
+
+    def compress(self, data):
+        '''
+        :param data: uncompressed block
+        :return: compressed block
+
+        Compress a block of data. The returned block can be decompressed
+        without waiting for the following blocks.
+        '''
+        if self.codec == "lz4":
+            if self.level is None:
+                return lz4.frame.compress(data)
+            return lz4.frame.compress(data, compression_level = self.level)
+        return self._stream.compress(data) + self._stream.flush(zlib.Z_SYNC_FLUSH)
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
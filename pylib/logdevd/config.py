@@ -1,12 +1,43 @@
 #!/usr/bin/python
 
 import yaml
-import liblognorm
 
 import sys
+import time
 
-import sources
-import destinations
+from . import compat
+from . import sources
+from . import destinations
+from . import rulebase
+from . import ratelimit
+from . import coalesce
+from . import enrich
+from . import filters
+from . import routing
+from . import priority
+from . import formats
+from . import shmring
+
+#-----------------------------------------------------------------------------
+
+# options that can be set globally and overridden for a single source
+SOURCE_OPTIONS = {
+    "rulebase": None,
+    "shard_rulebase": False,
+    "format": "lognorm",
+    "keep_original": False,
+    "send_unparsed": True,
+    "log_unparsed": False,
+    "json_passthrough": False,
+    "rate_limit": None,
+    "coalesce": False,
+    "filters": None,
+    "enrich": None,
+    "priority": None,
+}
+
+# how the log lines from a source are turned into messages
+SOURCE_FORMATS = ["lognorm", "json", "raw"]
 
 #-----------------------------------------------------------------------------
 
@@ -15,17 +46,61 @@ def sources_stdio():
     stdout = destinations.STDOUTDestination()
     return ([stdin], [stdout])
 
+def parse_endpoint(endpoint):
+    # {"host": ..., "port": ...} or "host:port" ("[address]:port" for IPv6)
+    if isinstance(endpoint, dict):
+        return (endpoint["host"], int(endpoint["port"]))
+    (host, port) = str(endpoint).rsplit(":", 1)
+    if host.startswith("[") and host.endswith("]"):
+        host = host[1:-1]
+    return (host, int(port))
+
+def pack_options(dest_def):
+    pack = dest_def.get("pack")
+    if pack is True:
+        return {}
+    if pack is False:
+        return None
+    if isinstance(pack, compat.integer_types):
+        return {"size": pack}
+    return pack
+
 def sources_load(source_defs, dest_defs, state_dir):
     cf_sources = []
     for src in source_defs:
-        if type(src) in [str, unicode]:
+        if isinstance(src, compat.string_types):
             new_source = sources.FileSource(src, state_dir)
+        elif src["proto"] == "file":
+            new_source = sources.FileSource(
+                src["path"], state_dir,
+                rotate_grace = src.get("rotate_grace"),
+            )
         elif src["proto"] == "udp":
             # XXX: no state directory needed
             new_source = sources.UDPSource(src.get("host"), int(src["port"]))
-        elif src["proto"] == "unix":
+        elif src["proto"] == "tcp":
+            # XXX: no state directory needed
+            new_source = sources.TCPSource(
+                src.get("host"), int(src["port"]),
+                framing = src.get("framing", "auto"),
+                max_message_size = int(src.get("max_message_size", 65536)),
+            )
+        elif src["proto"] == "unix" and src.get("type", "dgram") == "stream":
+            # XXX: no state directory needed
+            new_source = sources.UNIXStreamSource(
+                src["path"],
+                framing = src.get("framing", "auto"),
+                max_message_size = int(src.get("max_message_size", 65536)),
+            )
+        elif src["proto"] == "unix" and src.get("type", "dgram") == "dgram":
             # XXX: no state directory needed
             new_source = sources.UNIXSource(src["path"])
+        elif src["proto"] == "shm":
+            new_source = sources.ShmRingSource(
+                src["path"],
+                src.get("doorbell"),
+                int(src.get("size", shmring.CAPACITY)),
+            )
         elif src["proto"] == "stdin":
             # XXX: no state directory needed
             new_source = sources.FileHandleSource(sys.stdin)
@@ -35,35 +110,186 @@ def sources_load(source_defs, dest_defs, state_dir):
 
     cf_destinations = []
     for dest in dest_defs:
-        if dest in ["stdout", "STDOUT"] or dest["proto"] == "stdout":
-            new_dest = destinations.STDOUTDestination()
+        if dest in ["stdout", "STDOUT"]:
+            dest = {"proto": "stdout"}
+        fmt = dest.get("format", "json")
+        if fmt not in formats.FORMATS:
+            raise ValueError("unrecognized output format: %s" % (fmt,))
+        if dest["proto"] == "stdout":
+            new_dest = destinations.STDOUTDestination(fmt)
         elif dest["proto"] == "tcp":
-            new_dest = destinations.TCPDestination(dest["host"], int(dest["port"]))
+            compression = dest.get("compress")
+            if compression is True:
+                compression = {}
+            elif compression is False:
+                compression = None
+            elif isinstance(compression, compat.string_types):
+                compression = {"codec": compression}
+            batch = dest.get("batch")
+            if batch is True:
+                batch = {}
+            elif batch is False:
+                batch = None
+            ack = dest.get("ack")
+            if ack is True:
+                ack = {}
+            elif ack is False:
+                ack = None
+            if "endpoints" in dest:
+                endpoints = [parse_endpoint(e) for e in dest["endpoints"]]
+            else:
+                endpoints = [(dest["host"], int(dest["port"]))]
+            new_dest = destinations.TCPDestination(
+                endpoints, fmt,
+                batch = batch, compression = compression,
+                balance = dest.get("balance", "round-robin"),
+                eject_after = dest.get("eject_after"),
+                probe_interval = dest.get("probe_interval"),
+                resolve_interval = dest.get("resolve_interval"),
+                ack = ack,
+                queue_size = dest.get("queue_size"),
+            )
         elif dest["proto"] == "udp":
-            new_dest = destinations.UDPDestination(dest["host"], int(dest["port"]))
+            new_dest = destinations.UDPDestination(
+                dest["host"], int(dest["port"]), fmt,
+                pack = pack_options(dest),
+            )
+        elif dest["proto"] == "file":
+            new_dest = destinations.FileDestination(
+                dest["path"], fmt,
+                buffer_size = dest.get("buffer_size"),
+                fsync_interval = dest.get(
+                    "fsync_interval",
+                    destinations.FileDestination.FSYNC_INTERVAL,
+                ),
+                rotate_size = dest.get("rotate_size"),
+                rotate_interval = dest.get("rotate_interval"),
+                compress = dest.get("compress", False),
+            )
+        elif dest["proto"] == "unix" and \
+             dest.get("type", "dgram") in ["stream", "seqpacket"]:
+            new_dest = destinations.UNIXStreamDestination(
+                dest["path"], dest["type"], fmt,
+                queue_size = dest.get("queue_size"),
+                overflow = dest.get("overflow", "drop-new"),
+            )
         elif dest["proto"] == "unix":
             retry = dest.get("retry", True)
-            new_dest = destinations.UNIXDestination(dest["path"], retry)
+            new_dest = destinations.UNIXDestination(
+                dest["path"], retry, fmt,
+                pack = pack_options(dest),
+            )
         else:
             raise ValueError("unrecognized destination: %s" % (str(dest)))
         cf_destinations.append(new_dest)
 
     return (cf_sources, cf_destinations)
 
-def load(config_file, state_dir, stdio_only = False):
+def source_options(source, source_def, global_options, rulebases):
+    options = {}
+    for (name, default) in SOURCE_OPTIONS.items():
+        if isinstance(source_def, dict) and name in source_def:
+            options[name] = source_def[name]
+        else:
+            options[name] = global_options.get(name, default)
+
+    if options["format"] not in SOURCE_FORMATS:
+        raise ValueError("unrecognized source format: %s" % (options["format"]))
+    if options["format"] == "lognorm":
+        if options["rulebase"] is None:
+            raise ValueError("no rulebase for source: %s" % (str(source_def)))
+        # sources with the same rulebase share the normalizer
+        options["lognorm"] = rulebases.load(
+            options["rulebase"],
+            sharded = options["shard_rulebase"],
+        )
+    else:
+        options["lognorm"] = None
+    if options["rate_limit"] is not None:
+        options["rate_limiter"] = ratelimit.RateLimiter(
+            options["rate_limit"], time.time(),
+        )
+    else:
+        options["rate_limiter"] = None
+    if options["filters"]:
+        options["filter"] = filters.FilterSet(options["filters"])
+    else:
+        options["filter"] = None
+    if isinstance(options["coalesce"], dict):
+        options["coalescer"] = coalesce.Coalescer(
+            float(options["coalesce"].get("max_hold", 1.0)),
+        )
+    elif options["coalesce"]:
+        options["coalescer"] = coalesce.Coalescer()
+    else:
+        options["coalescer"] = None
+    if options["enrich"]:
+        options["enricher"] = enrich.Enricher(options["enrich"], str(source))
+    else:
+        options["enricher"] = None
+    return options
+
+def load(config_file, state_dir, stdio_only = False, archives = None,
+         rulebases = None):
+    if rulebases is None:
+        rulebases = rulebase.RulebaseCache()
+
     with open(config_file) as cf:
         configuration = yaml.safe_load(cf)
 
     if stdio_only:
         (src, dest) = sources_stdio()
+    elif archives is not None:
+        # sources are replaced anyway, so don't create them (file sources
+        # would create their position files)
+        dest_defs = configuration["destinations"]
+        (src, dest) = sources_load([], dest_defs, None)
     else:
         source_defs = configuration["sources"]
         dest_defs = configuration["destinations"]
         (src, dest) = sources_load(source_defs, dest_defs, state_dir)
 
-    lognorm = liblognorm.Lognorm(configuration["options"]["rulebase"])
+    # routes refer to destinations from config, so they make no sense with
+    # STDOUT as the only destination
+    if not stdio_only and configuration.get("routes") is not None:
+        named_dest = dict(
+            (d["name"], new_dest)
+            for (d, new_dest) in zip(dest_defs, dest)
+            if isinstance(d, dict) and "name" in d
+        )
+        router = routing.Router(configuration["routes"], named_dest)
+    else:
+        router = None
+
+    # priority lanes are ignored in STDIN/STDOUT mode, like routes
+    priorities_def = configuration.get("priorities")
+    if not stdio_only and priorities_def is not None:
+        scheduler = priority.Scheduler(priorities_def, dest, state_dir)
+    else:
+        scheduler = None
+
+    if archives is not None:
+        src = [sources.ArchiveSource(a) for a in archives]
+
+    # sources that replaced the ones from config only use global options
+    if stdio_only or archives is not None:
+        source_defs = [None] * len(src)
+
+    global_options = configuration.get("options") or {}
+    for (source, source_def) in zip(src, source_defs):
+        source.options = source_options(
+            source, source_def, global_options, rulebases,
+        )
+        if source.options["priority"] is None:
+            continue
+        if priorities_def is None:
+            raise ValueError("priority set, but no priorities defined")
+        if scheduler is not None and \
+           source.options["priority"] not in scheduler.lanes:
+            raise ValueError("unknown priority class: %s" %
+                             (source.options["priority"],))
 
-    return (src, dest, lognorm, configuration)
+    return (src, dest, router, scheduler, configuration)
 
 #-----------------------------------------------------------------------------
 # vim:ft=python
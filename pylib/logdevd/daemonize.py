@@ -17,6 +17,8 @@ import time
 import traceback
 import tempfile
 
+from . import compat
+
 #-----------------------------------------------------------------------------
 
 PARENT = 1
@@ -38,7 +40,7 @@ class PidFile:
         '''
         if filename is not None:
             self.filename = os.path.abspath(filename)
-            self.fd = open(self.filename, 'w', 0) # TODO: atomic create-or-fail
+            self.fd = open(self.filename, 'w') # TODO: atomic create-or-fail
         else:
             self.filename = None
             self.fd = None
@@ -63,12 +65,13 @@ class PidFile:
         self.fd.seek(0)
         self.fd.write("%d\n" % (self.pid))
         self.fd.truncate()
+        self.fd.flush()
 
     def close(self):
         '''
         Close pid file *without* removing it.
         '''
-        if self.fd is not None:
+        if self.fd is None:
             return
         self.fd.close()
         self.fd = None
@@ -184,9 +187,10 @@ def exception_logger(exctype, value, tb):
         dir = dump_dir, text = True,
     )
 
-    os.write(fd, "### @%d PID=%d\n" % (time.time(), os.getpid()))
+    header = "### @%d PID=%d\n" % (time.time(), os.getpid())
+    os.write(fd, compat.to_bytes(header))
     for line in traceback.format_exception(exctype, value, tb):
-        os.write(fd, line)
+        os.write(fd, compat.to_bytes(line))
     os.close(fd)
 
 #-----------------------------------------------------------------------------
@@ -1,89 +1,704 @@
 #!/usr/bin/python
 #
-# NOTE: all these destination types are JSON-per-line based (EOL markers will
-# be added as necessary)
+# NOTE: destinations get messages already serialized in their format (see
+# formats.py); stream destinations add end markers or length prefixes as
+# necessary
 #
 
 import socket
+import errno
+import select
+import fcntl
+import termios
+import struct
+import logging
+import collections
+import threading
+import gzip
+import os
+import re
 import time
 import sys
+from . import compat
+from . import formats
+from . import stats
+from . import compress
+from . import mmsg
 
 #-----------------------------------------------------------------------------
 
-class STDOUTDestination:
+class Destination(object):
+    # serialization format of messages passed to send() (see formats.py)
+    format = "json"
+
     def send(self, line):
-        sys.stdout.write(line + "\n")
-        sys.stdout.flush()
+        raise NotImplementedError()
+
+    def flush(self, force = False):
+        # called periodically from the main loop, and with `force' set before
+        # the destination is discarded or the daemon terminates
+        pass
+
+    def close(self):
+        # called after the final flush(force = True)
+        pass
+
+    def fileno(self):
+        # descriptor to watch for being writable, for destinations that don't
+        # block the main loop; None if the destination has nothing to write
+        return None
+
+    def writable(self):
+        # called when the descriptor from fileno() became writable
+        pass
 
 #-----------------------------------------------------------------------------
 
-class TCPDestination:
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
-        self.sock = None
+class STDOUTDestination(Destination):
+    def __init__(self, format = "json"):
+        self.format = format
+        self.stream = compat.binary_stream(sys.stdout)
 
-    def _disconnect(self):
-        if self.sock is not None:
-            self.sock.close()
+    def send(self, line):
+        self.stream.write(formats.frame(line, self.format))
+        self.stream.flush()
+
+#-----------------------------------------------------------------------------
+
+class TCPDestination(Destination):
+    BATCH_SIZE = 64 * 1024
+    BATCH_INTERVAL = 1.0
+    BALANCE = ["round-robin", "least-outstanding"]
+    EJECT_AFTER = 3 # consecutive failures
+    PROBE_INTERVAL = 5.0
+    RESOLVE_INTERVAL = 60.0
+    CONNECT_TIMEOUT = 5.0
+    # first reconnection delay for a connection that is not ejected; doubled
+    # with each failure, up to probe interval
+    RECONNECT_DELAY = 0.1
+    QUEUE_SIZE = 16 * 1024 * 1024 # bytes
+    DRAIN_TIMEOUT = 5.0
+    ACK_WINDOW = 64 # batches
+    ACK_TIMEOUT = 30.0
+    ACK_FRAME = ">QI" # sequence number, payload length
+    ACK_SIZE = 8 # sequence number of the last frame received
+
+    class Connection: # {{{
+        # connection to a single resolved address of an endpoint
+        def __init__(self, host, port, family, address, compression, ack):
+            self.host = host
+            self.port = port
+            self.family = family
+            self.address = address
             self.sock = None
+            # socket with non-blocking connect() in progress
+            self.connecting = None
+            self.connect_started = None
+            if compression is not None:
+                self.compressor = compress.Compressor(
+                    compression.get("codec", "zlib"),
+                    compression.get("level"),
+                )
+            else:
+                self.compressor = None
+            self.failures = 0
+            self.ejected_until = None # None means healthy
+            self.retry_at = 0 # next connection attempt (healthy connection)
+            # ack: None or (window size, timeout)
+            self.ack = ack
+            self.window = collections.deque() # (seq, block, time sent)
+            self.ack_buffer = b""
 
-    def _connect(self):
-        def try_connect():
+        def __str__(self):
+            return "%s:%d (%s)" % (self.host, self.port, self.address[0])
+
+        def start_connect(self):
+            # non-blocking connect(), finished in check_connect(), so a dead
+            # endpoint doesn't hold the main loop
+            sock = socket.socket(self.family, socket.SOCK_STREAM)
+            sock.setblocking(0)
+            err = sock.connect_ex(self.address)
+            if err not in (0, errno.EINPROGRESS):
+                sock.close()
+                return False
+            self.connecting = sock
+            self.connect_started = time.time()
+            return True
+
+        def check_connect(self):
+            # returns True (connected), False (failed), or None (in progress)
+            (_r, writable, _x) = select.select([], [self.connecting], [], 0)
+            if len(writable) > 0:
+                err = self.connecting.getsockopt(socket.SOL_SOCKET,
+                                                 socket.SO_ERROR)
+            elif time.time() - self.connect_started < \
+                 TCPDestination.CONNECT_TIMEOUT:
+                return None
+            else:
+                err = errno.ETIMEDOUT
+            sock = self.connecting
+            self.connecting = None
+            if err != 0:
+                sock.close()
+                return False
+            sock.setblocking(1)
+            self.disconnect()
+            self.sock = sock
+            self.ack_buffer = b""
+            if self.compressor is not None:
+                # the other end expects a fresh stream on a new connection
+                self.compressor.reset()
+            return True
+
+        def disconnect(self):
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+        def close(self):
+            self.disconnect()
+            if self.connecting is not None:
+                self.connecting.close()
+                self.connecting = None
+
+        def send(self, block, seq = None):
+            # returns number of bytes written to the socket or None on error
+            # (in the latter case caller should take_window())
+            if self.sock is None:
+                return None
+            if self.ack is not None and not self._wait_for_window():
+                return None
+            if self.compressor is not None:
+                data = self.compressor.compress(block)
+            else:
+                data = block
+            if self.ack is not None:
+                data = struct.pack(TCPDestination.ACK_FRAME, seq, len(data)) + \
+                       data
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((self.host, self.port))
-                return sock
+                self.sock.sendall(data)
             except socket.error:
+                self.disconnect()
                 return None
+            if self.ack is not None:
+                self.window.append((seq, block, time.time()))
+            return len(data)
 
-        self._disconnect()
-        self.sock = try_connect()
+        def _wait_for_window(self):
+            (size, timeout) = self.ack
+            while True:
+                if not self.read_acks():
+                    return False
+                if len(self.window) < size:
+                    return True
+                # read_acks() will notice if this times out
+                select.select([self.sock], [], [], timeout)
 
-        while self.sock is None:
-            time.sleep(0.1)
-            self.sock = try_connect()
+        def read_acks(self):
+            # read acks that have arrived, without blocking; returns False if
+            # the connection broke or the oldest frame waits for its ack for
+            # too long
+            if self.sock is None:
+                return (len(self.window) == 0)
+            while True:
+                try:
+                    data = self.sock.recv(4096, socket.MSG_DONTWAIT)
+                except socket.error as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        break
+                    self.disconnect()
+                    return False
+                if data == b"":
+                    self.disconnect()
+                    return False
+                self.ack_buffer += data
+            ack_size = TCPDestination.ACK_SIZE
+            while len(self.ack_buffer) >= ack_size:
+                (seq,) = struct.unpack(">Q", self.ack_buffer[:ack_size])
+                self.ack_buffer = self.ack_buffer[ack_size:]
+                self._acknowledge(seq)
+            (_size, timeout) = self.ack
+            if len(self.window) > 0 and \
+               time.time() - self.window[0][2] > timeout:
+                self.disconnect()
+                return False
+            return True
 
-    def send(self, line):
-        line += "\n"
+        def _acknowledge(self, seq):
+            # ack for a frame confirms all the frames sent before it
+            if seq not in [s for (s, _block, _sent) in self.window]:
+                return # duplicate or bogus ack
+            while self.window.popleft()[0] != seq:
+                pass
 
-        # on error, disconnect and try to reconnect
-        # FIXME: on broken connection (even to localhost) one line will most
-        # probably be lost, but I don't see what could I do to prevent this
-        # happening
-        while True:
+        def take_window(self):
+            # unacknowledged batches, to be sent again
+            blocks = [(seq, block) for (seq, block, _sent) in self.window]
+            self.window.clear()
+            return blocks
+
+        def outstanding(self):
+            # bytes in socket's send queue, not acknowledged by the peer yet
             if self.sock is None:
-                self._connect()
+                return 0
+            try:
+                buf = fcntl.ioctl(self.sock.fileno(), termios.TIOCOUTQ,
+                                  "\0" * 4)
+                return struct.unpack("i", buf)[0]
+            except IOError:
+                return 0
+    # }}}
+
+    def __init__(self, endpoints, format = "json", batch = None,
+                 compression = None, balance = "round-robin",
+                 eject_after = None, probe_interval = None,
+                 resolve_interval = None, ack = None, queue_size = None):
+        # endpoints: list of (host, port) pairs; all the addresses a host
+        #   resolves to are used
+        # batch: None (send each message immediately) or {"size": N,
+        #   "interval": seconds}
+        # compression: None or {"codec": ..., "level": N}
+        # ack: None or {"window": N, "timeout": seconds}
+        # queue_size: bytes kept while no connection is up, before the
+        #   parsing is held
+        if balance not in TCPDestination.BALANCE:
+            raise ValueError("unrecognized balancing method: %s" % (balance,))
+        self.endpoints = endpoints
+        self.format = format
+        self.balance = balance
+        self.eject_after = eject_after or TCPDestination.EJECT_AFTER
+        self.probe_interval = probe_interval or TCPDestination.PROBE_INTERVAL
+        self.resolve_interval = \
+            resolve_interval or TCPDestination.RESOLVE_INTERVAL
+        self.queue_size = queue_size or TCPDestination.QUEUE_SIZE
+        if compression is not None:
+            # fail early on unavailable codec
+            compress.Compressor(compression.get("codec", "zlib"))
+            if batch is None:
+                batch = {} # compressing single messages makes little sense
+        self.compression = compression
+        if ack is not None:
+            self.ack = (ack.get("window", TCPDestination.ACK_WINDOW),
+                        ack.get("timeout", TCPDestination.ACK_TIMEOUT))
+        else:
+            self.ack = None
+        self.seq = 0
+        # (seq, block) not sent yet or to be sent again, oldest first
+        self.backlog = collections.deque()
+        self.backlog_bytes = 0
+        if batch is not None:
+            self.batch_size = batch.get("size", TCPDestination.BATCH_SIZE)
+            self.batch_interval = batch.get("interval",
+                                            TCPDestination.BATCH_INTERVAL)
+        else:
+            self.batch_size = 0
+            self.batch_interval = 0
+        self.batch = []
+        self.batch_bytes = 0
+        self.batch_started = None
+        self.connections = []
+        self.next_connection = 0
+        self.next_resolve = 0
+        self.stats_prefix = "destination.tcp." + ",".join(
+            "%s:%d" % (host, port) for (host, port) in endpoints
+        )
+        self._resolve()
+        self._connect_all()
+
+    def _resolve(self):
+        # (re)build list of connections from DNS; connections to addresses
+        # that are still valid are kept
+        self.next_resolve = time.time() + self.resolve_interval
+        old = dict(
+            ((c.host, c.port, c.address), c) for c in self.connections
+        )
+        new = []
+        for (host, port) in self.endpoints:
             try:
-                self.sock.send(line)
+                addresses = socket.getaddrinfo(host, port, socket.AF_UNSPEC,
+                                               socket.SOCK_STREAM)
+            except socket.gaierror:
+                # resolver problems; keep what was known for this endpoint
+                new.extend(c for c in self.connections
+                           if (c.host, c.port) == (host, port))
+                continue
+            for (family, _type, _proto, _name, address) in addresses:
+                key = (host, port, address)
+                if key in old:
+                    new.append(old.pop(key))
+                elif key not in [(c.host, c.port, c.address) for c in new]:
+                    new.append(TCPDestination.Connection(
+                        host, port, family, address, self.compression,
+                        self.ack,
+                    ))
+        for conn in old.values():
+            if conn not in new:
+                self._requeue(conn.take_window())
+                conn.close()
+        self.connections = new
+
+    def _pick(self):
+        ready = [c for c in self.connections
+                 if c.ejected_until is None and c.sock is not None]
+        if len(ready) == 0:
+            return None
+        self.next_connection = (self.next_connection + 1) % len(ready)
+        if self.balance == "least-outstanding":
+            # start at round-robin position, so ties are spread evenly
+            ready = ready[self.next_connection:] + \
+                    ready[:self.next_connection]
+            return min(ready, key = lambda c: c.outstanding())
+        return ready[self.next_connection]
+
+    def _connect_all(self):
+        # start connecting where it's due and finish connections in
+        # progress; nothing here waits for the network
+        now = time.time()
+        for conn in self.connections:
+            if conn.sock is not None:
+                continue
+            if conn.connecting is not None:
+                result = conn.check_connect()
+                if result is True and conn.ejected_until is not None:
+                    logger = logging.getLogger("destination")
+                    logger.info("TCP destination %s is back", conn)
+                    conn.failures = 0
+                    conn.ejected_until = None
+                elif result is False:
+                    self._failed(conn)
+                continue
+            if conn.ejected_until is not None:
+                due = conn.ejected_until
+            else:
+                due = conn.retry_at
+            if due <= now and not conn.start_connect():
+                self._failed(conn)
+
+    def _failed(self, conn):
+        # returns unacknowledged batches that need to be sent again
+        blocks = conn.take_window()
+        if len(blocks) > 0:
+            stats.registry.incr(self.stats_prefix + ".resent", len(blocks))
+        conn.disconnect()
+        conn.failures += 1
+        if conn.ejected_until is not None:
+            # ejected connection is still down
+            conn.ejected_until = time.time() + self.probe_interval
+            return blocks
+        others = [c for c in self.connections
+                  if c is not conn and c.ejected_until is None]
+        if conn.failures >= self.eject_after and len(others) > 0:
+            self._eject(conn)
+            return blocks
+        # the only healthy connection can't be ejected, it just reconnects
+        if conn.failures == 1:
+            logger = logging.getLogger("destination")
+            logger.warning("TCP destination %s failed, reconnecting", conn)
+        delay = TCPDestination.RECONNECT_DELAY * \
+                2 ** min(conn.failures - 1, 16)
+        conn.retry_at = time.time() + min(delay, self.probe_interval)
+        return blocks
+
+    def _eject(self, conn):
+        logger = logging.getLogger("destination")
+        logger.warning("TCP destination %s failed %d times, ejecting it",
+                       conn, conn.failures)
+        stats.registry.incr(self.stats_prefix + ".ejected")
+        conn.close()
+        conn.ejected_until = time.time() + self.probe_interval
+
+    def send(self, line):
+        line = formats.frame(line, self.format)
+        if self.batch_size == 0:
+            self._send_block(line)
+            return
+        if self.batch_started is None:
+            self.batch_started = time.time()
+        self.batch.append(line)
+        self.batch_bytes += len(line)
+        if self.batch_bytes >= self.batch_size:
+            self._send_batch()
+
+    def flush(self, force = False):
+        if time.time() >= self.next_resolve:
+            self._resolve()
+        self._connect_all()
+        if self.ack is not None:
+            self._check_acks()
+        if len(self.batch) > 0 and (force or
+           time.time() - self.batch_started >= self.batch_interval):
+            self._send_batch()
+        else:
+            self._send_backlog()
+        if force:
+            self._wait_for_delivery()
+
+    def fileno(self):
+        # with data waiting for a connection, the main loop watches the
+        # connection attempt, so the data goes out as soon as it succeeds
+        if len(self.backlog) == 0:
+            return None
+        for conn in self.connections:
+            if conn.connecting is not None:
+                return conn.connecting.fileno()
+        return None
+
+    def writable(self):
+        self._connect_all()
+        self._send_backlog()
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+
+    def _check_acks(self):
+        for conn in self.connections:
+            if len(conn.window) > 0 and not conn.read_acks():
+                self._requeue(self._failed(conn))
+        self._send_backlog()
+
+    def _wait_for_delivery(self):
+        # before the destination is discarded, make sure everything that was
+        # sent was also received; connections that are down get some time to
+        # come back
+        if self.ack is not None:
+            deadline = time.time() + max(self.ack[1],
+                                         TCPDestination.DRAIN_TIMEOUT)
+        else:
+            deadline = time.time() + TCPDestination.DRAIN_TIMEOUT
+        while True:
+            if self.ack is not None:
+                self._check_acks()
+            else:
+                self._send_backlog()
+            waiting = [c.sock for c in self.connections
+                       if len(c.window) > 0 and c.sock is not None]
+            if len(waiting) == 0 and len(self.backlog) == 0:
                 return
-            except socket.error:
-                self._disconnect()
+            if time.time() >= deadline:
+                break
+            if len(waiting) > 0:
+                select.select(waiting, [], [], 0.1)
+            else:
+                self._wait_for_connection(0.1)
+        lost = len(self.backlog)
+        for conn in self.connections:
+            lost += len(conn.take_window())
+        self.backlog.clear()
+        self.backlog_bytes = 0
+        logger = logging.getLogger("destination")
+        logger.warning("TCP destination %s: %d batches not delivered",
+                       self.stats_prefix[len("destination.tcp."):], lost)
+        stats.registry.incr(self.stats_prefix + ".dropped", lost)
+
+    def _send_batch(self):
+        block = b"".join(self.batch)
+        self.batch = []
+        self.batch_bytes = 0
+        self.batch_started = None
+        self._send_block(block)
+
+    def _send_block(self, block):
+        if self.ack is not None:
+            self.seq += 1
+            self._deliver([(self.seq, block)])
+        else:
+            self._deliver([(None, block)])
+
+    def _deliver(self, blocks):
+        # blocks go out after the ones that wait already; when no connection
+        # is up, they wait in the backlog, and only a full backlog holds the
+        # parsing
+        # FIXME: without acks, on broken connection (even to localhost) one
+        # block will most probably be lost, as successful send() only means
+        # that kernel has buffered the data
+        for (seq, block) in blocks:
+            self.backlog.append((seq, block))
+            self.backlog_bytes += len(block)
+        self._send_backlog()
+        if self.backlog_bytes > self.queue_size:
+            stats.registry.incr(self.stats_prefix + ".held")
+            while self.backlog_bytes > self.queue_size:
+                self._wait_for_connection(0.1)
+                self._send_backlog()
+
+    def _send_backlog(self):
+        while len(self.backlog) > 0:
+            conn = self._pick()
+            if conn is None:
+                return
+            (seq, block) = self.backlog[0]
+            sent = conn.send(block, seq)
+            if sent is None:
+                # batches not acknowledged yet are older than the backlog
+                self._requeue(self._failed(conn))
+                continue
+            conn.failures = 0
+            self.backlog.popleft()
+            self.backlog_bytes -= len(block)
+            self._count_bytes(len(block), sent)
+
+    def _requeue(self, blocks):
+        for (seq, block) in reversed(blocks):
+            self.backlog.appendleft((seq, block))
+            self.backlog_bytes += len(block)
+
+    def _wait_for_connection(self, timeout):
+        if len(self.connections) == 0 or time.time() >= self.next_resolve:
+            self._resolve()
+        self._connect_all()
+        connecting = [c.connecting for c in self.connections
+                      if c.connecting is not None]
+        if len(connecting) > 0:
+            select.select([], connecting, [], timeout)
+        else:
+            time.sleep(timeout)
+        self._connect_all()
+
+    def _count_bytes(self, bytes_in, bytes_out):
+        stats.registry.incr(self.stats_prefix + ".bytes_in", bytes_in)
+        stats.registry.incr(self.stats_prefix + ".bytes_out", bytes_out)
+        if self.compression is not None:
+            bytes_out = stats.registry.get(self.stats_prefix + ".bytes_out")
+            bytes_in = stats.registry.get(self.stats_prefix + ".bytes_in")
+            stats.registry.set(self.stats_prefix + ".compression_ratio",
+                               float(bytes_in) / max(bytes_out, 1))
 
 #-----------------------------------------------------------------------------
 
-class UDPDestination:
-    def __init__(self, host, port):
+class DatagramDestination(Destination):
+    # base for destinations that can pack several messages into a single
+    # datagram
+    PACK_SIZE = 1400 # fits in a typical Ethernet MTU
+    PACK_INTERVAL = 0.05
+    BURST = 64 # datagrams sent in a single sendmmsg() call
+    OVERSIZE = ["send", "drop"]
+
+    def _init_packing(self, pack):
+        # pack: None (one message per datagram) or {"size": bytes,
+        #   "interval": seconds, "oversize": "send" | "drop"}
+        if pack is None:
+            self.pack_size = 0
+            return
+        self.pack_size = pack.get("size", DatagramDestination.PACK_SIZE)
+        self.pack_interval = pack.get("interval",
+                                      DatagramDestination.PACK_INTERVAL)
+        self.oversize = pack.get("oversize", "send")
+        if self.oversize not in DatagramDestination.OVERSIZE:
+            raise ValueError("unrecognized oversize policy: %s" %
+                             (self.oversize,))
+        self.datagrams = [] # complete datagrams, waiting to be sent
+        self.current = [] # messages for the datagram being filled
+        self.current_bytes = 0
+        self.pack_started = None
+
+    def send(self, line):
+        if self.pack_size == 0:
+            self._send_single(line)
+            return
+        # each message in a datagram ends with newline (JSON) or is prefixed
+        # with its length (msgpack)
+        event = formats.frame(line, self.format)
+        if len(event) > self.pack_size:
+            if self.oversize == "drop":
+                stats.registry.incr(self.stats_prefix + ".oversize_dropped")
+                return
+            # message goes alone in its own datagram
+            stats.registry.incr(self.stats_prefix + ".oversize_sent")
+            self._close_datagram()
+            self.datagrams.append(event)
+        else:
+            if self.current_bytes + len(event) > self.pack_size:
+                self._close_datagram()
+            self.current.append(event)
+            self.current_bytes += len(event)
+        if self.pack_started is None:
+            self.pack_started = time.time()
+        if len(self.datagrams) >= DatagramDestination.BURST:
+            self.flush(force = True)
+
+    def _close_datagram(self):
+        if len(self.current) > 0:
+            self.datagrams.append(b"".join(self.current))
+            self.current = []
+            self.current_bytes = 0
+
+    def flush(self, force = False):
+        if self.pack_size == 0 or self.pack_started is None:
+            return
+        if not force and time.time() - self.pack_started < self.pack_interval:
+            return
+        self._close_datagram()
+        (datagrams, self.datagrams) = (self.datagrams, [])
+        self.pack_started = None
+        self._send_packed(datagrams)
+
+    def _send_single(self, line):
+        raise NotImplementedError()
+
+    def _send_packed(self, datagrams):
+        raise NotImplementedError()
+
+#-----------------------------------------------------------------------------
+
+class UDPDestination(DatagramDestination):
+    def __init__(self, host, port, format = "json", pack = None):
         self.host = host
         self.port = port
+        self.format = format
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.connected = False
+        self.stats_prefix = "destination.udp.%s:%d" % (host, port)
+        self._init_packing(pack)
 
-    def send(self, line):
-        # XXX: ignore send errors
+    def _send_single(self, line):
+        # XXX: ignore send errors (only count them)
         try:
             self.sock.sendto(line, (self.host, self.port))
         except socket.error:
-            pass
+            stats.registry.incr(self.stats_prefix + ".send_errors")
+
+    def _send_packed(self, datagrams):
+        # XXX: ignore send errors (only count the lost datagrams)
+        if not self.connected:
+            try:
+                # sendmmsg() needs a connected socket
+                self.sock.connect((self.host, self.port))
+                self.connected = True
+            except socket.error:
+                # e.g. host name doesn't resolve anymore; try again next time
+                stats.registry.incr(self.stats_prefix + ".send_errors",
+                                    len(datagrams))
+                return
+        while len(datagrams) > 0:
+            try:
+                sent = mmsg.sendmmsg(self.sock, datagrams)
+            except socket.error:
+                # the first datagram failed, possibly because of an error
+                # left by an earlier one (ECONNREFUSED from ICMP), so it gets
+                # another chance; the rest of the burst is sent either way
+                sent = 1
+                try:
+                    self.sock.send(datagrams[0])
+                except socket.error:
+                    stats.registry.incr(self.stats_prefix + ".send_errors")
+                    # re-resolve the host name on the next burst
+                    self.connected = False
+            datagrams = datagrams[sent:]
 
 #-----------------------------------------------------------------------------
 
-class UNIXDestination:
-    def __init__(self, path, retry = True):
+class UNIXDestination(DatagramDestination):
+    def __init__(self, path, retry = True, format = "json", pack = None):
         self.path = path
         self.retry = retry # whether to ignore send errors
+        self.format = format
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.connected = False
+        self.stats_prefix = "destination.unix.%s" % (path,)
+        self._init_packing(pack)
 
-    def send(self, line):
+    def _send_single(self, line):
         def _try_send(line):
             try:
                 self.sock.sendto(line, self.path)
@@ -99,5 +714,386 @@ class UNIXDestination:
             while not _try_send(line):
                 time.sleep(0.1)
 
+    def _send_packed(self, datagrams):
+        while len(datagrams) > 0:
+            try:
+                # sendmmsg() needs a connected socket; connecting again is
+                # necessary when the receiver has re-created its socket
+                if not self.connected:
+                    self.sock.connect(self.path)
+                    self.connected = True
+                sent = mmsg.sendmmsg(self.sock, datagrams)
+                datagrams = datagrams[sent:]
+            except socket.error:
+                self.connected = False
+                if not self.retry:
+                    return # ignore send errors
+                time.sleep(0.1)
+
+#-----------------------------------------------------------------------------
+
+class UNIXStreamDestination(Destination):
+    # non-blocking destination: messages are queued and written whenever the
+    # socket is ready, so a slow or missing receiver doesn't hold the parsing
+    QUEUE_SIZE = 16 * 1024 * 1024 # bytes
+    OVERFLOW = ["drop-new", "drop-old"]
+    BACKOFF_MIN = 0.1
+    BACKOFF_MAX = 30.0
+    DRAIN_TIMEOUT = 5.0
+
+    def __init__(self, path, type = "stream", format = "json",
+                 queue_size = None, overflow = "drop-new"):
+        # type: "stream" or "seqpacket"
+        if overflow not in UNIXStreamDestination.OVERFLOW:
+            raise ValueError("unrecognized overflow policy: %s" % (overflow,))
+        self.path = path
+        if type == "seqpacket":
+            self.sock_type = socket.SOCK_SEQPACKET
+        else:
+            self.sock_type = socket.SOCK_STREAM
+        self.format = format
+        self.queue_size = queue_size or UNIXStreamDestination.QUEUE_SIZE
+        self.overflow = overflow
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+        self.head_written = 0 # part of queue[0] already written (stream)
+        self.sock = None
+        self.next_connect = 0
+        self.backoff = UNIXStreamDestination.BACKOFF_MIN
+        self.stats_prefix = "destination.unix.%s" % (path,)
+
+    def _connect(self):
+        now = time.time()
+        if now < self.next_connect:
+            return
+        sock = socket.socket(socket.AF_UNIX, self.sock_type)
+        sock.setblocking(0)
+        try:
+            # connect() on unix socket doesn't wait for anything, but it can
+            # fail with EAGAIN when receiver's backlog is full
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            self.next_connect = now + self.backoff
+            self.backoff = min(self.backoff * 2,
+                               UNIXStreamDestination.BACKOFF_MAX)
+            return
+        self.sock = sock
+        self.backoff = UNIXStreamDestination.BACKOFF_MIN
+
+    def _disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        # message that was partially written is sent from the beginning on
+        # the next connection
+        self.head_written = 0
+        self.next_connect = time.time() + self.backoff
+
+    def send(self, line):
+        if self.sock_type == socket.SOCK_STREAM:
+            line = formats.frame(line, self.format)
+        # seqpacket keeps message boundaries, no framing necessary
+        if self.queued_bytes + len(line) > self.queue_size:
+            if self.overflow == "drop-new" or len(line) > self.queue_size:
+                stats.registry.incr(self.stats_prefix + ".dropped")
+                return
+            self._drop_oldest(len(line))
+        self.queue.append(line)
+        self.queued_bytes += len(line)
+        self._write()
+
+    def _drop_oldest(self, space):
+        # partially written message can't be dropped without breaking the
+        # stream
+        head = None
+        if self.head_written > 0:
+            head = self.queue.popleft()
+        while len(self.queue) > 0 and \
+              self.queued_bytes + space > self.queue_size:
+            self.queued_bytes -= len(self.queue.popleft())
+            stats.registry.incr(self.stats_prefix + ".dropped")
+        if head is not None:
+            self.queue.appendleft(head)
+
+    def _write(self):
+        if self.sock is None:
+            self._connect()
+            if self.sock is None:
+                return
+        while len(self.queue) > 0:
+            message = self.queue[0]
+            try:
+                if self.head_written > 0:
+                    written = self.sock.send(message[self.head_written:])
+                else:
+                    written = self.sock.send(message)
+            except socket.error as e:
+                if e.errno == errno.EMSGSIZE:
+                    # seqpacket message over the socket's limit would be
+                    # retried forever
+                    self.queue.popleft()
+                    self.queued_bytes -= len(message)
+                    stats.registry.incr(self.stats_prefix + ".dropped")
+                    continue
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self._disconnect()
+                return
+            self.head_written += written
+            if self.head_written < len(message):
+                return # socket's buffer is full
+            self.queue.popleft()
+            self.queued_bytes -= len(message)
+            self.head_written = 0
+
+    def fileno(self):
+        if self.sock is None or len(self.queue) == 0:
+            return None
+        return self.sock.fileno()
+
+    def writable(self):
+        self._write()
+
+    def flush(self, force = False):
+        # (re)connecting happens here when the main loop has no messages
+        if len(self.queue) > 0:
+            self._write()
+        if not force:
+            return
+        deadline = time.time() + UNIXStreamDestination.DRAIN_TIMEOUT
+        while len(self.queue) > 0 and time.time() < deadline:
+            if self.sock is not None:
+                select.select([], [self.sock], [], 0.1)
+            else:
+                time.sleep(0.1)
+                self.next_connect = 0 # don't wait for backoff at the end
+            self._write()
+        if len(self.queue) > 0:
+            stats.registry.incr(self.stats_prefix + ".dropped",
+                                len(self.queue))
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+#-----------------------------------------------------------------------------
+
+class FileDestination(Destination):
+    BUFFER_SIZE = 1024 * 1024
+    FSYNC_INTERVAL = 1.0
+
+    class Compressor(threading.Thread): # {{{
+        # compresses rotated files in background, so the main loop is not
+        # stalled; a single thread serves all the file destinations and
+        # outlives them, so reloading the config never waits for it
+        def __init__(self):
+            super(FileDestination.Compressor, self).__init__()
+            # compression interrupted by daemon's exit is repeated on the
+            # next start (see FileDestination._compress_leftovers())
+            self.daemon = True
+            self.queue = compat.queue.Queue()
+            # files queued or being compressed
+            self.pending = set()
+
+        def compress(self, filename):
+            if filename in self.pending:
+                return
+            self.pending.add(filename)
+            self.queue.put(filename)
+
+        def run(self):
+            logger = logging.getLogger("destination")
+            while True:
+                filename = self.queue.get()
+                try:
+                    self._gzip(filename)
+                except (IOError, OSError) as e:
+                    logger.warning("can't compress %s: %s", filename, e)
+                finally:
+                    self.pending.discard(filename)
+
+        def _gzip(self, filename):
+            # compressed file shows up under its name only when complete; the
+            # temporary name is per process, since during a handoff both the
+            # old and the new process may be compressing the same file
+            tmpname = "%s.gz.tmp.%d" % (filename, os.getpid())
+            try:
+                src = open(filename, "rb")
+            except (IOError, OSError) as e:
+                if e.errno == errno.ENOENT:
+                    return # already compressed by someone else
+                raise
+            with src:
+                dest = gzip.open(tmpname, "wb")
+                try:
+                    while True:
+                        chunk = src.read(1024 * 1024)
+                        if chunk == b"":
+                            break
+                        dest.write(chunk)
+                finally:
+                    dest.close()
+            os.rename(tmpname, filename + ".gz")
+            try:
+                os.unlink(filename)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+    # }}}
+
+    _compressor = None
+
+    @staticmethod
+    def compressor():
+        # the thread is started on first use, from the main loop; a thread
+        # started while loading the config would not survive the fork() that
+        # detaches the daemon
+        if FileDestination._compressor is None:
+            FileDestination._compressor = FileDestination.Compressor()
+            FileDestination._compressor.start()
+        return FileDestination._compressor
+
+    def __init__(self, path, format = "json", buffer_size = None,
+                 fsync_interval = FSYNC_INTERVAL, rotate_size = None,
+                 rotate_interval = None, compress = False):
+        # fsync_interval: None means leave syncing to the OS
+        # rotate_size, rotate_interval: None means no rotation of this kind
+        self.path = path
+        self.format = format
+        self.buffer_size = buffer_size or FileDestination.BUFFER_SIZE
+        self.fsync_interval = fsync_interval
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.fd = None
+        self.size = 0
+        self.opened_at = None
+        self.next_fsync = None
+        self.dirty = False # written, but not synced to disk
+        self.stats_prefix = "destination.file.%s" % (path,)
+        self.compress_rotated = compress
+        # rotated files left uncompressed by the previous run are checked on
+        # the first flush()
+        self.leftovers_checked = False
+        self._open()
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                          0o644)
+        self.size = os.fstat(self.fd).st_size
+        self.opened_at = time.time()
+        if self.fsync_interval is not None:
+            self.next_fsync = self.opened_at + self.fsync_interval
+
+    def send(self, line):
+        line = formats.frame(line, self.format)
+        self.buffer.append(line)
+        self.buffered_bytes += len(line)
+        if self.buffered_bytes >= self.buffer_size:
+            self._write()
+            if self.rotate_size is not None and self.size >= self.rotate_size:
+                self._rotate()
+
+    def _write(self):
+        if self.buffered_bytes == 0:
+            return
+        data = b"".join(self.buffer)
+        self.buffer = []
+        self.buffered_bytes = 0
+        try:
+            while len(data) > 0:
+                written = os.write(self.fd, data)
+                self.size += written
+                data = data[written:]
+            self.dirty = True
+        except OSError as e:
+            logger = logging.getLogger("destination")
+            logger.warning("write to %s failed: %s", self.path, e)
+            stats.registry.incr(self.stats_prefix + ".lost_bytes", len(data))
+
+    def _sync(self):
+        if self.dirty:
+            os.fsync(self.fd)
+            self.dirty = False
+
+    def flush(self, force = False):
+        # all the messages that arrived in a loop iteration are written with
+        # a single write() call and synced together
+        if self.compress_rotated and not self.leftovers_checked:
+            self.leftovers_checked = True
+            self._compress_leftovers()
+        self._write()
+        now = time.time()
+        if force or (self.next_fsync is not None and now >= self.next_fsync):
+            self._sync()
+            if self.fsync_interval is not None:
+                self.next_fsync = now + self.fsync_interval
+        if (self.rotate_size is not None and self.size >= self.rotate_size) or \
+           (self.rotate_interval is not None and
+            now - self.opened_at >= self.rotate_interval):
+            self._rotate()
+
+    def _rotate(self):
+        if self.size == 0:
+            self.opened_at = time.time()
+            return
+        self._sync()
+        os.close(self.fd)
+        rotated = "%s.%s" % (self.path, time.strftime("%Y%m%d-%H%M%S"))
+        i = 1
+        candidate = rotated
+        while os.path.exists(candidate) or os.path.exists(candidate + ".gz"):
+            candidate = "%s.%d" % (rotated, i)
+            i += 1
+        os.rename(self.path, candidate)
+        self._open()
+        stats.registry.incr(self.stats_prefix + ".rotated")
+        if self.compress_rotated:
+            FileDestination.compressor().compress(candidate)
+
+    def _compress_leftovers(self):
+        (directory, basename) = os.path.split(self.path)
+        rotated = re.compile(
+            r'^' + re.escape(basename) + r'\.\d{8}-\d{6}(\.\d+)?$'
+        )
+        temporary = re.compile(
+            r'^' + re.escape(basename) + r'\..*\.gz\.tmp\.(\d+)$'
+        )
+        try:
+            names = sorted(os.listdir(directory or "."))
+        except OSError:
+            return
+        for name in names:
+            if rotated.match(name):
+                FileDestination.compressor().compress(
+                    os.path.join(directory, name)
+                )
+                continue
+            match = temporary.match(name)
+            if match is not None and not _process_alive(int(match.group(1))):
+                # compression interrupted by process' exit
+                try:
+                    os.unlink(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def close(self):
+        if self.fd is not None:
+            self._write()
+            self._sync()
+            os.close(self.fd)
+            self.fd = None
+
+#-----------------------------------------------------------------------------
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return (e.errno != errno.ESRCH)
+    return True
+
 #-----------------------------------------------------------------------------
 # vim:ft=python
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+'''
+Enriching messages
+------------------
+
+Normalized messages can get fields that don't come from the log line
+itself: the host that received the line, the log source, the receive time,
+the line's timestamp converted to ISO 8601, and the address (and name) of
+the sender. Enrichment is configured with a dictionary of field names::
+
+   {"host": true, "source": "log_source", "timestamp": "@timestamp"}
+
+``true`` means the default field name. Recognized enrichments:
+
+   * ``"host"`` (``"received_host"``) -- name of this host
+   * ``"source"`` (``"received_source"``) -- log source (e.g.
+     ``"UDP: *:1639"``)
+   * ``"received"`` (``"received_at"``) -- time the line was processed
+   * ``"timestamp"`` (``"timestamp"``) -- value of ``"date"`` field (as
+     produced by liblognorm's ``date-rfc3164`` parser) in ISO 8601 format;
+     ``"date_field"`` key sets a different source field
+   * ``"peer"`` (``"peer"``) -- address of the sender (UDP and TCP sources)
+   * ``"peer_name"`` (``"peer_name"``) -- reverse DNS name of the sender
+
+Host and source fields are computed once per source. Times are converted
+once per second, since consecutive lines mostly carry the same timestamp.
+Reverse DNS lookups are made in a background thread (:class:`Resolver`) and
+their results are cached for a limited time; a message whose sender is not
+resolved yet goes out without the name, so a slow DNS server never stalls
+processing.
+
+.. autoclass:: Enricher
+   :members:
+
+.. autoclass:: Resolver
+   :members:
+
+.. autofunction:: resolver
+
+'''
+#-----------------------------------------------------------------------------
+
+import socket
+import threading
+import time
+
+from . import compat
+from . import stats
+
+DEFAULT_FIELDS = {
+    "host": "received_host",
+    "source": "received_source",
+    "received": "received_at",
+    "timestamp": "timestamp",
+    "peer": "peer",
+    "peer_name": "peer_name",
+}
+
+#-----------------------------------------------------------------------------
+
+def iso8601(t):
+    '''
+    :param t: time (epoch)
+    :return: string
+
+    Format time as local time in ISO 8601 format, with UTC offset.
+    '''
+    tm = time.localtime(t)
+    if tm.tm_isdst > 0:
+        offset = -time.altzone
+    else:
+        offset = -time.timezone
+    if offset < 0:
+        (sign, offset) = ("-", -offset)
+    else:
+        sign = "+"
+    return "%s%s%02d:%02d" % (
+        time.strftime("%Y-%m-%dT%H:%M:%S", tm),
+        sign, offset // 3600, offset % 3600 // 60,
+    )
+
+def parse_rfc3164(date, now):
+    '''
+    :param date: syslog date (``"Oct 19 12:34:56"``)
+    :param now: current time (epoch), to guess the year
+    :return: time (epoch) or ``None`` if *date* is invalid
+    '''
+    year = time.localtime(now).tm_year
+    try:
+        result = _mktime(date, year)
+        if result > now + 7 * 86400:
+            # December's log read in January
+            result = _mktime(date, year - 1)
+    except (ValueError, OverflowError):
+        return None
+    return result
+
+def _mktime(date, year):
+    return time.mktime(time.strptime("%s %d" % (date, year),
+                                     "%b %d %H:%M:%S %Y"))
+
+#-----------------------------------------------------------------------------
+
+class Enricher:
+    '''
+    Enrichment of messages from a single source.
+    '''
+
+    def __init__(self, config, source_name):
+        '''
+        :param config: dictionary with enrichment definition
+        :param source_name: name of the source the messages come from
+        '''
+        self.date_field = config.get("date_field", "date")
+        self.fields = {}
+        for (name, field) in config.items():
+            if name == "date_field" or field is None or field is False:
+                continue
+            if name not in DEFAULT_FIELDS:
+                raise ValueError("unrecognized enrichment: %s" % (name,))
+            if field is True:
+                field = DEFAULT_FIELDS[name]
+            self.fields[name] = field
+
+        # fields that are the same for all the messages
+        self.static = {}
+        if "host" in self.fields:
+            self.static[self.fields["host"]] = socket.gethostname()
+        if "source" in self.fields:
+            self.static[self.fields["source"]] = source_name
+        self.received_field = self.fields.get("received")
+        self.timestamp_field = self.fields.get("timestamp")
+        self.peer_field = self.fields.get("peer")
+        self.peer_name_field = self.fields.get("peer_name")
+
+        # single-entry caches: (second, formatted receive time) and
+        # (date string, converted timestamp)
+        self._received = (None, None)
+        self._timestamp = (None, None)
+
+    def enrich(self, message, now, peer = None):
+        '''
+        :param message: normalized message (dictionary)
+        :param now: current time (epoch)
+        :param peer: address of the sender or ``None``
+
+        Add configured fields to the message.
+        '''
+        message.update(self.static)
+        if self.received_field is not None:
+            second = int(now)
+            if self._received[0] != second:
+                self._received = (second, iso8601(second))
+            message[self.received_field] = self._received[1]
+        if self.timestamp_field is not None:
+            date = message.get(self.date_field)
+            if date is not None:
+                if self._timestamp[0] != date:
+                    self._timestamp = (date, self._convert(date, now))
+                if self._timestamp[1] is not None:
+                    message[self.timestamp_field] = self._timestamp[1]
+        if peer is not None:
+            if self.peer_field is not None:
+                message[self.peer_field] = peer
+            if self.peer_name_field is not None:
+                name = resolver().lookup(peer, now)
+                if name is not None:
+                    message[self.peer_name_field] = name
+
+    def _convert(self, date, now):
+        if not isinstance(date, compat.string_types):
+            return None
+        t = parse_rfc3164(date, now)
+        if t is None:
+            stats.registry.incr("enrich.invalid_dates")
+            return None
+        return iso8601(t)
+
+#-----------------------------------------------------------------------------
+
+class Resolver(threading.Thread):
+    '''
+    Reverse DNS resolver with a cache. Lookups are done in background, one at
+    a time.
+    '''
+    TTL = 300.0
+    NEGATIVE_TTL = 60.0
+    MAX_SIZE = 10000
+
+    def __init__(self):
+        super(Resolver, self).__init__()
+        self.daemon = True
+        # address -> (name, expiry time); written only by the resolver thread
+        self.cache = {}
+        self.queue = compat.queue.Queue(Resolver.MAX_SIZE)
+        self.queued = set()
+
+    def lookup(self, address, now):
+        '''
+        :param address: IP address
+        :param now: current time (epoch)
+        :return: host name or ``None`` if it's not known (yet)
+
+        Return the cached name for the address. Missing and expired entries
+        are scheduled for resolving; an expired name is still returned in
+        the meantime.
+        '''
+        entry = self.cache.get(address)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        stats.registry.incr("enrich.dns_misses")
+        if address not in self.queued:
+            try:
+                self.queue.put_nowait(address)
+                self.queued.add(address)
+            except compat.queue.Full:
+                pass # try again with the next message
+        if entry is not None:
+            return entry[0]
+        return None
+
+    def run(self):
+        while True:
+            address = self.queue.get()
+            try:
+                name = socket.gethostbyaddr(address)[0]
+                expiry = time.time() + Resolver.TTL
+            except (socket.error, socket.herror, socket.gaierror):
+                name = None
+                expiry = time.time() + Resolver.NEGATIVE_TTL
+            self._store(address, name, expiry)
+            self.queued.discard(address)
+
+    def _store(self, address, name, expiry):
+        if address not in self.cache and len(self.cache) >= Resolver.MAX_SIZE:
+            now = time.time()
+            for (key, (_name, key_expiry)) in list(self.cache.items()):
+                if key_expiry <= now:
+                    del self.cache[key]
+            if len(self.cache) >= Resolver.MAX_SIZE:
+                self.cache.clear()
+        self.cache[address] = (name, expiry)
+
+_resolver = None
+
+def resolver():
+    '''
+    :return: :class:`Resolver`
+
+    Return the process-wide resolver, starting it on first use.
+    '''
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver()
+        _resolver.start()
+    return _resolver
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
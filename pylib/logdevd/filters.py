@@ -0,0 +1,170 @@
+#!/usr/bin/python
+'''
+Filtering log lines
+-------------------
+
+Filters drop uninteresting log lines before they get normalized. A filter
+matches a line by literal prefix, by literal substring, or by regular
+expression, and either excludes matching lines or includes only the matching
+lines. All filters of a source are compiled into a single regexp for
+excludes and a single regexp for includes, so a line is scanned at most
+twice, regardless of how many filters there are.
+
+Filter definition is a dictionary::
+
+   {"action": "exclude", "substring": ["DEBUG", "TRACE"], "name": "debug"}
+
+``"action"`` is either ``"exclude"`` (default) or ``"include"``. Exactly one
+of ``"prefix"``, ``"substring"`` (both can be a single string or a list of
+strings), and ``"regex"`` is required. ``"name"`` is used for reporting
+filter hits.
+
+Since the regexps are combined, groups are numbered across all the filters,
+so a regexp may only refer to its groups by name (``(?P<name>...)`` and
+``(?P=name)``), and group names must be unique among the source's filters.
+
+.. autoclass:: FilterSet
+   :members:
+
+.. autofunction:: literals_regex
+
+'''
+#-----------------------------------------------------------------------------
+
+import re
+
+from . import compat
+from . import stats
+
+# reference to a group by number: "\1" or "(?(1)...)"; escaped backslashes
+# are matched too, so "\\1" is not taken for a reference
+_NUMBERED_REFERENCE = re.compile(r'\\\\|\\([1-9])|\(\?\(([0-9]+)\)')
+
+#-----------------------------------------------------------------------------
+
+def literals_regex(literals):
+    '''
+    :param literals: list of strings
+    :return: regexp (string)
+
+    Build a regexp that matches any of the literal strings. The regexp has
+    the shape of a trie (common prefixes are merged), so for a large number
+    of literals the regexp engine doesn't need to try every single one at
+    each position of the scanned string.
+    '''
+    trie = {}
+    for literal in literals:
+        if literal == "":
+            raise ValueError("empty string is not a valid filter pattern")
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[""] = None # end of literal
+    return _trie_regex(trie)
+
+def _trie_regex(node):
+    if "" in node:
+        # a literal ends here; longer ones don't need to be checked, since
+        # matching any of them is enough
+        return ""
+    alternatives = [
+        re.escape(char) + _trie_regex(node[char])
+        for char in sorted(node)
+    ]
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return "(?:%s)" % ("|".join(alternatives),)
+
+#-----------------------------------------------------------------------------
+
+class FilterSet:
+    '''
+    Compiled list of filters for a single source.
+    '''
+
+    def __init__(self, filter_defs):
+        '''
+        :param filter_defs: list of filter definitions
+        '''
+        # regexp group name -> filter name
+        self.names = {}
+        parts = { "exclude": [], "include": [] }
+        for (i, fdef) in enumerate(filter_defs):
+            name = fdef.get("name", "filter%d" % (i,))
+            action = fdef.get("action", "exclude")
+            if action not in parts:
+                raise ValueError("unrecognized filter action: %s" % (action,))
+            if "prefix" in fdef:
+                pattern = r'\A' + literals_regex(_listify(fdef["prefix"]))
+            elif "substring" in fdef:
+                pattern = literals_regex(_listify(fdef["substring"]))
+            elif "regex" in fdef:
+                _check_regex(fdef["regex"])
+                pattern = "(?:%s)" % (fdef["regex"],)
+            else:
+                raise ValueError("filter without pattern: %s" % (str(fdef),))
+            group = "_filter%d" % (i,)
+            self.names[group] = name
+            parts[action].append("(?P<%s>%s)" % (group, pattern))
+
+        self.exclude = _compile(parts["exclude"])
+        self.include = _compile(parts["include"])
+        self.hits = dict((name, 0) for name in self.names.values())
+
+    def admit(self, line):
+        '''
+        :param line: log line (byte string)
+        :return: ``True`` if the line should be processed, ``False`` if it
+          should be dropped
+        '''
+        if self.include is not None:
+            match = self.include.search(line)
+            if match is None:
+                stats.registry.incr("filter.not_included")
+                return False
+            self._hit(match)
+        if self.exclude is not None:
+            match = self.exclude.search(line)
+            if match is not None:
+                self._hit(match)
+                return False
+        return True
+
+    def _hit(self, match):
+        for (group, value) in match.groupdict().items():
+            if value is not None and group in self.names:
+                name = self.names[group]
+                self.hits[name] += 1
+                stats.registry.incr("filter.%s" % (name,))
+                return
+
+def _check_regex(regex):
+    # each regexp is compiled on its own first, so errors point at it
+    try:
+        re.compile(compat.to_bytes(regex))
+    except re.error as e:
+        raise ValueError("invalid filter regex %s: %s" % (regex, e))
+    for match in _NUMBERED_REFERENCE.finditer(regex):
+        if match.group(1) is not None or match.group(2) is not None:
+            raise ValueError(
+                "filter regex %s refers to a group by number;"
+                " use a named group instead" % (regex,)
+            )
+
+def _compile(patterns):
+    if len(patterns) == 0:
+        return None
+    # log lines are not decoded yet, so the regexp works on bytes
+    try:
+        return re.compile(compat.to_bytes("|".join(patterns)))
+    except re.error as e:
+        # each regexp is valid, so they conflict with each other
+        raise ValueError("filter regexes can't be combined: %s" % (e,))
+
+def _listify(value):
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+'''
+Output formats
+--------------
+
+Destinations can use different serialization formats. A message is
+serialized to a given format at most once, and only when some destination
+asks for that format.
+
+Supported formats:
+
+   * ``"json"`` (default) -- JSON hash
+   * ``"msgpack"`` -- MessagePack map; *msgpack* module is used if available,
+     otherwise a built-in (slower) encoder
+
+Stream destinations (TCP, STDOUT) need to know where a message ends.
+JSON messages are terminated with a newline character, while MessagePack
+messages are prefixed with their length (4 bytes, big endian), see
+:func:`frame`.
+
+.. autoclass:: EncodedMessage
+   :members:
+
+.. autofunction:: frame
+
+'''
+#-----------------------------------------------------------------------------
+
+import json
+import struct
+from . import compat
+from . import jsonsplice
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FORMATS = ["json", "msgpack"]
+
+#-----------------------------------------------------------------------------
+
+class EncodedMessage:
+    '''
+    Message with a cache of its serialized forms.
+    '''
+
+    def __init__(self, message):
+        '''
+        :param message: dictionary or
+            :class:`logdevd.jsonsplice.SplicedMessage`
+        '''
+        self.message = message
+        self._encoded = {}
+
+    def encode(self, format):
+        '''
+        :param format: name of the format (one of :obj:`FORMATS`)
+        :return: serialized message (byte string)
+
+        Serialize the message to the specified format.
+        '''
+        try:
+            return self._encoded[format]
+        except KeyError:
+            pass
+        if format == "json":
+            result = encode_json(self.message)
+        else: # format == "msgpack"
+            result = encode_msgpack(self.message)
+        self._encoded[format] = result
+        return result
+
+#-----------------------------------------------------------------------------
+
+def encode_json(message):
+    if isinstance(message, jsonsplice.SplicedMessage):
+        result = message.encode()
+    else:
+        result = json.dumps(message, sort_keys = True)
+    # no-op in Python 2; in Python 3 the text is pure ASCII (json.dumps()
+    # escapes everything else), so this is just a copy
+    return compat.to_bytes(result)
+
+def encode_msgpack(message):
+    if isinstance(message, jsonsplice.SplicedMessage):
+        message = message.expand()
+    if msgpack is not None:
+        # Python 2 strings are byte strings, which use_bin_type would pack
+        # as bin; without it they are packed as str, like the built-in
+        # encoder does
+        return msgpack.packb(message, use_bin_type = compat.PY3)
+    return b"".join(_msgpack_parts(message))
+
+def frame(payload, format):
+    '''
+    :param payload: serialized message
+    :param format: format of the message
+    :return: message ready to be written to a stream
+
+    Add to the message the end marker appropriate for the format.
+    '''
+    if format == "json":
+        return payload + b"\n"
+    return struct.pack(">I", len(payload)) + payload
+
+#-----------------------------------------------------------------------------
+# fallback MessagePack encoder {{{
+
+def _msgpack_parts(obj):
+    if obj is None:
+        return [b"\xc0"]
+    if obj is True:
+        return [b"\xc3"]
+    if obj is False:
+        return [b"\xc2"]
+    if isinstance(obj, compat.integer_types):
+        return [_msgpack_int(obj)]
+    if isinstance(obj, float):
+        return [struct.pack(">Bd", 0xcb, obj)]
+    if isinstance(obj, compat.string_types):
+        obj = compat.to_bytes(obj)
+        return [_msgpack_header(len(obj), 0xa0, 31, 0xd9), obj]
+    if isinstance(obj, dict):
+        parts = [_msgpack_header(len(obj), 0x80, 15, None, 0xde)]
+        for (key, value) in obj.items():
+            parts.extend(_msgpack_parts(key))
+            parts.extend(_msgpack_parts(value))
+        return parts
+    if isinstance(obj, (list, tuple)):
+        parts = [_msgpack_header(len(obj), 0x90, 15, None, 0xdc)]
+        for value in obj:
+            parts.extend(_msgpack_parts(value))
+        return parts
+    raise TypeError("can't serialize %r to msgpack" % (obj,))
+
+def _msgpack_header(length, fix_base, fix_max, code8, code16 = None):
+    # str: fixstr, str8, str16, str32; map/array: fix, 16, 32
+    if length <= fix_max:
+        return struct.pack(">B", fix_base | length)
+    if code8 is not None:
+        if length < 2**8:
+            return struct.pack(">BB", code8, length)
+        code16 = code8 + 1
+    if length < 2**16:
+        return struct.pack(">BH", code16, length)
+    return struct.pack(">BI", code16 + 1, length)
+
+def _msgpack_int(value):
+    if 0 <= value < 2**7:
+        return struct.pack(">B", value)
+    if -2**5 <= value < 0:
+        return struct.pack(">b", value)
+    if value >= 0:
+        for (code, fmt, limit) in [(0xcc, ">BB", 2**8), (0xcd, ">BH", 2**16),
+                                   (0xce, ">BI", 2**32), (0xcf, ">BQ", 2**64)]:
+            if value < limit:
+                return struct.pack(fmt, code, value)
+    else:
+        for (code, fmt, limit) in [(0xd0, ">Bb", 2**7), (0xd1, ">Bh", 2**15),
+                                   (0xd2, ">Bi", 2**31), (0xd3, ">Bq", 2**63)]:
+            if value >= -limit:
+                return struct.pack(fmt, code, value)
+    raise TypeError("integer too large for msgpack: %d" % (value,))
+
+# }}}
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,287 @@
+#!/usr/bin/python
+'''
+Handing sockets over to a new process
+-------------------------------------
+
+Restarting *logdevourer* without dropping messages. The running process
+starts a new one (:func:`spawn`), passing it the sockets of its log sources
+as inherited descriptors, in the same way as :manpage:`systemd(1)` does with
+socket activation (``$LISTEN_FDS`` and ``$LISTEN_PID`` environment
+variables, descriptors starting from 3). Sources of the new process look for
+an inherited socket (:func:`take_socket`) before creating their own, so
+sockets received from :manpage:`systemd(1)` are used the same way.
+
+Along with listening sockets, accepted stream connections are passed, with
+their unprocessed data (``$LOGDEVD_HANDOFF`` variable). Positions in log
+files are passed through the state directory, as usual.
+
+The new process reports that it's ready (:func:`notify_ready`) through
+a pipe (``$LOGDEVD_HANDOFF_READY``); the old process doesn't read anything
+in the meantime and exits after the new process is ready. If the new process
+fails or doesn't get ready in time, the old one terminates it and continues
+its work. A new process that finds the pipe closed (the old one gave up on
+it) exits, so the two never read the same sockets and files.
+
+.. autofunction:: spawn
+
+.. autofunction:: take_socket
+
+.. autofunction:: take_connections
+
+.. autofunction:: notify_ready
+
+'''
+#-----------------------------------------------------------------------------
+
+import os
+import socket
+import fcntl
+import json
+import base64
+import select
+import signal
+import time
+
+SD_LISTEN_FDS_START = 3
+# not exposed by Python 2's socket module
+SO_DOMAIN = getattr(socket, "SO_DOMAIN", 39)
+
+READY_TIMEOUT = 60.0
+# time for a process that didn't get ready to exit on SIGTERM
+KILL_TIMEOUT = 5.0
+
+# sockets inherited from the previous process (or systemd), not taken by any
+# source yet: list of (socket, state)
+_inherited = None
+
+#-----------------------------------------------------------------------------
+# receiving end {{{
+
+def _inherited_sockets():
+    global _inherited
+    if _inherited is None:
+        _inherited = _parse_environment()
+    return _inherited
+
+def _parse_environment():
+    # variables are removed, so they're not passed to any children
+    pid = os.environ.pop("LISTEN_PID", None)
+    count = os.environ.pop("LISTEN_FDS", None)
+    os.environ.pop("LISTEN_FDNAMES", None)
+    states = os.environ.pop("LOGDEVD_HANDOFF", None)
+    if pid is None or count is None or int(pid) != os.getpid():
+        return []
+    count = int(count)
+    if states is not None:
+        states = json.loads(states)
+    else:
+        states = [None] * count
+    result = []
+    for i in range(count):
+        fd = SD_LISTEN_FDS_START + i
+        try:
+            result.append((_socket_from_fd(fd), states[i]))
+        except socket.error:
+            pass # not a socket
+    return result
+
+def _socket_from_fd(fd):
+    probe = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        family = probe.getsockopt(socket.SOL_SOCKET, SO_DOMAIN)
+        sock_type = probe.getsockopt(socket.SOL_SOCKET, socket.SO_TYPE)
+    finally:
+        probe.close()
+    sock = socket.fromfd(fd, family, sock_type)
+    os.close(fd)
+    return sock
+
+def _same_address(family, sockname, address):
+    if family == socket.AF_UNIX:
+        return (sockname == address)
+    (host, port) = address[0:2]
+    if sockname[1] != port:
+        return False
+    if host is None or host in ["", "0.0.0.0", "::"]:
+        return sockname[0] in ["0.0.0.0", "::"]
+    try:
+        addresses = socket.getaddrinfo(host, port, family)
+    except socket.gaierror:
+        return False
+    return sockname[0] in [a[4][0] for a in addresses]
+
+def _address_key(sockname):
+    # JSON-compatible form of socket address
+    if isinstance(sockname, tuple):
+        return list(sockname)
+    return sockname
+
+def take_socket(family, sock_type, address):
+    '''
+    :param family: address family (e.g. :const:`socket.AF_INET`)
+    :param sock_type: socket type (e.g. :const:`socket.SOCK_DGRAM`)
+    :param address: address the socket should be bound to (``(host, port)``
+        or path)
+    :return: :obj:`socket.socket` or ``None``
+
+    Find an inherited socket bound to the specified address. The socket is
+    handed to the caller only once.
+    '''
+    inherited = _inherited_sockets()
+    for entry in inherited:
+        (sock, state) = entry
+        if state is not None:
+            continue # accepted connection
+        if sock.family != family or sock.type != sock_type:
+            continue
+        if _same_address(family, sock.getsockname(), address):
+            inherited.remove(entry)
+            return sock
+    return None
+
+def take_connections(listener):
+    '''
+    :param listener: listening socket returned by :func:`take_socket`
+    :return: list of ``(socket, state)`` pairs
+
+    Find the connections accepted on the listening socket by the previous
+    process, along with their state (unprocessed data etc.).
+    '''
+    key = _address_key(listener.getsockname())
+    inherited = _inherited_sockets()
+    result = [e for e in inherited
+              if e[1] is not None and e[1]["listener"] == key]
+    for entry in result:
+        inherited.remove(entry)
+        entry[1]["buffer"] = base64.b64decode(entry[1]["buffer"])
+    return result
+
+def notify_ready():
+    '''
+    :return: ``False`` if the previous process has given up waiting for this
+        one, ``True`` otherwise
+
+    Tell the previous process (if any) that this process is ready to take
+    over and it can exit now. On ``False``, this process must exit without
+    reading anything, as the previous one continues its work.
+    '''
+    fd = os.environ.pop("LOGDEVD_HANDOFF_READY", None)
+    if fd is None:
+        return True
+    try:
+        os.write(int(fd), b"1")
+    except OSError:
+        # EPIPE: the reading end was closed
+        return False
+    finally:
+        os.close(int(fd))
+    return True
+
+# }}}
+#-----------------------------------------------------------------------------
+# sending end {{{
+
+def connection_state(listener, data, **kwargs):
+    '''
+    :param listener: listening socket the connection was accepted on
+    :param data: unprocessed data read from the connection
+    :param kwargs: other JSON-serializable state of the connection
+    :return: state for :func:`spawn`
+
+    Build a description of an accepted connection.
+    '''
+    state = dict(kwargs)
+    state["listener"] = _address_key(listener.getsockname())
+    state["buffer"] = base64.b64encode(data).decode("ascii")
+    return state
+
+def spawn(argv, entries, timeout = READY_TIMEOUT):
+    '''
+    :param argv: command to run (``argv[0]`` must be a path to executable)
+    :param entries: list of ``(socket, state)`` pairs; *state* is ``None``
+        for listening sockets and :func:`connection_state` result for accepted
+        connections
+    :return: ``True`` if the new process reported it's ready, ``False``
+        otherwise
+
+    Start a new process with the sockets passed to it and wait until it's
+    ready. Caller should not read from the sockets in the meantime.
+    '''
+    (ready_r, ready_w) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(ready_r)
+            _exec(argv, entries, ready_w)
+        finally:
+            os._exit(127)
+
+    os.close(ready_w)
+    try:
+        ready = _wait_ready(ready_r, timeout)
+    finally:
+        # a process that gets ready after this finds the pipe closed
+        os.close(ready_r)
+    if not ready:
+        # the process may be only slow (e.g. loading a big rulebase); it
+        # must not start reading next to this one
+        _terminate(pid)
+    else:
+        # with --daemon the spawned process has already exited, leaving the
+        # detached one; otherwise it's still running and gets inherited by
+        # init when this process exits
+        os.waitpid(pid, os.WNOHANG)
+    return ready
+
+def _terminate(pid):
+    os.kill(pid, signal.SIGTERM)
+    deadline = time.time() + KILL_TIMEOUT
+    while time.time() < deadline:
+        (reaped, _status) = os.waitpid(pid, os.WNOHANG)
+        if reaped != 0:
+            return
+        time.sleep(0.05)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+def _wait_ready(ready_r, timeout):
+    deadline = time.time() + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        try:
+            (readable, _w, _x) = select.select([ready_r], [], [], remaining)
+        except select.error:
+            continue # signal
+        if len(readable) == 0:
+            return False
+        # "1" on success, EOF if the process died (or has daemonized and the
+        # detached child died)
+        return (os.read(ready_r, 1) == b"1")
+
+def _exec(argv, entries, ready_fd):
+    # move the descriptors to 3, 4, ..., with the ready pipe right after them
+    fds = [sock.fileno() for (sock, state) in entries] + [ready_fd]
+    start = SD_LISTEN_FDS_START
+    high = [fcntl.fcntl(fd, fcntl.F_DUPFD, start + len(fds)) for fd in fds]
+    for (i, fd) in enumerate(high):
+        os.dup2(fd, start + i)
+    os.closerange(start + len(fds), _max_fd())
+
+    env = dict(os.environ)
+    env["LISTEN_PID"] = str(os.getpid())
+    env["LISTEN_FDS"] = str(len(entries))
+    env["LOGDEVD_HANDOFF"] = json.dumps([state for (sock, state) in entries])
+    env["LOGDEVD_HANDOFF_READY"] = str(start + len(entries))
+    os.execve(argv[0], argv, env)
+
+def _max_fd():
+    try:
+        return os.sysconf("SC_OPEN_MAX")
+    except (ValueError, OSError):
+        return 1024
+
+# }}}
+#-----------------------------------------------------------------------------
+# vim:ft=python:foldmethod=marker
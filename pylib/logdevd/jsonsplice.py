@@ -0,0 +1,105 @@
+#!/usr/bin/python
+'''
+JSON passthrough
+----------------
+
+Log lines that carry a whole JSON hash (``%*:rest%`` rules) don't need to be
+deserialized and serialized back. The hash only needs to be validated, and
+the fields extracted by the rule can be spliced into its serialized form.
+This only works when the hash doesn't have keys named like the fields
+(:func:`mentions_keys`), otherwise the output would have duplicate keys,
+which strict JSON parsers reject.
+
+.. autoclass:: SplicedMessage
+   :members:
+
+.. autofunction:: is_json_hash
+
+.. autofunction:: mentions_keys
+
+'''
+#-----------------------------------------------------------------------------
+
+import json
+
+#-----------------------------------------------------------------------------
+
+# validator that doesn't build dictionaries for JSON objects
+_VALIDATOR = json.JSONDecoder(object_pairs_hook = lambda pairs: None)
+
+def is_json_hash(text):
+    '''
+    :param text: string to check
+    :return: ``True`` or ``False``
+
+    Check if the string is a valid serialized JSON hash.
+    '''
+    text = text.strip()
+    if not text.startswith("{") or not text.endswith("}"):
+        return False
+    try:
+        _VALIDATOR.decode(text)
+        return True
+    except ValueError:
+        return False
+
+def mentions_keys(text, keys):
+    '''
+    :param text: serialized JSON hash
+    :param keys: names of the keys
+    :return: ``True`` or ``False``
+
+    Check if any of the keys appears in the serialized hash as a string. This
+    is a cheap substring check, so a value equal to the key also counts (key
+    written with escape sequences does not).
+    '''
+    for key in keys:
+        if json.dumps(key) in text:
+            return True
+    return False
+
+#-----------------------------------------------------------------------------
+
+class SplicedMessage(dict):
+    '''
+    Message that consists of a serialized JSON hash and additional fields.
+    The hash must not have keys named like the fields (see
+    :func:`mentions_keys`).
+
+    Since the embedded hash is not deserialized, its keys are not visible in
+    the dictionary. Use :meth:`expand` to get the full message.
+    '''
+
+    def __init__(self, json_hash, fields):
+        '''
+        :param json_hash: serialized JSON hash (see :func:`is_json_hash`)
+        :param fields: dictionary with additional fields
+        '''
+        super(SplicedMessage, self).__init__(fields)
+        self.json_hash = json_hash.strip()
+
+    def encode(self):
+        '''
+        :return: serialized JSON hash
+
+        Serialize the message.
+        '''
+        if len(self) == 0:
+            return self.json_hash
+        fields = json.dumps(self, sort_keys = True)
+        if self.json_hash[1:-1].strip() == "":
+            return fields
+        return self.json_hash[:-1].rstrip() + ", " + fields[1:]
+
+    def expand(self):
+        '''
+        :return: dictionary
+
+        Deserialize the embedded hash and merge the fields into it.
+        '''
+        result = json.loads(self.json_hash)
+        result.update(self)
+        return result
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -85,7 +85,7 @@ class SysLogHandler(logging.Handler):
     def emit(self, record):
         priority = SysLogHandler._priority(record.levelname)
         msg = self.format(record)
-        if type(msg) is unicode:
+        if not isinstance(msg, str): # unicode in Python 2
             msg = msg.encode('utf-8')
         syslog.syslog(priority, msg)
 
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+'''
+Sending multiple datagrams at once
+----------------------------------
+
+Wrapper for :manpage:`sendmmsg(2)` system call, which sends several
+datagrams with a single system call. On systems without :manpage:`sendmmsg(2)`
+datagrams are sent one by one.
+
+.. autofunction:: sendmmsg
+
+'''
+#-----------------------------------------------------------------------------
+
+import socket
+import ctypes
+import ctypes.util
+import os
+
+#-----------------------------------------------------------------------------
+
+class _iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_char_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+    _sendmmsg = _libc.sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr),
+                          ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    _sendmmsg = None
+
+#-----------------------------------------------------------------------------
+
+def sendmmsg(sock, datagrams):
+    '''
+    :param sock: connected datagram socket
+    :param datagrams: list of strings
+    :return: number of datagrams sent
+    :throws: :exc:`socket.error` when not even the first datagram could be
+        sent
+
+    Send datagrams through a connected socket. Fewer datagrams than requested
+    may be sent (e.g. when socket's buffer got full).
+    '''
+    if len(datagrams) == 0:
+        return 0
+    if _sendmmsg is None or len(datagrams) == 1:
+        return _send_each(sock, datagrams)
+
+    count = len(datagrams)
+    iovecs = (_iovec * count)()
+    messages = (_mmsghdr * count)()
+    for (i, datagram) in enumerate(datagrams):
+        iovecs[i].iov_base = datagram
+        iovecs[i].iov_len = len(datagram)
+        messages[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+        messages[i].msg_hdr.msg_iovlen = 1
+    result = _sendmmsg(sock.fileno(), messages, count, 0)
+    if result < 0:
+        err = ctypes.get_errno()
+        raise socket.error(err, os.strerror(err))
+    return result
+
+def _send_each(sock, datagrams):
+    sent = 0
+    for datagram in datagrams:
+        try:
+            sock.send(datagram)
+        except socket.error:
+            if sent == 0:
+                raise
+            break
+        sent += 1
+    return sent
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -17,10 +17,12 @@ class Poll:
         for h in handles:
             self.add(h)
 
-    def add(self, handle):
+    def add(self, handle, write = False):
         '''
         :param handle: file handle (e.g. :obj:`file` object, but anything with
           :meth:`fileno` method)
+        :param write: watch the handle for being ready for writing instead of
+          reading
         :return: ``True`` if the handle was added to poll list, ``False``
           otherwise (either handle is not pollable or was already in poll list)
 
@@ -35,7 +37,10 @@ class Poll:
 
         # remember for later
         self._object_map[handle.fileno()] = handle
-        self._poll.register(handle, select.POLLIN)
+        if write:
+            self._poll.register(handle.fileno(), select.POLLOUT)
+        else:
+            self._poll.register(handle.fileno(), select.POLLIN)
         return True
 
     def remove(self, handle):
@@ -52,6 +57,19 @@ class Poll:
         del self._object_map[handle.fileno()]
         self._poll.unregister(handle)
 
+    def discard(self, fd):
+        '''
+        :param fd: file descriptor
+
+        Remove file descriptor from poll list. This is useful for handles
+        whose :meth:`fileno` has already changed (e.g. the handle has
+        reconnected its socket).
+        '''
+        if fd not in self._object_map:
+            return
+        del self._object_map[fd]
+        self._poll.unregister(fd)
+
     def __contains__(self, handle):
         '''
         :param handle: file handle, the same as for :meth:`add`
@@ -76,12 +94,21 @@ class Poll:
         try:
             result = self._poll.poll(timeout)
             return [self._object_map[r[0]] for r in result]
-        except select.error, e:
+        except select.error as e:
             if e.args[0] == errno.EINTR: # in case some signal arrives
                 return []
             else: # other error, rethrow
                 raise
 
+    def handles(self):
+        '''
+        :return: list of file handles added with :meth:`add` method
+
+        List the handles in poll list, e.g. to watch them with a different
+        event loop.
+        '''
+        return list(self._object_map.values())
+
     def count(self):
         '''
         Count the descriptors added to the poll.
@@ -94,5 +121,88 @@ class Poll:
         '''
         return (len(self._object_map) == 0)
 
+#-----------------------------------------------------------------------------
+
+class EPoll(Poll):
+    '''
+    The same as :class:`Poll`, but built on top of :func:`select.epoll`.
+
+    The instance itself has :meth:`fileno` method, which returns a descriptor
+    that is ready for reading when any of the handles is ready, so an
+    :class:`EPoll` can be added to another :class:`Poll`. This way a single
+    log source can watch thousands of connections, while the main loop only
+    watches one descriptor.
+    '''
+
+    def __init__(self, handles = []):
+        self._poll = select.epoll()
+        self._object_map = {}
+
+        for h in handles:
+            self.add(h)
+
+    def add(self, handle):
+        '''
+        :param handle: file handle, the same as for :meth:`Poll.add`
+        :return: ``True`` if the handle was added to poll list, ``False``
+          otherwise
+
+        Add a handle to poll list. See :meth:`Poll.add`.
+        '''
+        if handle.fileno() is None:
+            return False
+        if handle.fileno() in self._object_map:
+            return False
+
+        self._object_map[handle.fileno()] = handle
+        self._poll.register(handle.fileno(), select.EPOLLIN)
+        return True
+
+    def remove(self, handle):
+        '''
+        :param handle: file handle, the same as for :meth:`Poll.add`
+
+        Remove file handle from poll list. See :meth:`Poll.remove`.
+        '''
+        if handle.fileno() is None:
+            return
+        if handle.fileno() not in self._object_map:
+            return
+        del self._object_map[handle.fileno()]
+        self._poll.unregister(handle.fileno())
+
+    def poll(self, timeout = 100):
+        '''
+        :param timeout: timeout in milliseconds for *poll* operation
+        :return: list of file handles added with :meth:`add` method
+
+        Check whether any data arrives on descriptors. See :meth:`Poll.poll`.
+        '''
+        try:
+            result = self._poll.poll(timeout / 1000.0)
+            return [self._object_map[r[0]] for r in result]
+        except IOError as e:
+            if e.errno == errno.EINTR: # in case some signal arrives
+                return []
+            else: # other error, rethrow
+                raise
+
+    def fileno(self):
+        '''
+        Return file descriptor of the epoll object itself.
+        '''
+        if self._poll is None:
+            return None
+        return self._poll.fileno()
+
+    def close(self):
+        '''
+        Close the epoll descriptor. Handles from poll list are not closed.
+        '''
+        if self._poll is not None:
+            self._poll.close()
+            self._poll = None
+        self._object_map.clear()
+
 #-----------------------------------------------------------------------------
 # vim:ft=python
@@ -0,0 +1,330 @@
+#!/usr/bin/python
+'''
+Priority lanes
+--------------
+
+Normally every message is sent to its destinations as soon as it's
+normalized, so when a destination is slow, messages from a chatty program
+hold everything read after them. With priority lanes, messages are first
+put to a queue of their *priority class*, and the queues are emptied in
+weighted round-robin order. In each iteration of the main loop, destinations
+get a limited time (*slice*) to accept messages, and what they don't take is
+left for the next iteration, so reading goes on. A message from a class with
+weight 8 doesn't wait for more than seven messages from any other class with
+weight 1, no matter how many of them are queued.
+
+Priorities are configured with a dictionary::
+
+   {"classes": {"high": {"weight": 8},
+                "normal": {"weight": 4},
+                "bulk": {"weight": 1, "queue_size": 10000,
+                         "overflow": "spool"}},
+    "default": "normal",
+    "rules": [{"match": {"program": ["sshd", "kernel"]}, "class": "high"},
+              {"match": {"tag": "debug"}, "class": "bulk"}]}
+
+Rules have the same ``"match"`` conditions as routes (see
+:mod:`logdevd.routing`), and the first matching rule wins. Messages not
+matched by any rule get the class of their source (``"priority"`` source
+option), or the default class.
+
+When a class' queue is full, queued messages are sent for up to another
+slice, since a burst fills the queue even when destinations are fast. If the
+queue is still full, the next message is handled according to the
+class' ``"overflow"`` policy:
+
+   * ``"block"`` -- send queued messages (of all classes, in the usual
+     order) until there's room; this is what happens without priority lanes
+   * ``"drop-new"`` -- drop the message
+   * ``"drop-old"`` -- drop the oldest queued message of the class
+   * ``"spool"`` -- write the message to a temporary file (in
+     ``"spool_dir"``), to be queued again when the queue becomes empty; the
+     file is limited to ``"spool_size"`` bytes, messages over that are
+     dropped
+
+.. autoclass:: Scheduler
+   :members:
+
+.. autoclass:: Spool
+   :members:
+
+'''
+#-----------------------------------------------------------------------------
+
+import collections
+import json
+import tempfile
+import time
+
+from . import compat
+from . import formats
+from . import routing
+from . import stats
+
+# used when the config doesn't define any classes; dropping messages needs to
+# be configured explicitly
+DEFAULT_CLASSES = {
+    "high": {"weight": 8},
+    "normal": {"weight": 4},
+    "bulk": {"weight": 1},
+}
+
+#-----------------------------------------------------------------------------
+
+class Spool:
+    '''
+    Temporary file with a FIFO of lines. The file is removed when closed.
+    '''
+
+    def __init__(self, directory = None):
+        '''
+        :param directory: directory to create the file in (``None`` means
+            system's default)
+        '''
+        self.file = tempfile.TemporaryFile(prefix = "logdevd-spool.",
+                                           dir = directory)
+        self.count = 0
+        self.size = 0 # bytes written
+        self.read_offset = 0
+
+    def append(self, line):
+        '''
+        :param line: line to store (byte string ending with newline)
+        '''
+        self.file.seek(0, 2)
+        self.file.write(line)
+        self.count += 1
+        self.size += len(line)
+
+    def read(self, count):
+        '''
+        :param count: maximum number of lines to read
+        :return: list of lines
+
+        Read (and remove) the oldest lines.
+        '''
+        # buffered writes need to be flushed before reading
+        self.file.flush()
+        self.file.seek(self.read_offset)
+        result = []
+        while len(result) < count and len(result) < self.count:
+            result.append(self.file.readline())
+        self.read_offset = self.file.tell()
+        self.count -= len(result)
+        if self.count == 0:
+            # everything was read, start over
+            self.file.seek(0)
+            self.file.truncate()
+            self.size = 0
+            self.read_offset = 0
+        return result
+
+    def close(self):
+        self.file.close()
+
+#-----------------------------------------------------------------------------
+
+class Lane:
+    OVERFLOW = ["block", "drop-new", "drop-old", "spool"]
+    QUEUE_SIZE = 10000 # messages
+    SPOOL_SIZE = 1024 * 1024 * 1024 # bytes
+
+    def __init__(self, name, class_def, spool_dir):
+        self.name = name
+        self.weight = int(class_def.get("weight", 1))
+        if self.weight < 1:
+            raise ValueError("weight of priority class %s must be positive" %
+                             (name,))
+        self.queue_size = class_def.get("queue_size", Lane.QUEUE_SIZE)
+        self.overflow = class_def.get("overflow", "block")
+        if self.overflow not in Lane.OVERFLOW:
+            raise ValueError("unrecognized overflow policy: %s" %
+                             (self.overflow,))
+        if self.overflow == "spool":
+            self.spool = Spool(class_def.get("spool_dir", spool_dir))
+            self.spool_size = class_def.get("spool_size", Lane.SPOOL_SIZE)
+        else:
+            self.spool = None
+        # (EncodedMessage, destinations)
+        self.queue = collections.deque()
+        self.stats_prefix = "priority.%s" % (name,)
+
+    def __len__(self):
+        if self.spool is not None:
+            return len(self.queue) + self.spool.count
+        return len(self.queue)
+
+#-----------------------------------------------------------------------------
+
+class Scheduler:
+    '''
+    Queues of priority classes and the order they are emptied in.
+    '''
+
+    SLICE = 0.05 # seconds
+    # messages read back from a spool at once
+    REFILL = 1000
+
+    def __init__(self, priorities_def, destinations, spool_dir = None):
+        '''
+        :param priorities_def: dictionary with priorities definition
+        :param destinations: list of all destinations (messages written to
+            a spool refer to them by position)
+        :param spool_dir: default directory for spool files
+        '''
+        classes = priorities_def.get("classes") or DEFAULT_CLASSES
+        self.lanes = dict(
+            (name, Lane(name, class_def or {}, spool_dir))
+            for (name, class_def) in classes.items()
+        )
+        # order of lanes in a scheduling round; heavier first, so the first
+        # messages after an idle period come from the most important class
+        self.order = sorted(self.lanes.values(),
+                            key = lambda l: (-l.weight, l.name))
+        self.default = priorities_def.get("default", "normal")
+        if self.default not in self.lanes:
+            raise ValueError("unknown default priority class: %s" %
+                             (self.default,))
+        self.slice = priorities_def.get("slice", Scheduler.SLICE)
+        rules = priorities_def.get("rules") or []
+        for rule in rules:
+            if rule.get("class") not in self.lanes:
+                raise ValueError("unknown priority class in rule: %s" %
+                                 (rule.get("class"),))
+        # classification is routing to lanes
+        self.rules = routing.Router(
+            [{"match": r.get("match"), "to": r["class"]} for r in rules],
+            self.lanes,
+        )
+        self.destinations = destinations
+        self.positions = dict((d, i) for (i, d) in enumerate(destinations))
+        # time spent in destinations' send() in the current slice
+        self.send_time = 0.0
+
+    def classify(self, message, priority = None):
+        '''
+        :param message: normalized message
+        :param priority: priority class of message's source or ``None``
+        :return: name of the priority class
+        '''
+        lanes = self.rules.lookup(message)
+        if len(lanes) > 0:
+            return lanes[0].name
+        if priority is not None:
+            return priority
+        return self.default
+
+    def put(self, message, destinations, priority = None):
+        '''
+        :param message: normalized message
+        :param destinations: list of destinations to send the message to
+        :param priority: priority class of message's source or ``None``
+
+        Queue a message in the lane of its priority class.
+        '''
+        lane = self.lanes[self.classify(message, priority)]
+        item = (formats.EncodedMessage(message), destinations)
+        if lane.spool is not None and lane.spool.count > 0:
+            # older messages are already in the spool, so this one goes
+            # there, too
+            self._spool(lane, item)
+            return
+        if len(lane.queue) >= lane.queue_size:
+            self._make_room(lane)
+        if len(lane.queue) >= lane.queue_size:
+            if lane.overflow == "block":
+                while len(lane.queue) >= lane.queue_size:
+                    self._round()
+            elif lane.overflow == "spool":
+                self._spool(lane, item)
+                return
+            elif lane.overflow == "drop-old":
+                lane.queue.popleft()
+                stats.registry.incr(lane.stats_prefix + ".dropped")
+            else: # lane.overflow == "drop-new"
+                stats.registry.incr(lane.stats_prefix + ".dropped")
+                return
+        lane.queue.append(item)
+
+    def pending(self):
+        '''
+        :return: ``True`` if any messages are queued
+        '''
+        for lane in self.order:
+            if len(lane) > 0:
+                return True
+        return False
+
+    def dispatch(self, force = False):
+        '''
+        :param force: send all the queued messages, regardless of the time
+            it takes
+
+        Send queued messages to their destinations, in weighted round-robin
+        order, until the queues are empty or the slice is used up.
+        '''
+        self.send_time = 0.0
+        while self._round() > 0:
+            if not force and self.send_time >= self.slice:
+                break
+        # the next slice is for making room while reading
+        self.send_time = 0.0
+        for lane in self.order:
+            stats.registry.set(lane.stats_prefix + ".queued", len(lane))
+
+    def close(self):
+        '''
+        Remove spool files. Messages still queued are lost.
+        '''
+        for lane in self.order:
+            if lane.spool is not None:
+                lane.spool.close()
+                lane.spool = None
+
+    def _round(self):
+        # single round of weighted round-robin; returns the number of
+        # messages sent
+        sent = 0
+        for lane in self.order:
+            for i in range(lane.weight):
+                if len(lane.queue) == 0 and not self._refill(lane):
+                    break
+                (encoded, destinations) = lane.queue.popleft()
+                for d in destinations:
+                    line = encoded.encode(d.format)
+                    # only time spent in destinations counts as back-pressure
+                    start = time.time()
+                    d.send(line)
+                    self.send_time += time.time() - start
+                sent += 1
+        return sent
+
+    def _make_room(self, lane):
+        while len(lane.queue) >= lane.queue_size and \
+              self.send_time < self.slice:
+            self._round()
+
+    def _spool(self, lane, item):
+        (encoded, destinations) = item
+        positions = ",".join(str(self.positions[d]) for d in destinations)
+        line = compat.to_bytes(positions) + b" " + encoded.encode("json") + \
+               b"\n"
+        if lane.spool.size + len(line) > lane.spool_size:
+            stats.registry.incr(lane.stats_prefix + ".dropped")
+            return
+        lane.spool.append(line)
+        stats.registry.incr(lane.stats_prefix + ".spooled")
+
+    def _refill(self, lane):
+        if lane.spool is None or lane.spool.count == 0:
+            return False
+        for line in lane.spool.read(Scheduler.REFILL):
+            (positions, data) = line.rstrip(b"\n").split(b" ", 1)
+            destinations = [self.destinations[int(p)]
+                            for p in positions.split(b",")]
+            message = json.loads(compat.to_str(data, "ascii"))
+            lane.queue.append((formats.EncodedMessage(message), destinations))
+        return True
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,363 @@
+#!/usr/bin/python
+'''
+Rulebase profiling
+------------------
+
+Running a rulebase over a sample of logs (a *corpus*) tells which rules are
+hot, which are dead, which programs are expensive to normalize, and what
+the lines that no rule matches look like. This is what
+``logdevd --profile-rules`` prints.
+
+*liblognorm* doesn't report which rule matched a line, so a match is
+attributed by its shape: tags and field names of the result are compared
+with the tags and field names of each rule (:class:`RuleIndex`). Rules that
+produce the same tags and fields (e.g. rules with only unnamed fields) can't
+be told apart and are counted as a group.
+
+Unparsed lines are grouped by their shape (:func:`line_shape`): numbers,
+IP addresses and long hex strings are replaced with placeholders, and the
+syslog header before the program name is dropped.
+
+.. autoclass:: RuleIndex
+   :members:
+
+.. autoclass:: Profile
+   :members:
+
+.. autofunction:: profile
+
+.. autofunction:: line_shape
+
+'''
+#-----------------------------------------------------------------------------
+
+import os
+import re
+import json
+import time
+
+from . import rulebase
+from . import sources
+
+# field in a rule: "%name:type%" or "%{"name": ..., ...}%"
+_FIELD = re.compile(r'%([^%]*)%')
+_JSON_NAME = re.compile(r'"name"\s*:\s*"([^"]*)"')
+
+_SHAPE_MASKS = [
+    (re.compile(r'\b\d{1,3}(?:\.\d{1,3}){3}\b'), "<ip>"),
+    (re.compile(r'\b(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{8,}\b'), "<hex>"),
+    (re.compile(r'\d+'), "#"),
+]
+
+#-----------------------------------------------------------------------------
+
+def line_shape(line):
+    '''
+    :param line: log line
+    :return: string
+
+    Reduce a log line to its shape, so lines differing only in variable
+    parts (numbers, addresses) compare equal.
+    '''
+    end = line.find(": ")
+    if end > 0:
+        # start at program name (see logdevd.rulebase.line_program())
+        line = line[line.rfind(" ", 0, end) + 1:]
+    for (regexp, placeholder) in _SHAPE_MASKS:
+        line = regexp.sub(placeholder, line)
+    return line
+
+def _fields(pattern):
+    result = set()
+    for field in _FIELD.findall(pattern):
+        if field.startswith("{"):
+            match = _JSON_NAME.search(field)
+            name = match.group(1) if match is not None else "-"
+        else:
+            name = field.split(":", 1)[0]
+        if name != "-":
+            result.add(name)
+    return result
+
+#-----------------------------------------------------------------------------
+
+class RuleIndex:
+    '''
+    Rules of a rulebase, with their tags and fields.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: path to the rulebase
+        '''
+        # list of (location, rule line)
+        self.rules = []
+        # list of lists of indices to self.rules; a group is what a match can
+        # be attributed to
+        self.groups = []
+        # frozenset(tags) -> list of (frozenset(fields), group index)
+        self._signatures = {}
+        # (tags, keys) of a result -> group index (or None)
+        self._memo = {}
+
+        groups = {}
+        prefix_fields = set()
+        for (filename, number, line) in rulebase.rulebase_lines(path):
+            if line.startswith("prefix="):
+                prefix_fields = _fields(line[7:])
+                continue
+            if not line.startswith("rule="):
+                continue
+            (tags, pattern) = (line[5:].split(":", 1) + [""])[0:2]
+            tags = frozenset(t.strip() for t in tags.split(",") if t.strip())
+            fields = frozenset(prefix_fields | _fields(pattern))
+            self.rules.append(("%s:%d" % (filename, number), line))
+            key = (tags, fields)
+            if key not in groups:
+                groups[key] = len(self.groups)
+                self.groups.append([])
+                self._signatures.setdefault(tags, []).append(
+                    (fields, groups[key])
+                )
+            self.groups[groups[key]].append(len(self.rules) - 1)
+        # the most specific rule first
+        for candidates in self._signatures.values():
+            candidates.sort(key = lambda c: -len(c[0]))
+
+    def match(self, result):
+        '''
+        :param result: normalization result (dictionary)
+        :return: index of rule group or ``None``
+
+        Find the group of rules that could have produced the result. Fields
+        added by annotations are allowed.
+        '''
+        tags = result.get("event.tags") or []
+        memo_key = (tuple(tags), tuple(sorted(result)))
+        try:
+            return self._memo[memo_key]
+        except KeyError:
+            pass
+        keys = set(result)
+        keys.discard("event.tags")
+        group = None
+        for (fields, index) in self._signatures.get(frozenset(tags), []):
+            if fields <= keys:
+                group = index
+                break
+        self._memo[memo_key] = group
+        return group
+
+#-----------------------------------------------------------------------------
+
+class Profile:
+    '''
+    Counters collected while normalizing a corpus.
+    '''
+
+    def __init__(self, groups):
+        '''
+        :param groups: number of rule groups (see :class:`RuleIndex`)
+        '''
+        self.lines = 0
+        self.unparsed = 0
+        self.unattributed = 0
+        self.time = 0.0
+        self.groups = [0] * groups
+        self.tags = {}
+        # program -> [lines, unparsed, time]
+        self.programs = {}
+        self.shapes = {}
+
+    def add(self, line, result, elapsed, group):
+        '''
+        :param line: normalized line
+        :param result: normalization result
+        :param elapsed: time the normalization took
+        :param group: rule group the result was attributed to
+        '''
+        self.lines += 1
+        self.time += elapsed
+        program = rulebase.line_program(line) or "-"
+        counters = self.programs.get(program)
+        if counters is None:
+            counters = self.programs[program] = [0, 0, 0.0]
+        counters[0] += 1
+        counters[2] += elapsed
+        if "unparsed-data" in result:
+            self.unparsed += 1
+            counters[1] += 1
+            shape = line_shape(line)
+            self.shapes[shape] = self.shapes.get(shape, 0) + 1
+            return
+        for tag in result.get("event.tags") or []:
+            self.tags[tag] = self.tags.get(tag, 0) + 1
+        if group is None:
+            self.unattributed += 1
+        else:
+            self.groups[group] += 1
+
+    def to_json(self):
+        return json.dumps(self.__dict__)
+
+    def merge_json(self, data):
+        '''
+        :param data: result of :meth:`to_json` of another profile
+
+        Add counters from another profile.
+        '''
+        other = json.loads(data)
+        self.lines += other["lines"]
+        self.unparsed += other["unparsed"]
+        self.unattributed += other["unattributed"]
+        self.time += other["time"]
+        for (i, count) in enumerate(other["groups"]):
+            self.groups[i] += count
+        for (tag, count) in other["tags"].items():
+            self.tags[tag] = self.tags.get(tag, 0) + count
+        for (program, counters) in other["programs"].items():
+            mine = self.programs.setdefault(program, [0, 0, 0.0])
+            for i in range(3):
+                mine[i] += counters[i]
+        for (shape, count) in other["shapes"].items():
+            self.shapes[shape] = self.shapes.get(shape, 0) + count
+
+    def report(self, index, top = 20):
+        '''
+        :param index: :class:`RuleIndex` the profile was collected with
+        :param top: number of programs and unparsed shapes to list
+        :return: report (string)
+        '''
+        lines = max(self.lines, 1)
+        out = []
+        out.append("lines: %d, unparsed: %d (%.1f%%), %.1f us/line" % (
+            self.lines, self.unparsed, 100.0 * self.unparsed / lines,
+            1e6 * self.time / lines,
+        ))
+
+        out.append("")
+        out.append("rules (matches, %, location, rule):")
+        order = sorted(range(len(index.groups)),
+                       key = lambda g: (-self.groups[g], index.groups[g][0]))
+        for group in order:
+            count = self.groups[group]
+            for (i, rule) in enumerate(index.groups[group]):
+                (location, text) = index.rules[rule]
+                if i == 0:
+                    prefix = "%10d %5.1f%%" % (count, 100.0 * count / lines)
+                else:
+                    prefix = "%10s %6s" % ("", "")
+                if count == 0:
+                    location += " (dead)"
+                out.append("%s  %s  %s" % (prefix, location, text[:100]))
+        if self.unattributed > 0:
+            out.append("%10d %5.1f%%  (matches not attributed to any rule)" % (
+                self.unattributed, 100.0 * self.unattributed / lines,
+            ))
+
+        out.append("")
+        out.append("tags (matches, tag):")
+        for (tag, count) in sorted(self.tags.items(), key = lambda t: -t[1]):
+            out.append("%10d  %s" % (count, tag))
+
+        out.append("")
+        out.append("programs (lines, unparsed %, us/line, total s, program):")
+        programs = sorted(self.programs.items(), key = lambda p: -p[1][2])
+        for (program, (count, unparsed, elapsed)) in programs[:top]:
+            out.append("%10d %6.1f%% %9.1f %9.3f  %s" % (
+                count, 100.0 * unparsed / count, 1e6 * elapsed / count,
+                elapsed, program,
+            ))
+
+        out.append("")
+        out.append("unparsed shapes (lines, shape):")
+        shapes = sorted(self.shapes.items(), key = lambda s: -s[1])
+        for (shape, count) in shapes[:top]:
+            out.append("%10d  %s" % (count, shape))
+        return "".join(l + "\n" for l in out)
+
+#-----------------------------------------------------------------------------
+
+def profile(corpus, normalizer, index, prepare, jobs = 1):
+    '''
+    :param corpus: path to a log file (plain or gzip-compressed)
+    :param normalizer: normalizer to profile
+    :type normalizer: :class:`liblognorm.Lognorm` or
+      :class:`logdevd.rulebase.ShardedLognorm`
+    :param index: :class:`RuleIndex` for the normalizer's rulebase
+    :param prepare: function that turns a line read from the corpus into
+      a line for the normalizer (sanitization, decoding)
+    :param jobs: number of processes to run
+    :return: :class:`Profile`
+
+    Normalize all the lines of the corpus, collecting statistics. With
+    *jobs* greater than 1, lines are distributed among child processes
+    (each of them reads the whole corpus, but normalizes only every
+    *jobs*-th line).
+    '''
+    result = Profile(len(index.groups))
+    if jobs <= 1:
+        _profile_part(corpus, normalizer, index, prepare, 0, 1, result)
+        return result
+
+    children = []
+    for part in range(jobs):
+        (read_fd, write_fd) = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                os.close(read_fd)
+                partial = Profile(len(index.groups))
+                _profile_part(corpus, normalizer, index, prepare,
+                              part, jobs, partial)
+                data = partial.to_json().encode("utf-8")
+                while len(data) > 0:
+                    data = data[os.write(write_fd, data):]
+                exit_code = 0
+            finally:
+                os._exit(exit_code)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    failed = False
+    for (pid, read_fd) in children:
+        chunks = []
+        while True:
+            chunk = os.read(read_fd, 65536)
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+        os.close(read_fd)
+        (_pid, status) = os.waitpid(pid, 0)
+        if status != 0:
+            failed = True
+            continue
+        result.merge_json(b"".join(chunks).decode("utf-8"))
+    if failed:
+        raise RuntimeError("some profiling processes failed")
+    return result
+
+def _profile_part(corpus, normalizer, index, prepare, part, jobs, result):
+    for (number, line) in enumerate(_corpus_lines(corpus)):
+        if number % jobs != part:
+            continue
+        line = prepare(line)
+        start = time.time()
+        normalized = normalizer.normalize(line)
+        elapsed = time.time() - start
+        result.add(line, normalized, elapsed, index.match(normalized))
+
+def _corpus_lines(corpus):
+    reader = sources.ArchiveReader(corpus)
+    try:
+        for line in reader.readlines():
+            yield line
+        line = reader.finish()
+        if line is not None:
+            yield line
+    finally:
+        reader.close()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+'''
+Rate limiting
+-------------
+
+Limiting the number of log lines that get normalized and sent, so a single
+misbehaving program can't eat all the CPU. Lines are limited before
+normalization, either with a token bucket (lines per second with allowed
+burst) or with a sampler (every N-th line), or both. Limits can be applied to
+a source as a whole or separately to each program (see
+:func:`logdevd.rulebase.line_program`).
+
+.. autoclass:: RateLimiter
+   :members:
+
+.. autoclass:: TokenBucket
+   :members:
+
+.. autoclass:: Sampler
+   :members:
+
+'''
+#-----------------------------------------------------------------------------
+
+from . import compat
+from . import rulebase
+from . import stats
+
+#-----------------------------------------------------------------------------
+
+class TokenBucket:
+    '''
+    Token bucket, refilled at constant rate, up to its size.
+    '''
+
+    def __init__(self, rate, burst, now):
+        '''
+        :param rate: tokens per second
+        :param burst: maximum number of tokens
+        :param now: current time (epoch)
+        '''
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = now
+
+    def take(self, now):
+        '''
+        :param now: current time (epoch)
+        :return: ``True`` if a token was available, ``False`` otherwise
+        '''
+        if now > self.last:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class Sampler:
+    '''
+    Deterministic 1-in-N sampler (first line passes, then every N-th).
+    '''
+
+    def __init__(self, n):
+        '''
+        :param n: sampling interval
+        '''
+        self.n = n
+        self.seen = 0
+
+    def take(self):
+        '''
+        :return: ``True`` if the line passes, ``False`` otherwise
+        '''
+        passes = (self.seen % self.n == 0)
+        self.seen += 1
+        return passes
+
+#-----------------------------------------------------------------------------
+
+class RateLimiter:
+    '''
+    Rate limiter for a single log source.
+    '''
+
+    # limit for number of separately limited programs, so random garbage in
+    # program name position can't eat all the memory; the lines from programs
+    # beyond this limit are limited together
+    MAX_KEYS = 10000
+
+    class Limit:
+        def __init__(self, params, now):
+            if params.get("rate") is not None:
+                rate = float(params["rate"])
+                burst = float(params.get("burst", rate))
+                self.bucket = TokenBucket(rate, burst, now)
+            else:
+                self.bucket = None
+            if params.get("sample") is not None:
+                self.sampler = Sampler(int(params["sample"]))
+            else:
+                self.sampler = None
+            self.suppressed = 0
+
+        def admit(self, now):
+            if self.sampler is not None and not self.sampler.take():
+                self.suppressed += 1
+                return False
+            if self.bucket is not None and not self.bucket.take(now):
+                self.suppressed += 1
+                return False
+            return True
+
+    def __init__(self, config, now):
+        '''
+        :param config: dictionary with ``"rate"``, ``"burst"``, ``"sample"``,
+          ``"by_program"``, ``"programs"``, and ``"summary_interval"`` keys
+          (all optional)
+        :param now: current time (epoch)
+        '''
+        self.params = {
+            "rate": config.get("rate"),
+            "burst": config.get("burst"),
+            "sample": config.get("sample"),
+        }
+        if self.params["burst"] is None:
+            del self.params["burst"]
+        self.programs = config.get("programs") or {}
+        self.by_program = config.get("by_program", False)
+        self.summary_interval = float(config.get("summary_interval", 10))
+        self.last_summary = now
+        self.limits = {}
+
+    def _key(self, line):
+        if not self.by_program and len(self.programs) == 0:
+            return None
+        program = rulebase.line_program(line)
+        if program is not None:
+            program = compat.to_str(program)
+        if program in self.programs:
+            return program
+        if self.by_program and (program in self.limits or
+                                len(self.limits) < RateLimiter.MAX_KEYS):
+            return program
+        return None
+
+    def admit(self, line, now):
+        '''
+        :param line: log line
+        :param now: current time (epoch)
+        :return: ``True`` if the line should be processed, ``False`` if it
+          should be dropped
+        '''
+        key = self._key(line)
+        limit = self.limits.get(key)
+        if limit is None:
+            params = self.programs.get(key, self.params)
+            limit = self.limits[key] = RateLimiter.Limit(params, now)
+        if limit.admit(now):
+            return True
+        stats.registry.incr("ratelimit.suppressed")
+        return False
+
+    def summary(self, now):
+        '''
+        :param now: current time (epoch)
+        :return: list of ``(program, suppressed)`` pairs (*program* is
+          ``None`` for the source as a whole)
+
+        Return number of lines suppressed since the last summary, once per
+        summary interval. Empty list is returned if it's not the time yet or
+        nothing was suppressed.
+        '''
+        if now - self.last_summary < self.summary_interval:
+            return []
+        self.last_summary = now
+        result = []
+        for (key, limit) in self.limits.items():
+            if limit.suppressed > 0:
+                result.append((key, limit.suppressed))
+                limit.suppressed = 0
+        return result
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+'''
+Routing messages to destinations
+--------------------------------
+
+By default every message is sent to every destination. Routes allow to send
+messages to selected destinations, depending on message's ``"program"``
+field, its tags (``"event.tags"`` field), and whether the log line was
+parsed or not.
+
+Route definition is a dictionary::
+
+   {"match": {"program": "dhcpd", "tag": ["dhcp"], "unparsed": false},
+     "to": ["dhcp_collector"]}
+
+All the conditions in ``"match"`` need to be met (``"program"`` and
+``"tag"`` can be a single string or a list of strings, of which any must
+match). Route without ``"match"`` matches all messages. The first matching
+route wins. Messages that don't match any route are dropped.
+
+.. autoclass:: Router
+   :members:
+
+'''
+#-----------------------------------------------------------------------------
+
+from . import stats
+
+#-----------------------------------------------------------------------------
+
+class Route:
+    MATCH_KEYS = set(["program", "tag", "unparsed"])
+
+    def __init__(self, route_def, destinations):
+        match = route_def.get("match") or {}
+        unknown = set(match) - Route.MATCH_KEYS
+        if len(unknown) > 0:
+            raise ValueError("unrecognized route condition: %s" %
+                             (", ".join(sorted(unknown)),))
+        self.programs = _set_or_none(match.get("program"))
+        self.tags = _set_or_none(match.get("tag"))
+        self.unparsed = match.get("unparsed")
+        self.destinations = []
+        for name in _listify(route_def.get("to", [])):
+            if name not in destinations:
+                raise ValueError("unknown destination in route: %s" % (name,))
+            self.destinations.append(destinations[name])
+
+    def matches(self, program, tags, unparsed):
+        if self.programs is not None and program not in self.programs:
+            return False
+        if self.tags is not None and self.tags.isdisjoint(tags):
+            return False
+        if self.unparsed is not None and self.unparsed != unparsed:
+            return False
+        return True
+
+#-----------------------------------------------------------------------------
+
+class Router:
+    '''
+    Compiled routing table.
+    '''
+
+    # routing decision only depends on (program, tags, unparsed) triple, so
+    # the decisions are remembered; this is the limit of how many of them
+    CACHE_SIZE = 4096
+
+    def __init__(self, route_defs, destinations):
+        '''
+        :param route_defs: list of route definitions
+        :param destinations: dictionary of named destinations
+        '''
+        self.routes = [Route(r, destinations) for r in route_defs]
+        self._cache = {}
+
+    def route(self, message):
+        '''
+        :param message: message to route
+        :return: list of destinations
+        '''
+        result = self.lookup(message)
+        if len(result) == 0:
+            stats.registry.incr("routing.unrouted")
+        return result
+
+    def lookup(self, message):
+        '''
+        :param message: message to route
+        :return: list of destinations
+
+        Find destinations for the message, without counting unrouted
+        messages.
+        '''
+        tags = message.get("event.tags")
+        if tags:
+            tags = tuple(tags)
+        else:
+            tags = ()
+        unparsed = ("originalmsg" in message and "unparsed-data" in message)
+        key = (message.get("program"), tags, unparsed)
+        try:
+            result = self._cache[key]
+        except KeyError:
+            result = self._find(*key)
+            if len(self._cache) >= Router.CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = result
+        except TypeError:
+            # unhashable "program" field (list or hash); it won't match any
+            # of the programs anyway
+            result = self._find(None, tags, unparsed)
+        return result
+
+    def _find(self, program, tags, unparsed):
+        for route in self.routes:
+            if route.matches(program, tags, unparsed):
+                return route.destinations
+        return []
+
+def _listify(value):
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+def _set_or_none(value):
+    if value is None:
+        return None
+    return set(_listify(value))
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,302 @@
+#!/usr/bin/python
+'''
+Loading liblognorm rulebases
+----------------------------
+
+Building a normalizer from a big rulebase takes a while, and the parsing is
+stopped for this time. :class:`RulebaseCache` remembers the already built
+normalizers, so reloading the daemon's configuration only builds a new
+normalizer if the rulebase has changed.
+
+.. autoclass:: RulebaseCache
+   :members:
+
+.. autoclass:: ShardedLognorm
+   :members:
+
+.. autofunction:: split_rulebase
+
+.. autofunction:: rulebase_lines
+
+.. autofunction:: rulebase_files
+
+.. autofunction:: rulebase_digest
+
+'''
+#-----------------------------------------------------------------------------
+
+import os
+import re
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import liblognorm
+
+from . import compat
+from . import stats
+
+#-----------------------------------------------------------------------------
+
+def include_path(path):
+    '''
+    :param path: path from ``include=`` line of a rulebase
+
+    Resolve path to an included rulebase the same way as *liblognorm* does
+    (relative paths are looked for in :envvar:`$LIBLOGNORM_RULEBASES`
+    directory, if it's set).
+    '''
+    if not os.path.isabs(path) and "LIBLOGNORM_RULEBASES" in os.environ:
+        return os.path.join(os.environ["LIBLOGNORM_RULEBASES"], path)
+    return path
+
+def rulebase_files(path):
+    '''
+    :param path: path to the rulebase
+    :return: list of paths
+
+    List rulebase file and all the files it includes (directly or
+    indirectly), in the order they are included.
+    '''
+    result = []
+    pending = [path]
+    while len(pending) > 0:
+        filename = pending.pop(0)
+        if filename in result:
+            continue # include loop; liblognorm will complain about it
+        result.append(filename)
+        try:
+            with open(filename) as f:
+                for line in f:
+                    if line.startswith("include="):
+                        pending.append(include_path(line[8:].strip()))
+        except (IOError, OSError):
+            pass # missing files are reported by liblognorm
+    return result
+
+def rulebase_digest(path):
+    '''
+    :param path: path to the rulebase
+    :return: hex digest
+
+    Compute digest of the rulebase and all the files it includes.
+    '''
+    digest = hashlib.sha1()
+    for filename in rulebase_files(path):
+        digest.update(compat.to_bytes(filename) + b"\0")
+        try:
+            with open(filename, "rb") as f:
+                digest.update(f.read())
+        except (IOError, OSError):
+            digest.update(b"\0missing\0")
+    return digest.hexdigest()
+
+#-----------------------------------------------------------------------------
+# splitting rulebase by program name {{{
+
+# literal program name at the beginning of a rule, followed by "[" (PID) or
+# ":" (end of syslog tag)
+_RULE_PROGRAM = re.compile(r'^([^\s\[:%\\]+)[\[:]')
+
+def rule_program(rule_line):
+    '''
+    :param rule_line: ``rule=...`` line from the rulebase
+    :return: program name or ``None``
+
+    Extract program name from a rule, if the rule starts with a literal one.
+    '''
+    parts = rule_line[5:].split(":", 1) # "rule=tags:body"
+    if len(parts) < 2:
+        return None
+    match = _RULE_PROGRAM.match(parts[1])
+    if match is None:
+        return None
+    return match.group(1)
+
+def line_program(line):
+    '''
+    :param line: log line (byte string or text)
+    :return: program name (of the same type as *line*) or ``None``
+
+    Extract program name from a syslog line (``"... program[pid]: ..."`` or
+    ``"... program: ..."``), looking for the first ``": "`` in the line.
+    '''
+    if isinstance(line, bytes):
+        (colon, space, bracket) = (b": ", b" ", b"[")
+    else:
+        (colon, space, bracket) = (": ", " ", "[")
+    end = line.find(colon)
+    if end <= 0:
+        return None
+    start = line.rfind(space, 0, end) + 1
+    pid = line.find(bracket, start, end)
+    if pid >= 0:
+        end = pid
+    return line[start:end]
+
+def rulebase_lines(path, seen = None):
+    '''
+    :param path: path to the rulebase
+    :return: iterator of ``(path, line_number, line)`` tuples
+
+    Read rulebase lines, with all the included files inlined.
+    '''
+    if seen is None:
+        seen = set()
+    seen.add(path)
+    with open(path) as f:
+        for (number, line) in enumerate(f, 1):
+            if line.startswith("include="):
+                included = include_path(line[8:].strip())
+                if included not in seen:
+                    for entry in rulebase_lines(included, seen):
+                        yield entry
+            else:
+                yield (path, number, line.rstrip("\n"))
+
+def split_rulebase(path):
+    '''
+    :param path: path to the rulebase
+    :return: dictionary with program names as keys and rulebase contents
+      (strings) as values
+
+    Split rulebase into smaller ones, one for each program name that rules
+    start with. Rules that don't start with a program name are omitted. All
+    included files are inlined.
+    '''
+    header = []
+    annotations = []
+    rules = {}
+    prefix = None
+    for (_path, _number, line) in rulebase_lines(path):
+        if line.strip() == "" or line.lstrip().startswith("#"):
+            continue
+        elif line.startswith("prefix="):
+            prefix = line
+        elif line.startswith("rule="):
+            program = rule_program(line)
+            if program is not None:
+                rules.setdefault(program, []).append((prefix, line))
+        elif line.startswith("annotate="):
+            annotations.append(line)
+        else:
+            # "version=", "type=", and anything else that's not specific to
+            # rules
+            header.append(line)
+
+    result = {}
+    for (program, program_rules) in rules.items():
+        lines = header[:]
+        last_prefix = None
+        for (prefix, rule) in program_rules:
+            if prefix != last_prefix:
+                lines.append(prefix or "prefix=")
+                last_prefix = prefix
+            lines.append(rule)
+        lines.extend(annotations)
+        result[program] = "".join(l + "\n" for l in lines)
+    return result
+
+# }}}
+#-----------------------------------------------------------------------------
+
+class ShardedLognorm:
+    '''
+    Normalizer that dispatches log lines by program name to smaller
+    normalizers, each built only from the rules for that program. Lines with
+    unknown program name and lines not recognized by the smaller normalizer
+    are normalized with the full rulebase, so the results are the same as
+    with the full rulebase alone.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: path to the rulebase
+        '''
+        self.full = liblognorm.Lognorm(path)
+        self.shards = {}
+        shards_dir = tempfile.mkdtemp(prefix = "logdevd.")
+        try:
+            for (program, content) in split_rulebase(path).items():
+                shard_file = os.path.join(shards_dir, "shard.rules")
+                with open(shard_file, "w") as f:
+                    f.write(content)
+                self.shards[program] = liblognorm.Lognorm(shard_file)
+        finally:
+            shutil.rmtree(shards_dir, ignore_errors = True)
+
+    def normalize(self, line):
+        '''
+        :param line: log line
+        :return: dictionary
+
+        Normalize a log line, the same way as :class:`liblognorm.Lognorm`.
+        '''
+        shard = self.shards.get(line_program(line))
+        if shard is not None:
+            result = shard.normalize(line)
+            if "unparsed-data" not in result:
+                return result
+        return self.full.normalize(line)
+
+#-----------------------------------------------------------------------------
+
+class RulebaseCache:
+    '''
+    Normalizers built from rulebases, keyed by rulebase's content digest.
+    '''
+
+    def __init__(self):
+        self._normalizers = {}
+        # keys requested since last expire() call
+        self._used = set()
+
+    def load(self, path, sharded = False):
+        '''
+        :param path: path to the rulebase
+        :param sharded: whether to build :class:`ShardedLognorm` instead of
+          plain normalizer
+        :return: :class:`liblognorm.Lognorm` or :class:`ShardedLognorm`
+          instance
+
+        Get a normalizer for specified rulebase, building it only if
+        necessary.
+        '''
+        logger = logging.getLogger("rulebase")
+        key = (rulebase_digest(path), sharded)
+        self._used.add(key)
+        if key in self._normalizers:
+            logger.info("rulebase %s unchanged, reusing it", path)
+            stats.registry.incr("rulebase.reused")
+            return self._normalizers[key]
+
+        start = time.time()
+        if sharded:
+            normalizer = ShardedLognorm(path)
+        else:
+            normalizer = liblognorm.Lognorm(path)
+        load_time = time.time() - start
+        if sharded:
+            logger.info("rulebase %s loaded in %.3fs (%d shards)",
+                        path, load_time, len(normalizer.shards))
+        else:
+            logger.info("rulebase %s loaded in %.3fs", path, load_time)
+        stats.registry.incr("rulebase.loaded")
+        stats.registry.set("rulebase.load_time", load_time)
+
+        self._normalizers[key] = normalizer
+        return normalizer
+
+    def expire(self):
+        '''
+        Forget normalizers that were not requested with :meth:`load` since
+        last call to this method.
+        '''
+        for key in list(self._normalizers):
+            if key not in self._used:
+                del self._normalizers[key]
+        self._used.clear()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
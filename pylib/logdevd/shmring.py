@@ -0,0 +1,261 @@
+#!/usr/bin/python
+'''
+Shared memory ring buffer
+-------------------------
+
+Single-producer, single-consumer ring buffer in a memory-mapped file
+(typically in :file:`/dev/shm`), for sending log messages to
+*logdevourer* from the same host without a system call per message.
+
+*logdevourer* creates the ring (:class:`Consumer`, used by ``{"proto": "shm"}``
+log source), and an application attaches to it with :class:`Producer`::
+
+   import logdevd.shmring
+   ring = logdevd.shmring.Producer("/dev/shm/logdevd.ring")
+   if not ring.send("app[1234]: something happened"):
+       pass # ring is full; message was not sent
+
+This module only uses the standard library, and importing it doesn't load
+the rest of the daemon, so applications don't need *liblognorm* or *yaml*.
+
+Consumer that ran out of messages marks itself waiting and sleeps on
+a *doorbell*, a datagram unix socket whose address is stored in the ring's
+header. Producer that finds the consumer waiting sends a single byte to the
+doorbell, so a stream of messages costs a wakeup only when the consumer has
+caught up.
+
+Ring layout (all integers little endian):
+
+   * offset 0: magic ``"LDRING01"``
+   * offset 8: capacity of the data area (8 bytes)
+   * offset 64: write position, updated by the producer (8 bytes)
+   * offset 128: read position, updated by the consumer (8 bytes)
+   * offset 192: "consumer waiting" flag (4 bytes)
+   * offset 256: doorbell socket path (NUL-terminated)
+   * offset 4096: data area
+
+Positions grow monotonically and are taken modulo capacity. Each record is
+its length (4 bytes) followed by the message, padded to 4 bytes. A record
+never wraps around the end of the data area; length ``0xFFFFFFFF`` marks the
+unused space at the end, and the next record starts at the beginning.
+
+.. note::
+   The ring relies on stores being visible to the other process in program
+   order (true for x86). Wakeups can be lost regardless: :meth:`Consumer.read`
+   sets the waiting flag after it has sampled the write position, so
+   a message written in between doesn't ring the doorbell. Such a message is
+   not stuck, though, as the main loop checks :meth:`Consumer.pending` in
+   each iteration (at least every 250ms) and reads the ring without waiting
+   for the doorbell.
+
+.. autoclass:: Producer
+   :members:
+
+.. autoclass:: Consumer
+   :members:
+
+'''
+#-----------------------------------------------------------------------------
+
+import mmap
+import os
+import socket
+import struct
+
+MAGIC = b"LDRING01"
+HEADER_SIZE = 4096
+CAPACITY = 4 * 1024 * 1024
+
+_CAPACITY_OFFSET = 8
+_HEAD_OFFSET = 64
+_TAIL_OFFSET = 128
+_WAITING_OFFSET = 192
+_DOORBELL_OFFSET = 256
+_DOORBELL_SIZE = 256
+
+_PAD = 0xFFFFFFFF
+
+def _align(size):
+    return (size + 3) & ~3
+
+#-----------------------------------------------------------------------------
+
+class _Ring(object):
+    def __init__(self, path, fd):
+        self.path = path
+        size = os.fstat(fd).st_size
+        self.map = mmap.mmap(fd, size)
+        if self.map[0:len(MAGIC)] != MAGIC:
+            self.map.close()
+            raise ValueError("%s is not a ring buffer" % (path,))
+        self.capacity = self._get("<Q", _CAPACITY_OFFSET)
+        if HEADER_SIZE + self.capacity > size:
+            self.map.close()
+            raise ValueError("%s is truncated" % (path,))
+
+    def _get(self, fmt, offset):
+        return struct.unpack_from(fmt, self.map, offset)[0]
+
+    def _set(self, fmt, offset, value):
+        struct.pack_into(fmt, self.map, offset, value)
+
+    def doorbell(self):
+        path = self.map[_DOORBELL_OFFSET:_DOORBELL_OFFSET + _DOORBELL_SIZE]
+        return path.split(b"\0", 1)[0]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+#-----------------------------------------------------------------------------
+
+class Producer(_Ring):
+    '''
+    Writing end of the ring. Only one producer may write to a ring at a time.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: path to the ring file (created by *logdevourer*)
+        '''
+        fd = os.open(path, os.O_RDWR)
+        try:
+            super(Producer, self).__init__(path, fd)
+        finally:
+            os.close(fd)
+        self.bell = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.bell.setblocking(0)
+
+    def send(self, message):
+        '''
+        :param message: message to send (byte string; text is encoded to
+            UTF-8)
+        :return: ``True`` if the message was written, ``False`` if there was
+            not enough free space in the ring
+
+        Write a message to the ring and wake up the consumer if necessary.
+        '''
+        if not isinstance(message, bytes):
+            message = message.encode("utf-8")
+        record = 4 + _align(len(message))
+        if record > self.capacity / 2:
+            raise ValueError("message too large for the ring")
+        head = self._get("<Q", _HEAD_OFFSET)
+        tail = self._get("<Q", _TAIL_OFFSET)
+        offset = head % self.capacity
+        contiguous = self.capacity - offset
+        if record <= contiguous:
+            needed = record
+        else:
+            needed = contiguous + record
+        if self.capacity - (head - tail) < needed:
+            return False
+
+        if record > contiguous:
+            self._set("<I", HEADER_SIZE + offset, _PAD)
+            head += contiguous
+            offset = 0
+        start = HEADER_SIZE + offset
+        self._set("<I", start, len(message))
+        self.map[start + 4:start + 4 + len(message)] = message
+        # the record has to be complete before the consumer can see it
+        self._set("<Q", _HEAD_OFFSET, head + record)
+
+        if self._get("<I", _WAITING_OFFSET) != 0:
+            self._set("<I", _WAITING_OFFSET, 0)
+            try:
+                self.bell.sendto(b"\0", self.doorbell())
+            except socket.error:
+                pass # consumer not running; it will check the ring on start
+        return True
+
+    def close(self):
+        '''
+        Detach from the ring.
+        '''
+        super(Producer, self).close()
+        self.bell.close()
+
+#-----------------------------------------------------------------------------
+
+class Consumer(_Ring):
+    '''
+    Reading end of the ring.
+    '''
+
+    # limit for a single :meth:`read` call, so other sources are not starved
+    READ_LIMIT = 1024
+
+    def __init__(self, path, doorbell, capacity = CAPACITY):
+        '''
+        :param path: path to the ring file
+        :param doorbell: path to the doorbell socket
+        :param capacity: size of the data area in bytes
+
+        Create the ring, or attach to an existing one if it has the same
+        capacity (so messages not consumed before restart are not lost).
+        Doorbell socket is not created.
+        '''
+        capacity = _align(capacity)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if not Consumer._valid(fd, capacity):
+                Consumer._initialize(fd, capacity)
+            super(Consumer, self).__init__(path, fd)
+        finally:
+            os.close(fd)
+        if not isinstance(doorbell, bytes):
+            doorbell = doorbell.encode("utf-8")
+        self._set("%ds" % (_DOORBELL_SIZE,), _DOORBELL_OFFSET, doorbell)
+
+    @staticmethod
+    def _valid(fd, capacity):
+        header = os.read(fd, _CAPACITY_OFFSET + 8)
+        if len(header) < _CAPACITY_OFFSET + 8 or not header.startswith(MAGIC):
+            return False
+        existing = struct.unpack_from("<Q", header, _CAPACITY_OFFSET)[0]
+        return (existing == capacity and
+                os.fstat(fd).st_size >= HEADER_SIZE + capacity)
+
+    @staticmethod
+    def _initialize(fd, capacity):
+        os.ftruncate(fd, 0)
+        os.ftruncate(fd, HEADER_SIZE + capacity)
+        header = MAGIC + struct.pack("<Q", capacity)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, header)
+
+    def pending(self):
+        '''
+        Check if there are unread messages in the ring.
+        '''
+        return (self._get("<Q", _HEAD_OFFSET) != self._get("<Q", _TAIL_OFFSET))
+
+    def read(self):
+        '''
+        :return: list of messages (byte strings)
+
+        Read messages from the ring. When there's nothing more to read,
+        consumer is marked as waiting for the doorbell.
+        '''
+        result = []
+        head = self._get("<Q", _HEAD_OFFSET)
+        tail = self._get("<Q", _TAIL_OFFSET)
+        while tail != head and len(result) < Consumer.READ_LIMIT:
+            offset = tail % self.capacity
+            length = self._get("<I", HEADER_SIZE + offset)
+            if length == _PAD:
+                tail += self.capacity - offset
+                continue
+            start = HEADER_SIZE + offset + 4
+            result.append(self.map[start:start + length])
+            tail += 4 + _align(length)
+        # free the space only after the messages were copied out
+        self._set("<Q", _TAIL_OFFSET, tail)
+        if tail == head:
+            self._set("<I", _WAITING_OFFSET, 1)
+        return result
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -2,13 +2,29 @@
 
 import socket
 import errno
+import collections
 import os
-import sha
+import hashlib
 import fcntl
+import gzip
+import time
+import logging
+
+from . import compat
+from . import poll
+from . import shmring
+from . import handoff
 
 #-----------------------------------------------------------------------------
 
 class Source(object):
+    # processing options for lines from this source (normalizer, what to do
+    # with unparsed lines, etc.); set by configuration loader
+    options = None
+    # address of the sender of the line last returned by try_readlines(),
+    # if the source knows it
+    peer = None
+
     def open(self):
         raise NotImplementedError()
 
@@ -27,6 +43,21 @@ class Source(object):
     def poll_makes_sense(self):
         return True
 
+    def pending(self):
+        # whether the source has lines to read even if its descriptor is not
+        # ready for reading
+        return False
+
+    def handoff(self):
+        # sockets to pass to a new process on restart, as a list of
+        # (socket, state) pairs (see handoff.py)
+        return []
+
+    def detach(self):
+        # close the source after handoff, leaving its sockets' addresses for
+        # the new process
+        self.close()
+
     def is_opened(self):
         return (self.fileno() is not None)
 
@@ -72,20 +103,20 @@ class FileHandleSource(Source):
 
         try:
             while True:
-                read = self.fh.read(1024)
-                if read == "": # EOF
+                read = os.read(self.fd, 1024)
+                if read == b"": # EOF
                     self.need_reopen = True
                     break # FIXME: what with `self.read_buffer'?
-                if "\n" in read:
-                    read = "".join(self.read_buffer) + read
+                if b"\n" in read:
+                    read = b"".join(self.read_buffer) + read
                     del self.read_buffer[:]
 
-                    lines = read.split("\n")
-                    if lines[-1] != "":
+                    lines = read.split(b"\n")
+                    if lines[-1] != b"":
                         self.read_buffer.append(lines[-1])
                     for line in lines[:-1]:
                         yield line
-        except IOError, e:
+        except (IOError, OSError) as e:
             if e.errno == errno.EWOULDBLOCK or e.errno == errno.EAGAIN:
                 pass # OK, just no more data to read at the moment
             else:
@@ -96,7 +127,170 @@ class FileHandleSource(Source):
 
 #-----------------------------------------------------------------------------
 
+class ArchiveReader:
+    '''
+    Sequential reader of a plain or gzip-compressed log file. Compressed
+    files are decompressed on the fly, without any temporary files.
+    '''
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, filename, fh = None):
+        '''
+        :param filename: name of the file to read
+        :param fh: already opened (uncompressed) file handle to read from
+          instead of opening *filename*
+        '''
+        self.filename = filename
+        if fh is not None:
+            self.raw_fh = fh
+            self.fh = fh
+        else:
+            self.raw_fh = open(filename, "rb", ArchiveReader.BUFFER_SIZE)
+            self.fh = self.raw_fh
+        if fh is None and filename.endswith(".gz"):
+            self.fh = gzip.GzipFile(fileobj = self.raw_fh, mode = "rb")
+        # position (in uncompressed data) right after the last returned line
+        self.pos = 0
+        self.read_buffer = b""
+        # complete lines read from the file, but not returned yet
+        self.lines = collections.deque()
+        self.eof = False
+
+    def is_compressed(self):
+        return (self.fh is not self.raw_fh)
+
+    def fileno(self):
+        return self.raw_fh.fileno()
+
+    def close(self):
+        if self.fh is not self.raw_fh:
+            self.fh.close()
+        self.raw_fh.close()
+
+    def read(self, size):
+        return self.fh.read(size)
+
+    def skip(self, count):
+        '''
+        Skip first *count* bytes of (uncompressed) data. Allowed only before
+        any line was read.
+        '''
+        if not self.is_compressed():
+            self.fh.seek(count)
+        else:
+            remaining = count
+            while remaining > 0:
+                chunk = self.fh.read(min(remaining, ArchiveReader.BUFFER_SIZE))
+                if chunk == b"":
+                    break
+                remaining -= len(chunk)
+            count -= remaining
+        self.pos = count
+
+    def readlines(self, limit = None):
+        '''
+        Read lines until EOF, or at most *limit* lines. Incomplete line at EOF
+        is kept for the next call, unless :meth:`finish` is called.
+        '''
+        count = 0
+        while True:
+            while len(self.lines) > 0:
+                if limit is not None and count >= limit:
+                    return
+                line = self.lines.popleft()
+                self.pos += len(line) + 1
+                count += 1
+                yield line
+            chunk = self.fh.read(ArchiveReader.BUFFER_SIZE)
+            if chunk == b"":
+                self.eof = True
+                return
+            self.eof = False
+            lines = (self.read_buffer + chunk).split(b"\n")
+            self.read_buffer = lines.pop()
+            self.lines.extend(lines)
+
+    def finish(self):
+        '''
+        Return the incomplete line from the end of the file, or ``None`` if
+        there's none.
+        '''
+        if self.read_buffer == b"":
+            return None
+        line = self.read_buffer
+        self.pos += len(line)
+        self.read_buffer = b""
+        return line
+
+#-----------------------------------------------------------------------------
+
+class ArchiveSource(Source):
+    '''
+    Log file (possibly gzip-compressed) read once, from the beginning to the
+    end. Position in the file is not remembered.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.reader = None
+        self.done = False
+
+    def open(self):
+        if self.done:
+            return
+        try:
+            self.reader = ArchiveReader(self.filename)
+        except (IOError, OSError):
+            self.done = True # no point in trying again
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def reopen(self):
+        self.close()
+        self.done = True
+
+    def reopen_necessary(self):
+        return self.done or (self.reader is not None and self.reader.eof)
+
+    def poll_makes_sense(self):
+        return False
+
+    def fileno(self):
+        if self.reader is None:
+            return None
+        return self.reader.fileno()
+
+    def try_readlines(self):
+        if self.reader is None:
+            return
+        for line in self.reader.readlines():
+            yield line
+        line = self.reader.finish()
+        if line is not None:
+            yield line
+
+    def __str__(self):
+        return "archive: %s" % (self.filename,)
+
+#-----------------------------------------------------------------------------
+
 class FileSource(Source):
+    # amount of data at the beginning of a file that identifies the file after
+    # it was compressed or copied by logrotate (shorter files are identified
+    # by what they have)
+    FINGERPRINT_SIZE = 256
+    # number of most recent rotated files to check for the predecessor
+    ROTATED_FILES_CHECKED = 4
+    # how long (in seconds) to keep reading a file that was just rotated,
+    # since writers may still have it opened
+    ROTATE_GRACE = 5.0
+    # lines read from a rotated file in a single call, so a large (or
+    # compressed) predecessor doesn't hold the main loop; the rest is
+    # reported by pending()
+    READ_LIMIT = 1024
+
     #------------------------------------------------------
     # PositionFile helper class {{{
 
@@ -104,7 +298,7 @@ class FileSource(Source):
         def __init__(self, filename):
             self.filename = filename
             # NOTE: do not truncate the file
-            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0666)
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o666)
             self.fh = os.fdopen(fd, 'r+')
 
         def read(self):
@@ -112,26 +306,41 @@ class FileSource(Source):
             stat_line = self.fh.readline()
             if stat_line != '' and stat_line.endswith("\n"):
                 # full line was read
+                fields = stat_line.split()
+                if len(fields) == 3:
+                    # position file from older version
+                    fields.append("-")
                 try:
-                    (dev, inode, pos) = stat_line.split()
+                    (dev, inode, pos, fingerprint) = fields
                     dev   = int(dev, 0)   # hex number
                     inode = int(inode, 0) # hex number
                     pos   = int(pos)      # dec number
+                    if fingerprint == "-":
+                        fingerprint = None
+                    elif ":" not in fingerprint:
+                        # older version only had full-size fingerprints
+                        fingerprint = "%d:%s" % (FileSource.FINGERPRINT_SIZE,
+                                                 fingerprint)
                 except ValueError:
                     # either unpack failed or one of the int() failed
                     dev   = None
                     inode = None
                     pos   = None
+                    fingerprint = None
             else:
                 # partial line or EOF means damaged status file
                 dev   = None
                 inode = None
                 pos   = None
-            return (dev, inode, pos)
+                fingerprint = None
+            return (dev, inode, pos, fingerprint)
 
-        def update(self, dev, inode, pos):
+        def update(self, dev, inode, pos, fingerprint = None):
+            if fingerprint is None:
+                fingerprint = "-"
             self.fh.seek(0)
-            self.fh.write("0x%08x 0x%08x %d\n" % (dev, inode, pos))
+            self.fh.write("0x%08x 0x%08x %d %s\n" %
+                          (dev, inode, pos, fingerprint))
             self.fh.truncate()
             self.fh.flush()
 
@@ -139,55 +348,124 @@ class FileSource(Source):
             self.fh.seek(0)
             self.fh.truncate()
 
+    # }}}
+    #------------------------------------------------------
+    # RotatedFile helper class {{{
+
+    class RotatedFile:
+        def __init__(self, reader, dev, inode, fingerprint, deadline = None):
+            self.reader = reader
+            # identity of the file before it was rotated
+            self.dev = dev
+            self.inode = inode
+            self.fingerprint = fingerprint
+            # until this time the file may still grow; None means the file is
+            # complete already
+            self.deadline = deadline
+            self.done = False
+
+        def readlines(self, limit = None):
+            if self.done:
+                return
+            for line in self.reader.readlines(limit):
+                yield line
+            if not self.reader.eof:
+                # limit reached
+                return
+            if self.deadline is not None and time.time() < self.deadline:
+                return
+            # nobody writes to the file anymore, so the last line is complete
+            line = self.reader.finish()
+            if line is not None:
+                yield line
+            self.done = True
+
+        def pending(self):
+            # whether there's more to read right away; a file that may still
+            # grow is not pending once its end was reached
+            return not self.done and not self.reader.eof
+
+        def position(self):
+            return (self.dev, self.inode, self.reader.pos, self.fingerprint)
+
+        def fileno(self):
+            return self.reader.fileno()
+
+        def close(self):
+            self.reader.close()
+
     # }}}
     #------------------------------------------------------
 
-    def __init__(self, filename, state_dir):
+    def __init__(self, filename, state_dir, rotate_grace = None):
         self.filename = filename
         self.fh = None
         self.dev = None
         self.inode = None
+        self.fingerprint = None
         self.read_buffer = None
+        # rotated predecessors of the file, to be read before the file itself
+        self.rotated = []
+        if rotate_grace is None:
+            self.rotate_grace = FileSource.ROTATE_GRACE
+        else:
+            self.rotate_grace = rotate_grace
 
         self.state_dir = state_dir
-        position_filename = "%s.pos" % (sha.sha(self.filename).hexdigest(),)
+        position_filename = "%s.pos" % (
+            hashlib.sha1(compat.to_bytes(self.filename)).hexdigest(),
+        )
         position_filename = os.path.join(self.state_dir, position_filename)
         self.position_file = FileSource.PositionFile(position_filename)
 
     def close(self):
-        if self.fh is not None:
+        if self.fh is not None or len(self.rotated) > 0:
             self._write_position()
+        if self.fh is not None:
             self.fh.close()
             self.fh = None
+        for rotated in self.rotated:
+            rotated.close()
+        del self.rotated[:]
 
     def __del__(self):
         self.close()
 
     def open(self):
         try:
-            self.fh = open(self.filename)
+            self.fh = open(self.filename, "rb")
         except (IOError, OSError):
             return
+        self.fingerprint = None
         self._rewind()
 
     def reopen(self):
-        # TODO: read until the EOF?
-        self.fh.close()
+        if self.fh is not None:
+            # the old file is kept opened and read to its end, along with the
+            # new file
+            self._drain_old_file()
         self.fh = None
+        self._forget_finished_rotated()
         self.dev = None
         self.inode = None
-        # NOTE: non-empty read_buffer from previous file causes wrong file
-        # position to be written to state file
-        self.read_buffer = None # TODO: or save it somewhere?
+        self.fingerprint = None
+        self.read_buffer = None
         try:
-            self.fh = open(self.filename)
+            self.fh = open(self.filename, "rb")
         except (IOError, OSError):
+            # with rotated files still being read the source is still opened
+            self._write_position()
             return
         (self.dev, self.inode, _size) = FileSource.stat(fh = self.fh)
         self._write_position()
 
     def reopen_necessary(self):
         (dev, inode, size) = FileSource.stat(path = self.filename)
+        if self.fh is None:
+            # only rotated files are read at the moment; reopen if the new
+            # file appeared or if there's nothing more to read
+            return (dev, inode) != (None, None) or \
+                   all(r.done for r in self.rotated)
         if (dev, inode) == (None, None) or size < self.fh.tell():
             # file has been removed (or truncated)
             self._file_removed()
@@ -201,31 +479,46 @@ class FileSource(Source):
         return False
 
     def fileno(self):
-        if self.fh is None:
-            return None
-        return self.fh.fileno()
+        if self.fh is not None:
+            return self.fh.fileno()
+        if len(self.rotated) > 0:
+            return self.rotated[0].fileno()
+        return None
+
+    def pending(self):
+        return any(r.pending() for r in self.rotated)
 
     def try_readlines(self):
+        # rotated files go first, as they hold older entries
+        for rotated in list(self.rotated):
+            for line in rotated.readlines(FileSource.READ_LIMIT):
+                yield line
+            if rotated.pending():
+                # the rest of it (and the newer files) in the next call
+                return
         if self.fh is None:
+            # NOTE: finished rotated files are removed in reopen(), so this
+            # source doesn't get closed behind the daemon's back
             return
+        self._forget_finished_rotated()
         while True:
             line = self.fh.readline()
-            if line.endswith("\n"):
+            if line.endswith(b"\n"):
                 # proper line with EOL marker
-                line = line.rstrip("\n")
+                line = line.rstrip(b"\n")
                 if self.read_buffer is not None:
                     yield self.read_buffer + line
                     self.read_buffer = None
                 else:
                     yield line
-            elif line != "":
+            elif line != b"":
                 # partial line, EOF must have been encountered
                 if self.read_buffer is not None:
                     self.read_buffer += line
                 else:
                     self.read_buffer = line
                 break
-            else: # line == ""
+            else: # line == b""
                 # EOF, no partial line read
                 break
 
@@ -237,13 +530,17 @@ class FileSource(Source):
 
     def _rewind(self):
         (self.dev, self.inode, size) = FileSource.stat(fh = self.fh)
-        (dev, inode, pos) = self.position_file.read()
+        (dev, inode, pos, fingerprint) = self.position_file.read()
         if (self.dev, self.inode) == (dev, inode) and pos <= size:
             self.fh.seek(pos)
+            self.fingerprint = fingerprint
         else:
             # either the position file is for other (possibly removed) logfile
             # or the logfile shrinked, meaning it was truncated or even
-            # removed and recreated
+            # removed and recreated; the old content could have been rotated,
+            # so it needs to be read before the current file
+            if dev is not None:
+                self._find_rotated(dev, inode, pos, fingerprint)
             self._write_position()
 
     def _file_removed(self):
@@ -252,12 +549,137 @@ class FileSource(Source):
         self.position_file.truncate()
 
     def _write_position(self):
+        if len(self.rotated) > 0:
+            # the oldest rotated file is still not read to the end, so its
+            # position is the one to remember
+            (dev, inode, pos, fingerprint) = self.rotated[0].position()
+            self.position_file.update(dev, inode, pos, fingerprint)
+            return
+        if self.fh is None:
+            return
         if self.read_buffer is None:
             pos = self.fh.tell()
         else:
             # incomplete line, so we'll take previous EOL position
             pos = self.fh.tell() - len(self.read_buffer)
-        self.position_file.update(self.dev, self.inode, pos)
+        if self.fingerprint is None:
+            self.fingerprint = FileSource.compute_fingerprint(self.fh)
+            self.fh.seek(pos + len(self.read_buffer or b""))
+        self.position_file.update(self.dev, self.inode, pos, self.fingerprint)
+
+    # }}}
+    #------------------------------------------------------
+    # reading rotated predecessor of the log file {{{
+
+    def _find_rotated(self, dev, inode, pos, fingerprint):
+        # rotated files are the ones with names like "daemon.log.1",
+        # "daemon.log.2.gz", or "daemon.log-20160318"
+        (directory, basename) = os.path.split(self.filename)
+        try:
+            names = [
+                os.path.join(directory, name)
+                for name in os.listdir(directory or ".")
+                if name.startswith(basename + ".") or
+                   name.startswith(basename + "-")
+            ]
+        except OSError:
+            return
+        candidates = []
+        for name in names:
+            try:
+                candidates.append((os.stat(name), name))
+            except OSError:
+                pass
+        # most recently modified first
+        candidates.sort(key = lambda c: -c[0].st_mtime)
+        del candidates[FileSource.ROTATED_FILES_CHECKED:]
+
+        for (stat, name) in candidates:
+            if ((stat.st_dev, stat.st_ino) == (dev, inode) and
+                stat.st_size >= pos) or \
+               (fingerprint is not None and
+                FileSource.file_fingerprint(name, fingerprint) == fingerprint):
+                try:
+                    reader = ArchiveReader(name)
+                except (IOError, OSError):
+                    continue
+                reader.skip(pos)
+                self.rotated.append(
+                    FileSource.RotatedFile(reader, dev, inode, fingerprint)
+                )
+                return
+
+    def _drain_old_file(self):
+        (dev, inode, size) = FileSource.stat(fh = self.fh)
+        if self.read_buffer is None:
+            pos = self.fh.tell()
+        else:
+            pos = self.fh.tell() - len(self.read_buffer)
+        if size < pos:
+            # the file was truncated, there's nothing left to read
+            self.fh.close()
+            return
+        fingerprint = self.fingerprint
+        if fingerprint is None:
+            fingerprint = FileSource.compute_fingerprint(self.fh)
+        # partial line will be read again
+        reader = ArchiveReader(self.filename, fh = self.fh)
+        reader.skip(pos)
+        deadline = time.time() + self.rotate_grace
+        self.rotated.append(
+            FileSource.RotatedFile(reader, dev, inode, fingerprint, deadline)
+        )
+
+    def _forget_finished_rotated(self):
+        finished = [r for r in self.rotated if r.done]
+        if len(finished) == 0:
+            return
+        for rotated in finished:
+            rotated.close()
+            self.rotated.remove(rotated)
+        self._write_position()
+
+    @staticmethod
+    def compute_fingerprint(fh):
+        '''
+        Compute fingerprint of a file's content from the beginning of the
+        file. Fingerprint of a file shorter than :attr:`FINGERPRINT_SIZE`
+        covers what the file has (and its length is part of the fingerprint),
+        so it stays valid when the file grows. For an empty file ``None`` is
+        returned. File position is changed.
+        '''
+        fh.seek(0)
+        return FileSource._fingerprint(fh.read(FileSource.FINGERPRINT_SIZE))
+
+    @staticmethod
+    def file_fingerprint(filename, like = None):
+        '''
+        Compute fingerprint of a (possibly compressed) file, over the same
+        amount of data as fingerprint *like* was computed.
+        '''
+        if like is not None:
+            size = int(like.split(":", 1)[0])
+        else:
+            size = FileSource.FINGERPRINT_SIZE
+        try:
+            reader = ArchiveReader(filename)
+        except (IOError, OSError):
+            return None
+        try:
+            data = reader.read(size)
+        except (IOError, OSError, EOFError):
+            # e.g. damaged gzip file
+            data = b""
+        reader.close()
+        if len(data) < size:
+            return None
+        return FileSource._fingerprint(data)
+
+    @staticmethod
+    def _fingerprint(data):
+        if len(data) == 0:
+            return None
+        return "%d:%s" % (len(data), hashlib.sha1(data).hexdigest())
 
     # }}}
     #------------------------------------------------------
@@ -286,6 +708,10 @@ class UDPSource(Source):
         self.socket = None
 
     def open(self):
+        self.socket = handoff.take_socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                          (self.host, self.port))
+        if self.socket is not None:
+            return
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             sock.bind((self.host, self.port))
@@ -293,6 +719,11 @@ class UDPSource(Source):
         except (IOError, OSError):
             pass
 
+    def handoff(self):
+        if self.socket is None:
+            return []
+        return [(self.socket, None)]
+
     def close(self):
         if self.socket is not None:
             self.socket.close()
@@ -309,9 +740,11 @@ class UDPSource(Source):
     def try_readlines(self):
         try:
             while True:
-                msg = self.socket.recv(4096, socket.MSG_DONTWAIT)
-                yield msg.rstrip("\n")
-        except socket.error, e:
+                (msg, address) = self.socket.recvfrom(4096,
+                                                      socket.MSG_DONTWAIT)
+                self.peer = address[0]
+                yield msg.rstrip(b"\n")
+        except socket.error as e:
             if e.errno == errno.EWOULDBLOCK or e.errno == errno.EAGAIN:
                 # this is expected when there's nothing in the socket queue
                 return
@@ -343,14 +776,29 @@ class UNIXSource(Source):
         self.close()
 
     def open(self):
+        self.socket = handoff.take_socket(socket.AF_UNIX, socket.SOCK_DGRAM,
+                                          self.path)
+        if self.socket is not None:
+            return
         try:
             sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
             sock.bind(self.path)
             self.socket = sock
-        except (IOError, OSError), e:
-            print str(e)
+        except (IOError, OSError) as e:
+            print(str(e))
             pass
 
+    def handoff(self):
+        if self.socket is None:
+            return []
+        return [(self.socket, None)]
+
+    def detach(self):
+        # the path now belongs to the new process
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
     def fileno(self):
         if self.socket is None:
             return None
@@ -360,8 +808,8 @@ class UNIXSource(Source):
         try:
             while True:
                 msg = self.socket.recv(4096, socket.MSG_DONTWAIT)
-                yield msg.rstrip("\n")
-        except socket.error, e:
+                yield msg.rstrip(b"\n")
+        except socket.error as e:
             if e.errno == errno.EWOULDBLOCK or e.errno == errno.EAGAIN:
                 # this is expected when there's nothing in the socket queue
                 return
@@ -371,5 +819,457 @@ class UNIXSource(Source):
     def __str__(self):
         return "UNIX: %s" % (self.path)
 
+#-----------------------------------------------------------------------------
+
+class ShmRingSource(Source):
+    # shared memory ring (see shmring.py); descriptor to poll is the doorbell
+    # socket
+    def __init__(self, path, doorbell = None, size = shmring.CAPACITY):
+        self.path = path
+        if doorbell is None:
+            doorbell = path + ".bell"
+        self.doorbell = doorbell
+        self.size = size
+        self.ring = None
+        self.socket = None
+        # open() is retried periodically; the same error is logged once
+        self.open_error = None
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+            os.unlink(self.doorbell)
+        if self.ring is not None:
+            # ring file stays, so messages written while logdevd is not
+            # running are not lost
+            self.ring.close()
+            self.ring = None
+
+    def __del__(self):
+        self.close()
+
+    def open(self):
+        sock = None
+        bound = False
+        try:
+            sock = handoff.take_socket(socket.AF_UNIX, socket.SOCK_DGRAM,
+                                       self.doorbell)
+            if sock is None:
+                if os.path.exists(self.doorbell):
+                    # stale socket from a crashed daemon
+                    os.unlink(self.doorbell)
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sock.bind(self.doorbell)
+            bound = True
+            sock.setblocking(0)
+            self.ring = shmring.Consumer(self.path, self.doorbell, self.size)
+        except (IOError, OSError, ValueError) as e:
+            if sock is not None:
+                sock.close()
+            if bound:
+                os.unlink(self.doorbell)
+            if str(e) != self.open_error:
+                self.open_error = str(e)
+                logger = logging.getLogger("sources")
+                logger.warning("can't open %s: %s", self, e)
+            return
+        self.socket = sock
+        self.open_error = None
+
+    def handoff(self):
+        if self.socket is None:
+            return []
+        return [(self.socket, None)]
+
+    def detach(self):
+        # the doorbell now belongs to the new process
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    def fileno(self):
+        if self.socket is None:
+            return None
+        return self.socket.fileno()
+
+    def pending(self):
+        return (self.ring is not None and self.ring.pending())
+
+    def try_readlines(self):
+        # doorbell rings only carry the wakeup
+        try:
+            while True:
+                self.socket.recv(64)
+        except socket.error as e:
+            if e.errno != errno.EWOULDBLOCK and e.errno != errno.EAGAIN:
+                raise
+        for msg in self.ring.read():
+            yield msg.rstrip(b"\n")
+
+    def __str__(self):
+        return "shm: %s" % (self.path)
+
+#-----------------------------------------------------------------------------
+
+class StreamSource(Source):
+    # RFC 6587: octet-counted framing ("<length> <message>"), non-transparent
+    # framing (one message per line), or auto-detection of the two, based on
+    # the first character of each message
+    FRAMINGS = ["auto", "octet-counted", "newline"]
+
+    #------------------------------------------------------
+    # Connection helper class {{{
+
+    class Connection:
+        # initial read buffer size; the buffer grows up to max message size
+        # (plus some room for length prefix) if messages need that
+        READ_SIZE = 4096
+        # number of reads from a single connection in a row, so one busy
+        # sender doesn't starve all the others
+        READS_IN_ROW = 16
+
+        def __init__(self, sock, framing, max_size):
+            sock.setblocking(False)
+            self.sock = sock
+            self.framing = framing
+            self.max_size = max_size
+            self.max_buffer = max_size + 32
+            # unprocessed data is kept in self.buffer[self.start:self.end];
+            # the buffer is reused for the whole connection lifetime
+            self.buffer = bytearray(min(self.READ_SIZE, self.max_buffer))
+            self.start = 0
+            self.end = 0
+            # remaining bytes of an oversized octet-counted message
+            self.skip = 0
+            # remaining part of an oversized newline-terminated message
+            self.skip_line = False
+            self.eof = False
+            try:
+                peer = sock.getpeername()
+            except socket.error:
+                peer = None
+            # IP address; unix socket peers are unnamed
+            if isinstance(peer, tuple):
+                self.peer = peer[0]
+            else:
+                self.peer = None
+
+        def fileno(self):
+            if self.sock is None:
+                return None
+            return self.sock.fileno()
+
+        def close(self):
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+        def state(self, listener):
+            # description of the connection for handing it over
+            return handoff.connection_state(
+                listener, bytes(self.buffer[self.start:self.end]),
+                skip = self.skip, skip_line = self.skip_line,
+            )
+
+        def restore(self, state):
+            # continue a connection taken over from the previous process
+            data = state["buffer"]
+            if len(data) > len(self.buffer):
+                self.buffer.extend(bytearray(len(data) - len(self.buffer)))
+            self.buffer[0:len(data)] = data
+            self.start = 0
+            self.end = len(data)
+            self.skip = state["skip"]
+            self.skip_line = state["skip_line"]
+
+        def readlines(self):
+            for i in range(self.READS_IN_ROW):
+                self._prepare_read()
+                view = memoryview(self.buffer)
+                try:
+                    read = self.sock.recv_into(view[self.end:])
+                except socket.error as e:
+                    if e.errno == errno.EWOULDBLOCK or e.errno == errno.EAGAIN:
+                        return # no more data at the moment
+                    read = 0 # treat broken connection as EOF
+                finally:
+                    del view # buffer can't be resized while a view exists
+
+                if read == 0: # EOF
+                    for msg in self._frames():
+                        yield msg
+                    if self.start < self.end and self.skip == 0 and \
+                       not self.skip_line:
+                        # last message without EOL marker (or an incomplete
+                        # octet-counted one)
+                        yield bytes(self.buffer[self.start:self.end]) \
+                            .rstrip(b"\n")
+                    self.eof = True
+                    return
+
+                self.end += read
+                try:
+                    for msg in self._frames():
+                        yield msg
+                except ValueError:
+                    # octet counting framing was required, but something else
+                    # was sent; there's no way to find next message boundary
+                    self.eof = True
+                    return
+
+        def _prepare_read(self):
+            if self.start == self.end:
+                self.start = self.end = 0
+            if self.end < len(self.buffer):
+                return
+            if self.start > 0:
+                # move the unprocessed data to the beginning of the buffer
+                length = self.end - self.start
+                self.buffer[0:length] = self.buffer[self.start:self.end]
+                self.start = 0
+                self.end = length
+            else:
+                size = min(len(self.buffer) * 2, self.max_buffer)
+                self.buffer.extend(bytearray(size - len(self.buffer)))
+
+        def _frames(self):
+            while self.start < self.end:
+                if self.skip > 0:
+                    skip = min(self.skip, self.end - self.start)
+                    self.start += skip
+                    self.skip -= skip
+                    continue
+                if self.skip_line:
+                    eol = self.buffer.find(b"\n", self.start, self.end)
+                    if eol < 0:
+                        self.start = self.end
+                    else:
+                        self.start = eol + 1
+                        self.skip_line = False
+                    continue
+
+                msg = None
+                if self.framing != "newline" and \
+                   0x30 <= self.buffer[self.start] <= 0x39: # "0" .. "9"
+                    msg = self._octet_counted_frame()
+                elif self.framing == "octet-counted":
+                    raise ValueError("not an octet-counted frame")
+                if msg is None:
+                    msg = self._newline_frame()
+                if msg is None or msg is False:
+                    break # incomplete message
+                yield msg
+
+        def _octet_counted_frame(self):
+            # returns message, False for incomplete message, or None if this
+            # is not an octet-counted frame (auto framing)
+            buf = self.buffer
+            header_end = min(self.end, self.start + 11)
+            space = buf.find(b" ", self.start, header_end)
+            if space < 0:
+                # anything but digits (e.g. newline in "123\n") ends the
+                # header without a space, so it's not worth waiting for more
+                if self.end - self.start <= 10 and \
+                   bytes(buf[self.start:header_end]).isdigit():
+                    return False
+                if self.framing == "auto":
+                    return None
+                raise ValueError("not an octet-counted frame")
+            length = bytes(buf[self.start:space])
+            if not length.isdigit():
+                if self.framing == "auto":
+                    return None
+                raise ValueError("not an octet-counted frame")
+            length = int(length)
+            msg_start = space + 1
+            # oversized message gets truncated, and the rest is skipped
+            msg_length = min(length, self.max_size)
+            if msg_start + msg_length > self.end:
+                return False
+            self.start = msg_start + msg_length
+            self.skip = length - msg_length
+            return bytes(buf[msg_start:self.start]).rstrip(b"\n")
+
+        def _newline_frame(self):
+            eol = self.buffer.find(b"\n", self.start, self.end)
+            if eol >= 0:
+                msg_end = min(eol, self.start + self.max_size)
+                msg = bytes(self.buffer[self.start:msg_end])
+                self.start = eol + 1
+                return msg
+            if self.end - self.start >= self.max_size:
+                # oversized message; truncate it and ignore the rest
+                msg_end = self.start + self.max_size
+                msg = bytes(self.buffer[self.start:msg_end])
+                self.start = msg_end
+                self.skip_line = True
+                return msg
+            return False
+
+    # }}}
+    #------------------------------------------------------
+
+    def __init__(self, framing = "auto", max_message_size = 65536):
+        if framing not in StreamSource.FRAMINGS:
+            raise ValueError("unrecognized framing: %s" % (framing,))
+        self.framing = framing
+        self.max_message_size = max_message_size
+        self.socket = None
+        self.epoll = None
+        self.connections = set()
+
+    def _listen_socket(self):
+        raise NotImplementedError()
+
+    def open(self):
+        try:
+            sock = self._listen_socket()
+        except (IOError, OSError):
+            return
+        sock.setblocking(False)
+        self.socket = sock
+        self.epoll = poll.EPoll([self.socket])
+        for (conn_sock, state) in handoff.take_connections(sock):
+            conn = StreamSource.Connection(
+                conn_sock, self.framing, self.max_message_size,
+            )
+            conn.restore(state)
+            self.connections.add(conn)
+            self.epoll.add(conn)
+
+    def handoff(self):
+        if self.socket is None:
+            return []
+        result = [(self.socket, None)]
+        for conn in self.connections:
+            result.append((conn.sock, conn.state(self.socket)))
+        return result
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.connections.clear()
+        if self.epoll is not None:
+            self.epoll.close()
+            self.epoll = None
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def __del__(self):
+        self.close()
+
+    def fileno(self):
+        if self.epoll is None:
+            return None
+        return self.epoll.fileno()
+
+    def try_readlines(self):
+        if self.epoll is None:
+            return
+        for handle in self.epoll.poll(0):
+            if handle is self.socket:
+                self._accept()
+                continue
+            self.peer = handle.peer
+            for msg in handle.readlines():
+                yield msg
+            if handle.eof:
+                self.epoll.remove(handle)
+                self.connections.discard(handle)
+                handle.close()
+
+    def _accept(self):
+        while True:
+            try:
+                (sock, addr) = self.socket.accept()
+            except socket.error as e:
+                if e.errno == errno.EWOULDBLOCK or e.errno == errno.EAGAIN:
+                    return
+                elif e.errno in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS,
+                                 errno.ENOMEM, errno.ECONNABORTED,
+                                 errno.EINTR, errno.EPROTO):
+                    # try again on next poll
+                    return
+                else:
+                    raise
+            conn = StreamSource.Connection(
+                sock, self.framing, self.max_message_size,
+            )
+            self.connections.add(conn)
+            self.epoll.add(conn)
+
+#-----------------------------------------------------------------------------
+
+class TCPSource(StreamSource):
+    def __init__(self, host, port, framing = "auto",
+                 max_message_size = 65536):
+        super(TCPSource, self).__init__(framing, max_message_size)
+        if host is None or host == "":
+            self.host = ""
+        else:
+            self.host = host
+        self.port = port
+
+    def _listen_socket(self):
+        sock = handoff.take_socket(socket.AF_INET, socket.SOCK_STREAM,
+                                   (self.host, self.port))
+        if sock is not None:
+            return sock
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.host, self.port))
+            sock.listen(socket.SOMAXCONN)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def __str__(self):
+        if self.host == "":
+            host = "*"
+        else:
+            host = self.host
+        return "TCP: %s:%d" % (host, self.port)
+
+#-----------------------------------------------------------------------------
+
+class UNIXStreamSource(StreamSource):
+    def __init__(self, path, framing = "auto", max_message_size = 65536):
+        super(UNIXStreamSource, self).__init__(framing, max_message_size)
+        self.path = path
+
+    def _listen_socket(self):
+        sock = handoff.take_socket(socket.AF_UNIX, socket.SOCK_STREAM,
+                                   self.path)
+        if sock is not None:
+            return sock
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self.path)
+            sock.listen(socket.SOMAXCONN)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def close(self):
+        opened = (self.socket is not None)
+        super(UNIXStreamSource, self).close()
+        if opened:
+            os.unlink(self.path)
+
+    def detach(self):
+        # the path now belongs to the new process
+        super(UNIXStreamSource, self).close()
+
+    def __str__(self):
+        return "UNIX stream: %s" % (self.path)
+
 #-----------------------------------------------------------------------------
 # vim:ft=python:foldmethod=marker
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+'''
+Daemon's statistics
+-------------------
+
+Counters and gauges describing daemon's work (e.g. number of suppressed
+lines, time it took to load a rulebase). All the parts of the daemon report
+to the single :obj:`registry`, and the daemon can dump it to logs.
+
+.. autoclass:: Stats
+   :members:
+
+'''
+#-----------------------------------------------------------------------------
+
+class Stats:
+    '''
+    Registry of named numeric values.
+    '''
+
+    def __init__(self):
+        self._values = {}
+
+    def incr(self, name, value = 1):
+        '''
+        :param name: name of the counter
+        :param value: value to add to the counter
+
+        Increment a counter.
+        '''
+        self._values[name] = self._values.get(name, 0) + value
+
+    def set(self, name, value):
+        '''
+        :param name: name of the gauge
+        :param value: new value
+
+        Set a gauge to a specific value.
+        '''
+        self._values[name] = value
+
+    def get(self, name, default = 0):
+        '''
+        :param name: name of the counter or gauge
+        :param default: value to return if the name was not set yet
+
+        Get current value of a counter or a gauge.
+        '''
+        return self._values.get(name, default)
+
+    def items(self):
+        '''
+        :return: list of ``(name, value)`` pairs, sorted by name
+        '''
+        return sorted(self._values.items())
+
+#-----------------------------------------------------------------------------
+
+registry = Stats()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
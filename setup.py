@@ -13,4 +13,10 @@ setup(
         "liblognorm",
         "yaml",
     ],
+    python_requires = ">=2.7",
+    classifiers = [
+        "Programming Language :: Python :: 2",
+        "Programming Language :: Python :: 2.7",
+        "Programming Language :: Python :: 3",
+    ],
 )
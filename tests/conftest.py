@@ -0,0 +1,14 @@
+#!/usr/bin/python
+#
+# tests run against the source tree (`make test' sets PYTHONPATH instead)
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)
+)), "pylib"))
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+
+import socket
+import sys
+import unittest
+
+from logdevd import poll
+
+if sys.version_info >= (3, 5):
+    from logdevd import aio
+
+#-----------------------------------------------------------------------------
+
+class SocketSource:
+    # the part of a source that the runtime uses
+    def __init__(self, sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def pending(self):
+        return False
+
+    def try_readlines(self):
+        data = self.sock.recv(4096)
+        if data == b"":
+            return None
+        return data.splitlines()
+
+class FakeDaemon:
+    def __init__(self, sources):
+        self.sources = sources
+        self.destinations = []
+        self.scheduler = None
+        self.unpollable_opened_sources = []
+        self.poll_h = poll.Poll(sources)
+        self.lines = []
+        self.flushed = False
+
+    def process(self, source):
+        lines = source.try_readlines()
+        if lines is None:
+            self.poll_h.remove(source)
+            return
+        self.lines.extend(lines)
+
+    def filecount(self):
+        return self.poll_h.count()
+
+    def reopen_sources_if_necessary(self):
+        pass
+
+    def flush_coalesced(self, force = False):
+        pass
+
+    def report_suppressed(self):
+        pass
+
+    def dispatch_queued(self, force = False):
+        pass
+
+    def flush_destinations(self, force = False):
+        pass
+
+    def close_destinations(self):
+        self.flushed = True
+
+#-----------------------------------------------------------------------------
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio runtime needs Python 3.5")
+class TestRuntime(unittest.TestCase):
+    def test_read_until_eof(self):
+        (ours, theirs) = socket.socketpair()
+        daemon = FakeDaemon([SocketSource(theirs)])
+        ours.sendall(b"foo\nbar\n")
+        ours.close()
+        aio.run(daemon, exit_on_eof = True)
+        theirs.close()
+        self.assertEqual(daemon.lines, [b"foo", b"bar"])
+        self.assertTrue(daemon.flushed)
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from logdevd import destinations
+from logdevd import stats
+
+#-----------------------------------------------------------------------------
+
+class TestUDPDestination(unittest.TestCase):
+    def setUp(self):
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(("127.0.0.1", 0))
+        self.port = self.receiver.getsockname()[1]
+
+    def tearDown(self):
+        self.receiver.close()
+
+    def receive_all(self):
+        self.receiver.settimeout(0.2)
+        result = []
+        try:
+            while True:
+                result.append(self.receiver.recv(4096))
+        except socket.timeout:
+            pass
+        return result
+
+    def test_packed(self):
+        dest = destinations.UDPDestination("127.0.0.1", self.port,
+                                           pack = {"size": 10})
+        for line in [b"foo", b"bar", b"0123456789"]:
+            dest.send(line)
+        dest.flush(force = True)
+        self.assertEqual(self.receive_all(), [b"foo\nbar\n", b"0123456789\n"])
+
+    def test_error_doesnt_lose_burst(self):
+        dest = destinations.UDPDestination("127.0.0.1", self.port,
+                                           pack = {"size": 10})
+        # leave ECONNREFUSED pending on the destination's socket
+        dest._send_packed([b"x"])
+        self.receiver.close()
+        dest._send_packed([b"y"])
+        time.sleep(0.1)
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(("127.0.0.1", self.port))
+        dest._send_packed([b"a", b"b", b"c"])
+        self.assertEqual(self.receive_all(), [b"a", b"b", b"c"])
+
+#-----------------------------------------------------------------------------
+
+class TestUNIXStreamDestination(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "sock")
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.listener.bind(self.path)
+        self.listener.listen(1)
+
+    def tearDown(self):
+        self.listener.close()
+        shutil.rmtree(self.dir)
+
+    def test_oversized_packet_is_dropped(self):
+        dest = destinations.UNIXStreamDestination(self.path, "seqpacket")
+        dropped = stats.registry.get(dest.stats_prefix + ".dropped")
+        dest.send(b"x" * (4 * 1024 * 1024))
+        dest.send(b"foo")
+        (peer, _address) = self.listener.accept()
+        peer.settimeout(1)
+        try:
+            self.assertEqual(peer.recv(4096), b"foo")
+        finally:
+            peer.close()
+            dest.close()
+        self.assertEqual(
+            stats.registry.get(dest.stats_prefix + ".dropped") - dropped, 1,
+        )
+
+#-----------------------------------------------------------------------------
+
+class TestTCPDestination(unittest.TestCase):
+    def setUp(self):
+        # a port that nothing listens on (yet)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_single_endpoint_down(self):
+        dest = destinations.TCPDestination([("127.0.0.1", self.port)])
+        start = time.time()
+        for i in range(10):
+            dest.send(b"line")
+            dest.flush()
+        self.assertLess(time.time() - start, 1.0)
+        (conn,) = dest.connections
+        self.assertIsNone(conn.ejected_until)
+        self.assertEqual(len(dest.backlog), 10)
+        # messages wait until the endpoint comes up
+        self.listener.listen(1)
+        deadline = time.time() + 2.0
+        while len(dest.backlog) > 0 and time.time() < deadline:
+            time.sleep(0.05)
+            dest.flush()
+        (peer, _address) = self.listener.accept()
+        dest.close()
+        data = b""
+        while True:
+            chunk = peer.recv(4096)
+            if chunk == b"":
+                break
+            data += chunk
+        peer.close()
+        self.assertEqual(data, b"line\n" * 10)
+
+    def test_drain_is_bounded(self):
+        dest = destinations.TCPDestination([("127.0.0.1", self.port)])
+        dropped = stats.registry.get(dest.stats_prefix + ".dropped")
+        for i in range(3):
+            dest.send(b"line")
+        (timeout, destinations.TCPDestination.DRAIN_TIMEOUT) = \
+            (destinations.TCPDestination.DRAIN_TIMEOUT, 0.3)
+        try:
+            start = time.time()
+            dest.flush(force = True)
+        finally:
+            destinations.TCPDestination.DRAIN_TIMEOUT = timeout
+            dest.close()
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(len(dest.backlog), 0)
+        self.assertEqual(
+            stats.registry.get(dest.stats_prefix + ".dropped") - dropped, 3,
+        )
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
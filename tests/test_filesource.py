@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from logdevd import sources
+
+#-----------------------------------------------------------------------------
+
+class TestFileSourceRotation(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix = "logdevd-test.")
+        self.log = os.path.join(self.dir, "daemon.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def append(self, filename, data):
+        with open(filename, "ab") as f:
+            f.write(data)
+
+    def read_lines(self):
+        source = sources.FileSource(self.log, self.dir)
+        source.open()
+        lines = list(source.try_readlines())
+        source.close()
+        return lines
+
+    def rotate_compressed(self):
+        # logrotate with "compress" and "nodelaycompress": the file gets
+        # a new inode, so only its content identifies it
+        with open(self.log, "rb") as src:
+            dest = gzip.open(self.log + ".1.gz", "wb")
+            dest.write(src.read())
+            dest.close()
+        os.unlink(self.log)
+
+    def test_restart_after_compressed_rotation(self):
+        self.append(self.log, b"x" * 300 + b"\n")
+        self.assertEqual(self.read_lines(), [b"x" * 300])
+        self.append(self.log, b"missed\n")
+        self.rotate_compressed()
+        self.append(self.log, b"new\n")
+        self.assertEqual(self.read_lines(), [b"missed", b"new"])
+
+    def test_restart_after_compressed_rotation_of_short_file(self):
+        self.append(self.log, b"first\n")
+        self.assertEqual(self.read_lines(), [b"first"])
+        self.append(self.log, b"missed\n")
+        self.rotate_compressed()
+        self.append(self.log, b"new\n")
+        self.assertEqual(self.read_lines(), [b"missed", b"new"])
+
+    def test_short_fingerprint_doesnt_match_other_file(self):
+        self.append(self.log, b"first\n")
+        self.assertEqual(self.read_lines(), [b"first"])
+        os.unlink(self.log)
+        self.append(self.log + ".1", b"other\n")
+        self.append(self.log, b"new\n")
+        self.assertEqual(self.read_lines(), [b"new"])
+
+    def test_large_predecessor_is_read_in_parts(self):
+        self.append(self.log, b"first\n")
+        self.assertEqual(self.read_lines(), [b"first"])
+        missed = [b"missed %d" % (i,) for i in range(2500)]
+        self.append(self.log, b"\n".join(missed) + b"\n")
+        self.rotate_compressed()
+        self.append(self.log, b"new\n")
+        source = sources.FileSource(self.log, self.dir)
+        source.open()
+        parts = [list(source.try_readlines())]
+        while source.pending():
+            parts.append(list(source.try_readlines()))
+        source.close()
+        self.assertEqual([len(p) for p in parts], [1024, 1024, 453])
+        self.assertEqual(sum(parts, []), missed + [b"new"])
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
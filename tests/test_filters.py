@@ -0,0 +1,48 @@
+#!/usr/bin/python
+
+import unittest
+
+from logdevd import filters
+
+#-----------------------------------------------------------------------------
+
+class TestFilterSet(unittest.TestCase):
+    def test_exclude_and_include(self):
+        fset = filters.FilterSet([
+            {"action": "include", "prefix": ["app", "web"]},
+            {"substring": "DEBUG"},
+        ])
+        self.assertTrue(fset.admit(b"app: started"))
+        self.assertFalse(fset.admit(b"app: DEBUG x=1"))
+        self.assertFalse(fset.admit(b"db: started"))
+
+    def test_named_backreference(self):
+        fset = filters.FilterSet([
+            {"regex": "(z)"},
+            {"regex": "(?P<c>x)(?P=c)", "name": "double"},
+        ])
+        self.assertFalse(fset.admit(b"xx"))
+        self.assertTrue(fset.admit(b"xy"))
+        self.assertEqual(fset.hits["double"], 1)
+
+    def test_numbered_backreference(self):
+        self.assertRaises(ValueError, filters.FilterSet,
+                          [{"regex": "(x)\\1"}])
+        self.assertRaises(ValueError, filters.FilterSet,
+                          [{"regex": "(z)"}, {"regex": "(x)\\1"}])
+        # escaped backslash followed by a digit is not a reference
+        fset = filters.FilterSet([{"regex": "a\\\\1"}])
+        self.assertFalse(fset.admit(b"a\\1"))
+
+    def test_invalid_regex(self):
+        self.assertRaises(ValueError, filters.FilterSet, [{"regex": "(x"}])
+        self.assertRaises(ValueError, filters.FilterSet,
+                          [{"regex": "(?P<a>x)"}, {"regex": "(?P<a>y)"}])
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,29 @@
+#!/usr/bin/python
+
+import unittest
+
+from logdevd import formats
+
+#-----------------------------------------------------------------------------
+
+class TestMsgpack(unittest.TestCase):
+    MESSAGE = {"program": "sshd"}
+    # fixmap of one pair, fixstr key and value
+    PACKED = b"\x81\xa7program\xa4sshd"
+
+    def test_builtin_encoder(self):
+        packed = b"".join(formats._msgpack_parts(TestMsgpack.MESSAGE))
+        self.assertEqual(packed, TestMsgpack.PACKED)
+
+    @unittest.skipIf(formats.msgpack is None, "msgpack module not installed")
+    def test_module_packs_strings_as_str(self):
+        self.assertEqual(formats.encode_msgpack(TestMsgpack.MESSAGE),
+                         TestMsgpack.PACKED)
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+import socket
+import unittest
+
+from logdevd import sources
+
+#-----------------------------------------------------------------------------
+
+def read_all(data, framing = "auto", max_size = 65536, chunks = None):
+    # feed data to a stream connection (in chunks, if specified) and return
+    # all the messages it produced, up to EOF
+    (ours, theirs) = socket.socketpair()
+    conn = sources.StreamSource.Connection(theirs, framing, max_size)
+    messages = []
+    try:
+        for chunk in (chunks or [data]):
+            ours.sendall(chunk)
+            messages.extend(conn.readlines())
+        ours.close()
+        while not conn.eof:
+            messages.extend(conn.readlines())
+    finally:
+        conn.close()
+    return messages
+
+#-----------------------------------------------------------------------------
+
+class TestNewlineFraming(unittest.TestCase):
+    def test_lines(self):
+        self.assertEqual(
+            read_all(b"foo\nbar baz\n", "newline"),
+            [b"foo", b"bar baz"],
+        )
+
+    def test_last_line_without_eol(self):
+        self.assertEqual(read_all(b"foo\nbar", "newline"), [b"foo", b"bar"])
+
+    def test_oversized_line(self):
+        self.assertEqual(
+            read_all(b"0123456789abc\nshort\n", "newline", max_size = 10),
+            [b"0123456789", b"short"],
+        )
+
+class TestOctetCountedFraming(unittest.TestCase):
+    def test_frames(self):
+        self.assertEqual(
+            read_all(b"3 foo7 bar baz", "octet-counted"),
+            [b"foo", b"bar baz"],
+        )
+
+    def test_frame_split_between_reads(self):
+        self.assertEqual(
+            read_all(None, "octet-counted",
+                     chunks = [b"1", b"1 hello", b" world"]),
+            [b"hello world"],
+        )
+
+    def test_oversized_frame(self):
+        self.assertEqual(
+            read_all(b"12 0123456789ab3 foo", "octet-counted", max_size = 10),
+            [b"0123456789", b"foo"],
+        )
+
+    def test_not_octet_counted(self):
+        self.assertEqual(read_all(b"foo bar\n", "octet-counted"), [])
+
+class TestAutoFraming(unittest.TestCase):
+    def test_mixed(self):
+        self.assertEqual(
+            read_all(b"3 foofoo bar\n3 baz"),
+            [b"foo", b"foo bar", b"baz"],
+        )
+
+    def test_line_starting_with_digits(self):
+        self.assertEqual(read_all(b"12ab cd\n"), [b"12ab cd"])
+
+    def test_incomplete_frame_at_eof(self):
+        self.assertEqual(read_all(b"2019 was a year\n"), [b"2019 was a year"])
+
+    def test_digits_only_line(self):
+        # newline ends the header, so "123" is not a length prefix
+        self.assertEqual(read_all(b"123\nfoo\n"), [b"123", b"foo"])
+
+    def test_digits_only_line_at_eof(self):
+        self.assertEqual(read_all(b"foo\n123\n"), [b"foo", b"123"])
+
+    def test_digits_only_line_is_not_held(self):
+        (ours, theirs) = socket.socketpair()
+        conn = sources.StreamSource.Connection(theirs, "auto", 65536)
+        try:
+            ours.sendall(b"123\n")
+            self.assertEqual(list(conn.readlines()), [b"123"])
+        finally:
+            conn.close()
+            ours.close()
+
+    def test_incomplete_length_is_held(self):
+        self.assertEqual(
+            read_all(None, chunks = [b"12", b"3 " + b"x" * 123]),
+            [b"x" * 123],
+        )
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from logdevd import handoff
+
+PYLIB = os.path.dirname(os.path.dirname(os.path.abspath(handoff.__file__)))
+
+#-----------------------------------------------------------------------------
+
+class TestSpawn(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.script = os.path.join(self.dir, "child")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def child(self, code):
+        with open(self.script, "w") as f:
+            f.write("#!%s\n" % (sys.executable,))
+            f.write("import sys\n")
+            f.write("sys.path.insert(0, %r)\n" % (PYLIB,))
+            f.write("import logdevd.handoff\n")
+            f.write(code)
+        os.chmod(self.script, 0o755)
+        return [self.script]
+
+    def test_ready(self):
+        argv = self.child("logdevd.handoff.notify_ready()\n")
+        self.assertTrue(handoff.spawn(argv, []))
+
+    def test_died(self):
+        argv = self.child("sys.exit(1)\n")
+        self.assertFalse(handoff.spawn(argv, []))
+
+    def test_slow_process_is_terminated(self):
+        marker = os.path.join(self.dir, "started")
+        argv = self.child(
+            "import time\n"
+            "open(%r, 'w').close()\n"
+            "time.sleep(2)\n"
+            "logdevd.handoff.notify_ready()\n"
+            "open(%r, 'w').close()\n" % (marker, marker + ".ready")
+        )
+        start = time.time()
+        self.assertFalse(handoff.spawn(argv, [], timeout = 0.5))
+        self.assertLess(time.time() - start, 2)
+        self.assertTrue(os.path.exists(marker))
+        time.sleep(2)
+        self.assertFalse(os.path.exists(marker + ".ready"))
+
+class TestNotifyReady(unittest.TestCase):
+    def test_abandoned(self):
+        (ready_r, ready_w) = os.pipe()
+        os.close(ready_r)
+        os.environ["LOGDEVD_HANDOFF_READY"] = str(ready_w)
+        self.assertFalse(handoff.notify_ready())
+        self.assertNotIn("LOGDEVD_HANDOFF_READY", os.environ)
+
+    def test_not_spawned(self):
+        os.environ.pop("LOGDEVD_HANDOFF_READY", None)
+        self.assertTrue(handoff.notify_ready())
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
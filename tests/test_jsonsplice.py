@@ -0,0 +1,40 @@
+#!/usr/bin/python
+
+import json
+import unittest
+
+from logdevd import jsonsplice
+
+#-----------------------------------------------------------------------------
+
+class TestSplicedMessage(unittest.TestCase):
+    def test_encode(self):
+        message = jsonsplice.SplicedMessage('{"a": 1} ', {"program": "b"})
+        self.assertEqual(json.loads(message.encode()),
+                         {"a": 1, "program": "b"})
+        self.assertEqual(message.expand(), {"a": 1, "program": "b"})
+
+    def test_empty_parts(self):
+        self.assertEqual(jsonsplice.SplicedMessage('{"a": 1}', {}).encode(),
+                         '{"a": 1}')
+        self.assertEqual(jsonsplice.SplicedMessage('{ }', {"b": 2}).encode(),
+                         '{"b": 2}')
+
+    def test_mentions_keys(self):
+        text = '{"program": "a", "x": 1}'
+        self.assertTrue(jsonsplice.mentions_keys(text, {"program": "b"}))
+        self.assertFalse(jsonsplice.mentions_keys(text, {"host": "b"}))
+        self.assertFalse(jsonsplice.mentions_keys(text, {}))
+
+    def test_is_json_hash(self):
+        self.assertTrue(jsonsplice.is_json_hash(' {"a": [1, {}]} '))
+        self.assertFalse(jsonsplice.is_json_hash('[1]'))
+        self.assertFalse(jsonsplice.is_json_hash('{"a": }'))
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
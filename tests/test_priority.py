@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import json
+import shutil
+import tempfile
+import unittest
+
+from logdevd import compat
+from logdevd import priority
+from logdevd import stats
+
+#-----------------------------------------------------------------------------
+
+class ListDestination:
+    format = "json"
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, line):
+        self.messages.append(json.loads(compat.to_str(line, "ascii"))["n"])
+
+#-----------------------------------------------------------------------------
+
+class TestScheduling(unittest.TestCase):
+    def test_weights(self):
+        dest = ListDestination()
+        scheduler = priority.Scheduler(
+            {"classes": {"heavy": {"weight": 2}, "light": {"weight": 1}},
+             "default": "light"},
+            [dest],
+        )
+        for i in range(4):
+            scheduler.put({"n": "light%d" % (i,)}, [dest])
+        for i in range(4):
+            scheduler.put({"n": "heavy%d" % (i,)}, [dest], "heavy")
+        scheduler.dispatch(force = True)
+        self.assertEqual(dest.messages, [
+            "heavy0", "heavy1", "light0",
+            "heavy2", "heavy3", "light1",
+            "light2", "light3",
+        ])
+        self.assertFalse(scheduler.pending())
+
+    def test_rules(self):
+        dest = ListDestination()
+        scheduler = priority.Scheduler(
+            {"classes": {"high": {"weight": 8}, "normal": {"weight": 1}},
+             "rules": [{"match": {"program": "sshd"}, "class": "high"}]},
+            [dest],
+        )
+        self.assertEqual(scheduler.classify({"program": "sshd"}), "high")
+        self.assertEqual(scheduler.classify({"program": "cron"}), "normal")
+        self.assertEqual(scheduler.classify({"program": "cron"}, "high"),
+                         "high")
+
+    def test_default_classes_block(self):
+        scheduler = priority.Scheduler({}, [])
+        self.assertEqual(
+            sorted(lane.overflow for lane in scheduler.order),
+            ["block", "block", "block"],
+        )
+
+#-----------------------------------------------------------------------------
+
+class TestOverflow(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dest = ListDestination()
+        self.scheduler = None
+
+    def tearDown(self):
+        if self.scheduler is not None:
+            self.scheduler.close()
+        shutil.rmtree(self.dir)
+
+    def fill(self, overflow, count):
+        # zero slice: destinations get no time to make room in the queue
+        self.scheduler = priority.Scheduler(
+            {"classes": {"normal": {"queue_size": 2, "overflow": overflow}},
+             "slice": 0},
+            [self.dest], self.dir,
+        )
+        self.dropped = stats.registry.get("priority.normal.dropped")
+        for i in range(count):
+            self.scheduler.put({"n": i}, [self.dest])
+
+    def dropped_count(self):
+        return stats.registry.get("priority.normal.dropped") - self.dropped
+
+    def sent_after_dispatch(self):
+        self.scheduler.dispatch(force = True)
+        return self.dest.messages
+
+    def test_drop_new(self):
+        self.fill("drop-new", 4)
+        self.assertEqual(self.sent_after_dispatch(), [0, 1])
+        self.assertEqual(self.dropped_count(), 2)
+
+    def test_drop_old(self):
+        self.fill("drop-old", 4)
+        self.assertEqual(self.sent_after_dispatch(), [2, 3])
+        self.assertEqual(self.dropped_count(), 2)
+
+    def test_block(self):
+        self.fill("block", 4)
+        # the oldest messages were sent to make room
+        self.assertEqual(self.dest.messages, [0, 1])
+        self.assertEqual(self.sent_after_dispatch(), [0, 1, 2, 3])
+        self.assertEqual(self.dropped_count(), 0)
+
+    def test_spool(self):
+        self.fill("spool", 5)
+        self.assertEqual(self.scheduler.lanes["normal"].spool.count, 3)
+        self.assertEqual(self.sent_after_dispatch(), [0, 1, 2, 3, 4])
+        self.assertEqual(self.dropped_count(), 0)
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from logdevd import shmring
+from logdevd import sources
+
+#-----------------------------------------------------------------------------
+
+class TestRing(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "ring")
+        self.doorbell = os.path.join(self.dir, "doorbell")
+        self.rings = []
+
+    def tearDown(self):
+        for ring in self.rings:
+            ring.close()
+        shutil.rmtree(self.dir)
+
+    def open(self, capacity = 64):
+        consumer = shmring.Consumer(self.path, self.doorbell, capacity)
+        producer = shmring.Producer(self.path)
+        self.rings.extend([consumer, producer])
+        return (consumer, producer)
+
+    def test_full(self):
+        (consumer, producer) = self.open()
+        # 16 bytes per record
+        for i in range(4):
+            self.assertTrue(producer.send(b"message %02d" % (i,)))
+        self.assertFalse(producer.send(b"message 04"))
+        self.assertEqual(consumer.read()[0], b"message 00")
+        self.assertTrue(producer.send(b"message 04"))
+
+    def test_padding_at_wraparound(self):
+        (consumer, producer) = self.open()
+        # 20 bytes per record, so the fourth one doesn't fit at the end
+        messages = [b"message %05d" % (i,) for i in range(4)]
+        for m in messages[:3]:
+            self.assertTrue(producer.send(m))
+        self.assertEqual(consumer.read(), messages[:3])
+        self.assertTrue(producer.send(messages[3]))
+        self.assertEqual(consumer.read(), messages[3:])
+        self.assertFalse(consumer.pending())
+
+    def test_order_over_many_wraparounds(self):
+        (consumer, producer) = self.open()
+        sent = [b"x" * (i % 13) + b"%d" % (i,) for i in range(500)]
+        received = []
+        for m in sent:
+            while not producer.send(m):
+                received.extend(consumer.read())
+        received.extend(consumer.read())
+        self.assertEqual(received, sent)
+
+    def test_doorbell(self):
+        bell = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        bell.bind(self.doorbell)
+        bell.settimeout(1)
+        try:
+            (consumer, producer) = self.open()
+            # consumer that found the ring empty waits for the doorbell
+            self.assertEqual(consumer.read(), [])
+            producer.send(b"foo")
+            self.assertEqual(bell.recv(16), b"\0")
+            # consumer that didn't catch up yet is not woken up again
+            producer.send(b"bar")
+            bell.settimeout(0)
+            self.assertRaises(socket.error, bell.recv, 16)
+            self.assertEqual(consumer.read(), [b"foo", b"bar"])
+        finally:
+            bell.close()
+
+    def test_reattach_keeps_messages(self):
+        (consumer, producer) = self.open()
+        producer.send(b"foo")
+        consumer.close()
+        consumer = shmring.Consumer(self.path, self.doorbell, 64)
+        self.rings.append(consumer)
+        self.assertEqual(consumer.read(), [b"foo"])
+
+#-----------------------------------------------------------------------------
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class TestShmRingSource(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.handler = ListHandler()
+        logging.getLogger("sources").addHandler(self.handler)
+
+    def tearDown(self):
+        logging.getLogger("sources").removeHandler(self.handler)
+        shutil.rmtree(self.dir)
+
+    def test_open_error(self):
+        # ring path is a directory, so the ring can't be created
+        doorbell = os.path.join(self.dir, "doorbell")
+        source = sources.ShmRingSource(self.dir, doorbell)
+        source.open()
+        source.open()
+        self.assertFalse(source.is_opened())
+        self.assertFalse(os.path.exists(doorbell))
+        self.assertEqual(len(self.handler.messages), 1)
+
+    def test_open(self):
+        path = os.path.join(self.dir, "ring")
+        source = sources.ShmRingSource(path)
+        source.open()
+        try:
+            self.assertTrue(source.is_opened())
+            producer = shmring.Producer(path)
+            producer.send(b"foo\n")
+            producer.close()
+            self.assertTrue(source.pending())
+            self.assertEqual(list(source.try_readlines()), [b"foo"])
+        finally:
+            source.close()
+        self.assertFalse(os.path.exists(path + ".bell"))
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
+
+#-----------------------------------------------------------------------------
+# vim:ft=python
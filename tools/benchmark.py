@@ -0,0 +1,167 @@
+#!/usr/bin/python
+'''
+Throughput benchmark: runs ``logdevd --ingest`` from this source tree over
+a generated log file under each of the specified interpreters and reports
+lines per second. Messages are written to a temporary file through a file
+destination, so the figures cover the whole read-normalize-encode-write
+path. Time of an empty run (interpreter start, loading the configuration) is
+subtracted.
+
+   tools/benchmark.py -p python2 -p python3 -f raw
+   tools/benchmark.py -p python2 -p python3 -r syslog.rules.example
+'''
+#-----------------------------------------------------------------------------
+
+import sys
+import os
+import time
+import json
+import shutil
+import optparse
+import tempfile
+import subprocess
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOGDEVD = os.path.join(TOP_DIR, "bin", "logdevd")
+PYLIB = os.path.join(TOP_DIR, "pylib")
+
+PROGRAMS = ["sshd", "CRON", "kernel", "postfix/smtpd", "dhcpd", "snmpd"]
+
+LOGGING_CONFIG = {
+    "version": 1,
+    "root": { "level": "NOTSET", "handlers": ["sink"] },
+    "handlers": {
+        "sink": { "class": "logdevd.logging_handlers.NullHandler" },
+    },
+}
+
+#-----------------------------------------------------------------------------
+
+parser = optparse.OptionParser(
+    usage = "%prog [options]"
+)
+parser.add_option(
+    "-p", "--python", dest = "interpreters",
+    action = "append", default = [],
+    help = "interpreter to benchmark (can be specified multiple times;"
+           " defaults to the one running this script)", metavar = "PATH",
+)
+parser.add_option(
+    "-n", "--lines", dest = "lines",
+    type = "int", default = 200000,
+    help = "number of log lines to process", metavar = "N",
+)
+parser.add_option(
+    "-f", "--format", dest = "format",
+    default = None,
+    help = "source format: lognorm (default with --rulebase), json, or raw"
+           " (default otherwise)", metavar = "FORMAT",
+)
+parser.add_option(
+    "-r", "--rulebase", dest = "rulebase",
+    default = None,
+    help = "rulebase for lognorm format", metavar = "FILE",
+)
+parser.add_option(
+    "-o", "--output-format", dest = "output_format",
+    default = "json",
+    help = "destination format (json or msgpack)", metavar = "FORMAT",
+)
+parser.add_option(
+    "-R", "--repeat", dest = "repeat",
+    type = "int", default = 3,
+    help = "number of runs per interpreter (the best one is reported)",
+    metavar = "N",
+)
+
+(options, args) = parser.parse_args()
+
+if options.format is None:
+    options.format = "lognorm" if options.rulebase is not None else "raw"
+if options.format == "lognorm" and options.rulebase is None:
+    parser.error("lognorm format requires --rulebase")
+if len(options.interpreters) == 0:
+    options.interpreters = [sys.executable]
+
+#-----------------------------------------------------------------------------
+
+def log_line(i):
+    program = PROGRAMS[i % len(PROGRAMS)]
+    if options.format == "json":
+        return json.dumps({
+            "program": program, "pid": i,
+            "message": "request %d served in %d ms" % (i, i % 997),
+        })
+    return "Oct 19 12:%02d:%02d host%d %s[%d]: request %d served in %d ms" % (
+        (i // 60) % 60, i % 60, i % 4, program, i, i, i % 997,
+    )
+
+def prepare(work_dir):
+    lines_file = os.path.join(work_dir, "input.log")
+    with open(lines_file, "w") as f:
+        for i in range(options.lines):
+            f.write(log_line(i) + "\n")
+    empty_file = os.path.join(work_dir, "empty.log")
+    open(empty_file, "w").close()
+
+    config = {
+        "sources": [],
+        "destinations": [{
+            "proto": "file", "path": os.path.join(work_dir, "output.log"),
+            "format": options.output_format, "fsync_interval": None,
+        }],
+        "options": { "format": options.format },
+    }
+    if options.rulebase is not None:
+        config["options"]["rulebase"] = os.path.abspath(options.rulebase)
+    config_file = os.path.join(work_dir, "logdevourer.conf")
+    with open(config_file, "w") as f:
+        json.dump(config, f) # JSON is valid YAML
+    logging_file = os.path.join(work_dir, "logging.conf")
+    with open(logging_file, "w") as f:
+        json.dump(LOGGING_CONFIG, f)
+    return (lines_file, empty_file, config_file, logging_file)
+
+def run(interpreter, input_file, config_file, logging_file, state_dir):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [PYLIB] + [p for p in [os.environ.get("PYTHONPATH")] if p]
+    )
+    command = [
+        interpreter, LOGDEVD, "--config", config_file,
+        "--logging", logging_file, "--state-dir", state_dir,
+        "--ingest", input_file,
+    ]
+    output_file = os.path.join(state_dir, "output.log")
+    if os.path.exists(output_file):
+        os.unlink(output_file)
+    start = time.time()
+    subprocess.check_call(command, env = env)
+    return time.time() - start
+
+#-----------------------------------------------------------------------------
+
+work_dir = tempfile.mkdtemp(prefix = "logdevd-bench.")
+try:
+    (lines_file, empty_file, config_file, logging_file) = prepare(work_dir)
+    sys.stdout.write("%d lines, %s format, %s output\n" % (
+        options.lines, options.format, options.output_format,
+    ))
+    for interpreter in options.interpreters:
+        startup = min(
+            run(interpreter, empty_file, config_file, logging_file, work_dir)
+            for i in range(options.repeat)
+        )
+        total = min(
+            run(interpreter, lines_file, config_file, logging_file, work_dir)
+            for i in range(options.repeat)
+        )
+        elapsed = max(total - startup, 1e-6)
+        sys.stdout.write("%-30s %10.0f lines/s (%.2fs + %.2fs startup)\n" % (
+            interpreter, options.lines / elapsed, elapsed, startup,
+        ))
+finally:
+    shutil.rmtree(work_dir, ignore_errors = True)
+
+#-----------------------------------------------------------------------------
+# vim:ft=python